@@ -0,0 +1,32 @@
+"""Add links.track_clicks
+
+Revision ID: c5d2e8f1a7b3
+Revises: b93060f540cf
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d2e8f1a7b3'
+down_revision: Union[str, None] = 'b93060f540cf'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Значение по умолчанию на стороне БД: существующие ссылки продолжают учитывать переходы
+    op.add_column(
+        'links',
+        sa.Column('track_clicks', sa.Boolean(), server_default=sa.true(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('links', 'track_clicks')
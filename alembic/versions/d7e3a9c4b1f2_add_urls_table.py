@@ -0,0 +1,110 @@
+"""Add urls table and backfill links/link_history url_id
+
+Revision ID: d7e3a9c4b1f2
+Revises: c5d2e8f1a7b3
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+import logging
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.urls import TABLE_SIZES, format_sizes, url_id_for
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7e3a9c4b1f2'
+down_revision: Union[str, None] = 'c5d2e8f1a7b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+# Строк на одну транзакцию переноса: блокировки держатся только на пачку
+BATCH_SIZE = int(os.getenv("URLS_BACKFILL_BATCH", "10000"))
+
+INSERT_URLS = sa.text(
+    "INSERT INTO urls (id, url) SELECT * FROM unnest(CAST(:ids AS bigint[]), CAST(:urls AS varchar[])) "
+    "ON CONFLICT (id) DO NOTHING"
+)
+
+
+def backfill(table: str, key: str, key_type: str) -> int:
+    """Заполняет urls и url_id строк table пачками по BATCH_SIZE, каждая в своей транзакции.
+
+    original_url остаётся заполненным: экземпляры приложения без поддержки
+    url_id продолжают читать адрес из строки. Очищает его отдельная команда
+    python -m app.urls clear-original. Строка с адресом, чей url_id уже занят
+    другим адресом (коллизия хеша), остаётся без url_id.
+    """
+    bind = op.get_bind()
+    select_batch = sa.text(
+        f"SELECT {key}, original_url FROM {table} "
+        f"WHERE url_id IS NULL AND original_url IS NOT NULL AND {key} > :last ORDER BY {key} LIMIT :limit"
+    )
+    update_batch = sa.text(
+        f"UPDATE {table} SET url_id = batch.url_id "
+        f"FROM unnest(CAST(:keys AS {key_type}[]), CAST(:ids AS bigint[])) AS batch(key, url_id) "
+        f"JOIN urls ON urls.id = batch.url_id "
+        f"WHERE {table}.{key} = batch.key AND urls.url = {table}.original_url"
+    )
+    # Пустая строка и нулевой UUID меньше любого ключа
+    last = "" if key_type == "varchar" else "00000000-0000-0000-0000-000000000000"
+    moved = 0
+    while True:
+        rows = bind.execute(select_batch, {"last": last, "limit": BATCH_SIZE}).all()
+        if not rows:
+            return moved
+        keys = [str(row[0]) for row in rows]
+        ids = [url_id_for(row[1]) for row in rows]
+        bind.execute(INSERT_URLS, {"ids": ids, "urls": [row[1] for row in rows]})
+        bind.execute(update_batch, {"keys": keys, "ids": ids})
+        moved += len(rows)
+        last = keys[-1]
+        logger.info(f"{table}: {moved} rows linked to urls")
+
+
+def log_sizes(stage: str):
+    logger.info(f"Table sizes {stage}:\n{format_sizes(op.get_bind().execute(TABLE_SIZES).all())}")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('urls',
+    sa.Column('id', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('url', sa.String(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    for table in ('links', 'link_history'):
+        op.add_column(table, sa.Column('url_id', sa.BigInteger(), nullable=True))
+        op.create_foreign_key(f'{table}_url_id_fkey', table, 'urls', ['url_id'], ['id'])
+        op.alter_column(table, 'original_url', existing_type=sa.String(), nullable=True)
+    op.create_index(op.f('ix_links_url_id'), 'links', ['url_id'], unique=False)
+
+    # Перенос идёт вне транзакции миграции: приложение продолжает работать,
+    # а прерванный перенос при повторном запуске продолжается с оставшихся строк
+    with op.get_context().autocommit_block():
+        log_sizes("before backfill")
+        backfill('links', 'short_code', 'varchar')
+        backfill('link_history', 'id', 'uuid')
+        op.execute('VACUUM ANALYZE links')
+        op.execute('VACUUM ANALYZE link_history')
+        log_sizes("after backfill")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('links', 'link_history'):
+        op.execute(
+            f"UPDATE {table} SET original_url = urls.url FROM urls "
+            f"WHERE {table}.url_id = urls.id AND {table}.original_url IS NULL"
+        )
+        op.alter_column(table, 'original_url', existing_type=sa.String(), nullable=False)
+        op.drop_constraint(f'{table}_url_id_fkey', table, type_='foreignkey')
+    op.drop_index(op.f('ix_links_url_id'), table_name='links')
+    for table in ('links', 'link_history'):
+        op.drop_column(table, 'url_id')
+    op.drop_table('urls')
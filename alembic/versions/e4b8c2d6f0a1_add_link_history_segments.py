@@ -0,0 +1,42 @@
+"""Add link_history_segments
+
+Revision ID: e4b8c2d6f0a1
+Revises: d7e3a9c4b1f2
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b8c2d6f0a1'
+down_revision: Union[str, None] = 'd7e3a9c4b1f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('link_history_segments',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('month', sa.String(length=7), nullable=False),
+    sa.Column('bucket', sa.Integer(), nullable=False),
+    sa.Column('buckets', sa.Integer(), nullable=False),
+    sa.Column('path', sa.String(), nullable=False),
+    sa.Column('rows', sa.Integer(), nullable=False),
+    sa.Column('size_bytes', sa.BigInteger(), nullable=False),
+    sa.Column('min_expires_at', sa.DateTime(), nullable=False),
+    sa.Column('max_expires_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('month', 'bucket', 'buckets')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Сегменты перед откатом нужно вернуть в link_history: python -m app.coldstore restore
+    op.drop_table('link_history_segments')
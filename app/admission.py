@@ -0,0 +1,201 @@
+import asyncio
+import json
+from collections import OrderedDict
+from app.fastpath import redirect_short_code
+from app.metrics import CallbackMetric
+from config import (
+    ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_READ_LIMIT,
+    ADMISSION_READ_QUEUE,
+    ADMISSION_READ_TIMEOUT,
+    ADMISSION_REDIRECT_LIMIT,
+    ADMISSION_REDIRECT_QUEUE,
+    ADMISSION_REDIRECT_TIMEOUT,
+    ADMISSION_WRITE_LIMIT,
+    ADMISSION_WRITE_QUEUE,
+    ADMISSION_WRITE_TIMEOUT,
+)
+
+REDIRECT = "redirect"
+READ = "read"
+WRITE = "write"
+
+# Служебные пути должны отвечать и под перегрузкой. Выгрузка может идти минуты и
+# не должна занимать место чтений: её ограничивает EXPORT_MAX_CONCURRENCY
+BYPASS_PREFIXES = ("/internal", "/metrics", "/links/export")
+
+
+class RouteClass:
+    def __init__(self, name: str, priority: int, limit: int, queue_size: int, timeout: float):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.admitted = 0
+        self.shed = 0
+        # Ожидающие в порядке прихода; ушедшие по таймауту или отмене удаляются сразу
+        self.waiters = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        return len(self.waiters)
+
+    def status(self) -> dict:
+        return {
+            "priority": self.priority,
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+
+class AdmissionController:
+    """Ограничивает число одновременных запросов каждого класса и всех вместе.
+
+    Освободившееся место получает ожидающий запрос с наименьшим priority
+    (редиректы раньше чтений, чтения раньше записей). Новый запрос уступает
+    только тем ожидающим своего или более приоритетного класса, которые могли бы
+    занять место прямо сейчас: класс, упёршийся в свой лимит, никого не держит.
+    Если очередь класса заполнена или место не освободилось за timeout, запрос
+    отклоняется.
+    """
+
+    def __init__(self, classes, total_limit: int):
+        self.classes = {route_class.name: route_class for route_class in classes}
+        self.total_limit = total_limit
+        self.active = 0
+        self._by_priority = sorted(self.classes.values(), key=lambda route_class: route_class.priority)
+
+    def _can_run(self, route_class: RouteClass) -> bool:
+        return route_class.active < route_class.limit and self.active < self.total_limit
+
+    def _yields_to_waiters(self, route_class: RouteClass) -> bool:
+        return any(
+            other.waiters and other.active < other.limit
+            for other in self._by_priority
+            if other.priority <= route_class.priority
+        )
+
+    def _grant(self, route_class: RouteClass):
+        route_class.active += 1
+        route_class.admitted += 1
+        self.active += 1
+
+    async def acquire(self, route_class: RouteClass) -> bool:
+        if self._can_run(route_class) and not self._yields_to_waiters(route_class):
+            self._grant(route_class)
+            return True
+        if route_class.queued >= route_class.queue_size:
+            route_class.shed += 1
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        route_class.waiters[future] = None
+        try:
+            await asyncio.wait_for(future, route_class.timeout)
+            return True
+        except asyncio.TimeoutError:
+            route_class.shed += 1
+            return False
+        except asyncio.CancelledError:
+            # Клиент ушёл уже после того, как место было выделено
+            if future.done() and not future.cancelled():
+                self.release(route_class)
+            raise
+        finally:
+            route_class.waiters.pop(future, None)
+
+    def release(self, route_class: RouteClass):
+        route_class.active -= 1
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        for route_class in self._by_priority:
+            # Класс, упёршийся в свой лимит, пропускается: место может занять класс ниже
+            while route_class.waiters and self._can_run(route_class):
+                future, _ = route_class.waiters.popitem(last=False)
+                if future.done():
+                    continue
+                self._grant(route_class)
+                future.set_result(True)
+            if self.active >= self.total_limit:
+                return
+
+    def status(self) -> dict:
+        return {
+            "total_limit": self.total_limit,
+            "active": self.active,
+            "classes": {name: route_class.status() for name, route_class in self.classes.items()},
+        }
+
+
+def classify(scope) -> str:
+    if scope["path"].startswith(BYPASS_PREFIXES):
+        return None
+    if redirect_short_code(scope):
+        return REDIRECT
+    if scope["method"] in ("GET", "HEAD"):
+        return READ
+    return WRITE
+
+
+OVERLOADED_BODY = json.dumps({"detail": "Server is overloaded, retry later"}).encode()
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        class_name = classify(scope)
+        route_class = self.controller.classes.get(class_name)
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.controller.acquire(route_class):
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", b"1"),
+                    (b"content-length", str(len(OVERLOADED_BODY)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": OVERLOADED_BODY})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route_class)
+
+
+admission_controller = AdmissionController(
+    [
+        RouteClass(REDIRECT, 0, ADMISSION_REDIRECT_LIMIT, ADMISSION_REDIRECT_QUEUE, ADMISSION_REDIRECT_TIMEOUT),
+        RouteClass(READ, 1, ADMISSION_READ_LIMIT, ADMISSION_READ_QUEUE, ADMISSION_READ_TIMEOUT),
+        RouteClass(WRITE, 2, ADMISSION_WRITE_LIMIT, ADMISSION_WRITE_QUEUE, ADMISSION_WRITE_TIMEOUT),
+    ],
+    total_limit=ADMISSION_MAX_CONCURRENCY,
+)
+
+
+def _admission_collector(field: str):
+    return lambda: [((name,), getattr(route_class, field)) for name, route_class in admission_controller.classes.items()]
+
+
+CallbackMetric("admission_active", "Requests being processed by class", "gauge", ("class",), _admission_collector("active"))
+CallbackMetric("admission_queued", "Requests waiting for admission by class", "gauge", ("class",), _admission_collector("queued"))
+CallbackMetric("admission_admitted_total", "Admitted requests by class", "counter", ("class",), _admission_collector("admitted"))
+CallbackMetric("admission_shed_total", "Requests rejected with 503 by class", "counter", ("class",), _admission_collector("shed"))
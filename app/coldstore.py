@@ -0,0 +1,569 @@
+"""Холодное хранилище старой истории ссылок.
+
+Строки link_history, истёкшие раньше чем COLD_AFTER_DAYS дней назад, переносятся
+в сжатые файлы-сегменты в COLD_STORAGE_DIR: один файл на месяц истечения и
+корзину пользователей (COLD_USER_BUCKETS). Таблица link_history_segments той же
+БД хранит, какие сегменты есть. GET /links/expired дочитывает строки
+пользователя из сегментов его корзины.
+
+Формат сегмента:
+
+    MAGIC | длина заголовка (uint32) | заголовок JSON | user_id строк | группы строк
+
+Строки отсортированы по user_id. Колонка user_id (по 16 байт) не сжата: строки
+пользователя находятся двоичным поиском прямо по отображённому в память файлу.
+Остальные колонки хранятся группами по GROUP_ROWS строк, и каждая колонка группы
+сжата zlib отдельно, так что чтение распаковывает только группы с нужными строками.
+
+    python -m app.coldstore compact --older-than-days 365
+    python -m app.coldstore list
+    python -m app.coldstore restore --month 2024-01
+"""
+import argparse
+import asyncio
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import uuid
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.metrics import Counter
+from app.models import HistorySegment, LinkHistory, Url
+from config import COLD_AFTER_DAYS, COLD_STORAGE_DIR, COLD_USER_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"LHSEG\x01"
+HEADER_LENGTH = struct.Struct("<I")
+GROUP_ROWS = 4096
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# Пустое значение в колонках дат
+NULL_TIME = -(2 ** 63)
+NO_USER = uuid.UUID(int=0)
+
+# Строка сегмента; поля совпадают с запросом истёкших ссылок в app/queries.py
+ColdRow = namedtuple(
+    "ColdRow", "id short_code original_url url_id expires_at click_count created_at user_id"
+)
+
+TIME_COLUMNS = ("expires_at", "created_at")
+INT_COLUMNS = ("click_count",)
+TEXT_COLUMNS = ("short_code", "original_url")
+UUID_COLUMNS = ("id",)
+COLUMNS = UUID_COLUMNS + TEXT_COLUMNS + TIME_COLUMNS + INT_COLUMNS
+
+COLD_ROWS_READ = Counter("cold_history_rows_read_total", "link_history rows read from cold segments")
+
+# Колонки link_history; адрес нормализованных строк берётся из urls, чтобы сегмент не зависел от БД
+HISTORY_ROWS = select(
+    LinkHistory.id,
+    LinkHistory.short_code,
+    func.coalesce(LinkHistory.original_url, Url.url).label("original_url"),
+    LinkHistory.expires_at,
+    LinkHistory.click_count,
+    LinkHistory.created_at,
+    LinkHistory.user_id,
+).outerjoin(Url, Url.id == LinkHistory.url_id)
+
+
+def user_hash(user_id) -> int:
+    return int.from_bytes((user_id or NO_USER).bytes[:4], "big")
+
+
+def bucket_for(user_id, buckets: int) -> int:
+    return user_hash(user_id) % buckets
+
+
+def month_of(moment: datetime) -> str:
+    return moment.strftime("%Y-%m")
+
+
+def _to_micros(moment) -> int:
+    return NULL_TIME if moment is None else (moment - EPOCH) // MICROSECOND
+
+
+def _from_micros(value: int):
+    return None if value == NULL_TIME else EPOCH + value * MICROSECOND
+
+
+def _encode_column(name: str, values) -> bytes:
+    if name in UUID_COLUMNS:
+        return b"".join(value.bytes for value in values)
+    if name in TEXT_COLUMNS:
+        encoded = [(value or "").encode() for value in values]
+        return array("I", map(len, encoded)).tobytes() + b"".join(encoded)
+    if name in TIME_COLUMNS:
+        return array("q", map(_to_micros, values)).tobytes()
+    return array("q", (value or 0 for value in values)).tobytes()
+
+
+def _decode_column(name: str, data: bytes, count: int) -> list:
+    if name in UUID_COLUMNS:
+        return [uuid.UUID(bytes=data[i * 16:(i + 1) * 16]) for i in range(count)]
+    if name in TEXT_COLUMNS:
+        lengths = array("I")
+        lengths.frombytes(data[:4 * count])
+        values, position = [], 4 * count
+        for length in lengths:
+            values.append(data[position:position + length].decode())
+            position += length
+        return values
+    numbers = array("q")
+    numbers.frombytes(data)
+    if name in TIME_COLUMNS:
+        return [_from_micros(value) for value in numbers]
+    return list(numbers)
+
+
+def segment_key(row) -> tuple:
+    """Порядок строк в сегменте: пользователь, срок истечения, id."""
+    return (row.user_id or NO_USER).bytes, row.expires_at, row.id.bytes
+
+
+class SegmentWriter:
+    """Пишет сегмент по одной строке; строки должны приходить в порядке segment_key.
+
+    В памяти держится только текущая группа строк: ключи и сжатые группы
+    копятся во временных файлах и склеиваются в сегмент в close.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self.min_expires_at = None
+        self.max_expires_at = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._keys = open(f"{path}.keys", "w+b")
+        self._blocks = open(f"{path}.blocks", "w+b")
+        self._group = []
+        self._groups = []
+        self._offset = 0
+        self._last_key = None
+
+    def add(self, row):
+        key = segment_key(row)
+        if self._last_key is not None and key < self._last_key:
+            raise ValueError(f"Rows of {self.path} are not sorted by user")
+        self._last_key = key
+        self._keys.write(key[0])
+        self._group.append(row)
+        self.rows += 1
+        if self.min_expires_at is None or row.expires_at < self.min_expires_at:
+            self.min_expires_at = row.expires_at
+        if self.max_expires_at is None or row.expires_at > self.max_expires_at:
+            self.max_expires_at = row.expires_at
+        if len(self._group) >= GROUP_ROWS:
+            self._flush_group()
+
+    def _flush_group(self):
+        if not self._group:
+            return
+        columns = {}
+        for name in COLUMNS:
+            block = zlib.compress(_encode_column(name, [getattr(row, name) for row in self._group]), 6)
+            columns[name] = [self._offset, len(block)]
+            self._blocks.write(block)
+            self._offset += len(block)
+        self._groups.append({"rows": len(self._group), "columns": columns})
+        self._group = []
+
+    def close(self) -> int:
+        """Атомарно записывает сегмент и возвращает размер файла."""
+        self._flush_group()
+        header = json.dumps({"rows": self.rows, "group_rows": GROUP_ROWS, "groups": self._groups}).encode()
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "wb") as segment_file:
+            segment_file.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+            for part in (self._keys, self._blocks):
+                part.seek(0)
+                shutil.copyfileobj(part, segment_file)
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+        os.replace(temporary, self.path)
+        self._remove_parts()
+        return os.path.getsize(self.path)
+
+    def abort(self):
+        self._remove_parts()
+        for path in (f"{self.path}.tmp", self.path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _remove_parts(self):
+        for part in (self._keys, self._blocks):
+            part.close()
+            if os.path.exists(part.name):
+                os.remove(part.name)
+
+
+def write_segment(path: str, rows) -> int:
+    """Записывает строки в сегмент атомарно и возвращает размер файла."""
+    writer = SegmentWriter(path)
+    try:
+        for row in sorted(rows, key=segment_key):
+            writer.add(row)
+        return writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+class SegmentReader:
+    """Чтение сегмента через mmap: страницы файла подгружаются ОС по мере обращения."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as segment_file:
+            self._mmap = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a link history segment")
+        (header_length,) = HEADER_LENGTH.unpack_from(self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + HEADER_LENGTH.size
+        header = json.loads(self._mmap[header_start:header_start + header_length])
+        self.rows = header["rows"]
+        self.group_rows = header["group_rows"]
+        self.groups = header["groups"]
+        self._keys_start = header_start + header_length
+        self._data_start = self._keys_start + 16 * self.rows
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _key(self, index: int) -> bytes:
+        start = self._keys_start + 16 * index
+        return self._mmap[start:start + 16]
+
+    def _bound(self, key: bytes, upper: bool) -> int:
+        low, high = 0, self.rows
+        while low < high:
+            middle = (low + high) // 2
+            current = self._key(middle)
+            if current < key or (upper and current == key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _read_range(self, start: int, stop: int) -> list:
+        rows = []
+        if stop <= start:
+            return rows
+        for group_index in range(start // self.group_rows, (stop - 1) // self.group_rows + 1):
+            group = self.groups[group_index]
+            columns = {}
+            for name in COLUMNS:
+                offset, length = group["columns"][name]
+                data = zlib.decompress(self._mmap[self._data_start + offset:self._data_start + offset + length])
+                columns[name] = _decode_column(name, data, group["rows"])
+            first = group_index * self.group_rows
+            for index in range(max(start, first) - first, min(stop, first + group["rows"]) - first):
+                user_id = uuid.UUID(bytes=self._key(first + index))
+                rows.append(ColdRow(
+                    id=columns["id"][index],
+                    short_code=columns["short_code"][index],
+                    original_url=columns["original_url"][index],
+                    url_id=None,
+                    expires_at=columns["expires_at"][index],
+                    click_count=columns["click_count"][index],
+                    created_at=columns["created_at"][index],
+                    user_id=None if user_id == NO_USER else user_id,
+                ))
+        return rows
+
+    def rows_for_user(self, user_id) -> list:
+        key = (user_id or NO_USER).bytes
+        return self._read_range(self._bound(key, upper=False), self._bound(key, upper=True))
+
+    def all_rows(self) -> list:
+        return self._read_range(0, self.rows)
+
+    def iter_rows(self):
+        """Все строки по порядку; в памяти распакована одна группа."""
+        for start in range(0, self.rows, self.group_rows):
+            yield from self._read_range(start, min(start + self.group_rows, self.rows))
+
+
+def storage_path(relative: str, storage_dir: str = None) -> str:
+    return os.path.join(storage_dir or COLD_STORAGE_DIR, relative)
+
+
+def read_user_rows(paths, user_id, skip_missing: bool = False) -> list:
+    rows = []
+    for path in paths:
+        try:
+            reader = SegmentReader(path)
+        except FileNotFoundError:
+            if not skip_missing:
+                raise
+            logger.warning(f"Cold segment {path} is missing, its rows are skipped")
+            continue
+        with reader:
+            rows.extend(reader.rows_for_user(user_id))
+    COLD_ROWS_READ.inc(len(rows))
+    return rows
+
+
+async def _user_segment_paths(session: AsyncSession, user_id, storage_dir: str) -> list:
+    # Корзина считается по числу корзин сегмента: смена COLD_USER_BUCKETS не теряет старые файлы
+    paths = (await session.execute(
+        select(HistorySegment.path).where(
+            HistorySegment.bucket == literal(user_hash(user_id)) % HistorySegment.buckets
+        )
+    )).scalars().all()
+    return [storage_path(path, storage_dir) for path in paths]
+
+
+async def read_cold_history(session: AsyncSession, user_id, storage_dir: str = None) -> list:
+    """Строки истории пользователя из сегментов; без COLD_STORAGE_DIR — пустой список без запроса.
+
+    Уплотнение может переписать сегмент и удалить прежний файл между запросом
+    индекса и чтением. Тогда индекс запрашивается ещё раз, а файл, которого
+    всё равно нет, пропускается с предупреждением.
+    """
+    storage_dir = storage_dir or COLD_STORAGE_DIR
+    if not storage_dir:
+        return []
+    paths = await _user_segment_paths(session, user_id, storage_dir)
+    if not paths:
+        return []
+    try:
+        return await asyncio.to_thread(read_user_rows, paths, user_id)
+    except FileNotFoundError:
+        paths = await _user_segment_paths(session, user_id, storage_dir)
+        return await asyncio.to_thread(read_user_rows, paths, user_id, True)
+
+
+class BucketCompaction:
+    """Новый сегмент корзины: строки из БД сливаются со строками прежнего сегмента по segment_key."""
+
+    def __init__(self, path: str, previous_path: str = None):
+        self.previous_path = previous_path
+        self.writer = SegmentWriter(path)
+        self.moved = 0
+        self._reader = SegmentReader(previous_path) if previous_path else None
+        self._previous = self._reader.iter_rows() if self._reader else iter(())
+        self._next = next(self._previous, None)
+
+    def add(self, row):
+        key = segment_key(row)
+        while self._next is not None and segment_key(self._next) <= key:
+            # Строка, которая уже есть в прежнем сегменте, не дублируется
+            if segment_key(self._next) != key:
+                self.writer.add(self._next)
+            self._next = next(self._previous, None)
+        self.writer.add(row)
+        self.moved += 1
+
+    def finish(self) -> int:
+        while self._next is not None:
+            self.writer.add(self._next)
+            self._next = next(self._previous, None)
+        self._close_reader()
+        return self.writer.close()
+
+    def abort(self):
+        self._close_reader()
+        self.writer.abort()
+
+    def _close_reader(self):
+        if self._reader is not None:
+            self._previous.close()
+            self._reader.close()
+            self._reader = None
+
+
+async def compact_history(
+    session: AsyncSession,
+    older_than: datetime,
+    storage_dir: str = None,
+    buckets: int = COLD_USER_BUCKETS,
+    batch_size: int = 1000,
+) -> dict:
+    """Переносит строки link_history с expires_at < older_than в сегменты.
+
+    Каждый месяц обрабатывается отдельно. Если сегмент месяца и корзины уже
+    есть, он переписывается вместе с новыми строками. Новый файл записывается
+    до транзакции, которая обновляет индекс и удаляет строки из таблицы, а
+    старый файл удаляется после неё: при сбое строки не теряются, могут
+    остаться только лишние файлы.
+    """
+    storage_dir = storage_dir or COLD_STORAGE_DIR
+    if not storage_dir:
+        raise ValueError("COLD_STORAGE_DIR is not set")
+    oldest = (await session.execute(
+        select(func.min(LinkHistory.expires_at)).where(LinkHistory.expires_at < older_than)
+    )).scalar()
+    moved = {}
+    start = oldest.replace(day=1, hour=0, minute=0, second=0, microsecond=0) if oldest else older_than
+    while start < older_than:
+        end = (start + timedelta(days=32)).replace(day=1)
+        moved.update(await _compact_month(session, storage_dir, start, min(end, older_than), buckets, batch_size))
+        start = end
+    return moved
+
+
+async def _compact_month(
+    session: AsyncSession, storage_dir: str, start: datetime, end: datetime, buckets: int, batch_size: int
+) -> dict:
+    """Переносит один месяц: строки идут из БД в порядке сегмента и сразу пишутся в файлы корзин.
+
+    В памяти остаются только текущие группы корзин и id перенесённых строк
+    (по 16 байт), поэтому объём месяца не ограничен памятью процесса. Чтение
+    прежних сегментов, сжатие и запись идут в потоке, а не в цикле событий.
+    """
+    month = month_of(start)
+    segments = {
+        segment.bucket: segment
+        for segment in (await session.execute(
+            select(HistorySegment).where(HistorySegment.month == month, HistorySegment.buckets == buckets)
+        )).scalars()
+    }
+    compactions, relatives = {}, {}
+    ids = bytearray()
+
+    def add_rows(rows):
+        for row in rows:
+            bucket = bucket_for(row.user_id, buckets)
+            compaction = compactions.get(bucket)
+            if compaction is None:
+                relatives[bucket] = os.path.join(month, f"bucket-{bucket:04d}-{uuid.uuid4().hex[:8]}.seg")
+                segment = segments.get(bucket)
+                compaction = compactions[bucket] = BucketCompaction(
+                    storage_path(relatives[bucket], storage_dir),
+                    storage_path(segment.path, storage_dir) if segment is not None else None,
+                )
+            compaction.add(row)
+            ids.extend(row.id.bytes)
+
+    sizes = {}
+    try:
+        result = await session.stream(
+            HISTORY_ROWS.where(LinkHistory.expires_at >= start, LinkHistory.expires_at < end)
+            # Тот же порядок, что и segment_key: UUID сравниваются побайтно, пустой пользователь — нулевой
+            .order_by(LinkHistory.user_id.nulls_first(), LinkHistory.expires_at, LinkHistory.id),
+            execution_options={"yield_per": batch_size},
+        )
+        async for rows in result.partitions():
+            await asyncio.to_thread(add_rows, rows)
+        for bucket, compaction in compactions.items():
+            sizes[bucket] = await asyncio.to_thread(compaction.finish)
+    except BaseException:
+        for compaction in compactions.values():
+            compaction.abort()
+        raise
+    if not compactions:
+        return {}
+
+    for bucket, compaction in compactions.items():
+        segment = segments.get(bucket)
+        if segment is None:
+            segment = HistorySegment(month=month, bucket=bucket, buckets=buckets)
+            session.add(segment)
+        segment.path = relatives[bucket]
+        segment.size_bytes = sizes[bucket]
+        segment.rows = compaction.writer.rows
+        segment.min_expires_at = compaction.writer.min_expires_at
+        segment.max_expires_at = compaction.writer.max_expires_at
+        segment.created_at = datetime.utcnow()
+
+    chunk = 16 * 1000
+    for offset in range(0, len(ids), chunk):
+        batch = [uuid.UUID(bytes=bytes(ids[i:i + 16])) for i in range(offset, min(offset + chunk, len(ids)), 16)]
+        await session.execute(delete(LinkHistory).where(LinkHistory.id.in_(batch)))
+    await session.commit()
+
+    moved = {}
+    for bucket, compaction in sorted(compactions.items()):
+        if compaction.previous_path is not None:
+            os.remove(compaction.previous_path)
+        moved[f"{month}/{bucket}"] = compaction.moved
+        logger.info(
+            f"Compacted {compaction.moved} link_history rows into {relatives[bucket]} ({compaction.writer.rows} rows)"
+        )
+    return moved
+
+
+async def restore_segment(session: AsyncSession, segment: HistorySegment, storage_dir: str = None) -> int:
+    """Возвращает строки сегмента в link_history и удаляет сегмент."""
+    path = storage_path(segment.path, storage_dir)
+    with SegmentReader(path) as reader:
+        rows = reader.all_rows()
+    existing = set()
+    ids = [row.id for row in rows]
+    for start in range(0, len(ids), 1000):
+        existing.update((await session.execute(
+            select(LinkHistory.id).where(LinkHistory.id.in_(ids[start:start + 1000]))
+        )).scalars())
+    session.add_all(
+        LinkHistory(
+            id=row.id,
+            short_code=row.short_code,
+            original_url=row.original_url,
+            expires_at=row.expires_at,
+            click_count=row.click_count,
+            created_at=row.created_at,
+            user_id=row.user_id,
+        )
+        for row in rows
+        if row.id not in existing
+    )
+    await session.delete(segment)
+    await session.commit()
+    os.remove(path)
+    logger.info(f"Restored {len(rows) - len(existing)} link_history rows from {segment.path}")
+    return len(rows) - len(existing)
+
+
+async def main(argv=None):
+    from app.tasks import link_session_makers
+
+    parser = argparse.ArgumentParser(description="Move old link_history rows to cold segments and back")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compact = commands.add_parser("compact", help="Move history older than the threshold to segments")
+    compact.add_argument("--older-than-days", type=int, default=COLD_AFTER_DAYS)
+    compact.add_argument("--buckets", type=int, default=COLD_USER_BUCKETS)
+    commands.add_parser("list", help="List segments")
+    restore = commands.add_parser("restore", help="Move segment rows back to link_history")
+    restore.add_argument("--month", required=True, help="Month of expiry, YYYY-MM")
+    restore.add_argument("--bucket", type=int, help="Only this bucket (default: all buckets of the month)")
+    args = parser.parse_args(argv)
+
+    for session_maker in link_session_makers():
+        async with session_maker() as session:
+            if args.command == "compact":
+                older_than = datetime.utcnow() - timedelta(days=args.older_than_days)
+                moved = await compact_history(session, older_than, buckets=args.buckets)
+                print(f"Moved {sum(moved.values())} rows into {len(moved)} segments")
+            elif args.command == "list":
+                for segment in (await session.execute(
+                    select(HistorySegment).order_by(HistorySegment.month, HistorySegment.bucket)
+                )).scalars():
+                    print(f"{segment.month} {segment.bucket}/{segment.buckets} {segment.rows} rows "
+                          f"{segment.size_bytes} bytes {segment.path}")
+            else:
+                query = select(HistorySegment).where(HistorySegment.month == args.month)
+                if args.bucket is not None:
+                    query = query.where(HistorySegment.bucket == args.bucket)
+                for segment in (await session.execute(query)).scalars().all():
+                    await restore_segment(session, segment)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
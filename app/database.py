@@ -1,12 +1,382 @@
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from typing import AsyncGenerator
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from config import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER, DATABASE_URL
+from fastapi import Depends, Request
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from config import (
+    DATABASE_URL,
+    DB_ECHO,
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_READ_YOUR_WRITES_WINDOW,
+    DB_REPLICA_MAX_LAG,
+    DB_REPLICA_RETRY_AFTER,
+    DB_REPLICA_STRATEGY,
+    DB_REPLICA_URLS,
+    DB_SHARD_PREVIOUS_URLS,
+    DB_SHARD_URLS,
+    DB_SHARD_VNODES,
+    DB_STATEMENT_CACHE_SIZE,
+    DB_STATEMENT_TIMEOUT,
+)
+from app.metrics import CallbackHistogram, CallbackMetric
+from app.models import Link
+from app.redis import has_recent_write, mark_recent_write
+# Подключает обработчики событий, которые замеряют каждый SQL-запрос
+from app import querylog  # noqa: F401
+from app.replicas import ReplicaRouter
+from app.sharding import ShardRouter, copy_link
+from app.urls import copy_urls, inline_urls
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Границы корзин гистограммы ожидания соединения из пула, в секундах
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class PoolWaitHistogram:
+    def __init__(self, buckets=POOL_WAIT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.timeouts = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self) -> dict:
+        # Корзины кумулятивные, как в Prometheus (le)
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = self.count
+        return {
+            "buckets": buckets,
+            "count": self.count,
+            "sum": self.sum,
+            "timeouts": self.timeouts,
+        }
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, который замеряет время ожидания свободного соединения."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_histogram = PoolWaitHistogram()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.wait_histogram.timeouts += 1
+            raise
+        finally:
+            self.wait_histogram.observe(time.perf_counter() - start)
+
+
+def build_engine_options(url: str) -> dict:
+    options = {
+        "echo": DB_ECHO,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    if url.startswith("sqlite"):
+        # У SQLite свой пул, размеры очереди к нему неприменимы
+        return options
+
+    options.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    if "+asyncpg" in url:
+        connect_args = {"statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+        if DB_STATEMENT_TIMEOUT:
+            connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT)}
+        options["connect_args"] = connect_args
+    return options
+
+
+def create_engine_from_config(url: str) -> AsyncEngine:
+    if "+asyncpg" in url:
+        url = make_url(url).update_query_dict(
+            {"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)}
+        )
+    return create_async_engine(url, **build_engine_options(str(url)))
+
+
+def get_pool_status(target: AsyncEngine = None) -> dict:
+    pool = (target or engine).pool
+    status = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            max_overflow=pool._max_overflow,
+            timeout=pool.timeout(),
+        )
+    if isinstance(pool, InstrumentedQueuePool):
+        status["wait_time"] = pool.wait_histogram.snapshot()
+    return status
+
+
+engine = create_engine_from_config(DATABASE_URL)
 
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
+# Сколько запросов завершилось, так и не открыв соединение ни с одной БД
+session_usage = {"requests": 0, "without_connection": 0}
+_request_db_usage = ContextVar("request_db_usage", default=None)
+
+
+@event.listens_for(Session, "after_begin")
+def _mark_connection_opened(session, transaction, connection):
+    usage = _request_db_usage.get()
+    if usage is not None:
+        usage["connected"] = True
+
+
+class LazySession:
+    """Обёртка над AsyncSession, которая создаёт сессию при первом обращении."""
+
+    def __init__(self, session_maker):
+        self._session_maker = session_maker
+        self._session = None
+
+    @property
+    def opened(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name):
+        if self._session is None:
+            self._session = self._session_maker()
+        return getattr(self._session, name)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
 async def get_async_session() -> AsyncSession:
-    async with async_session_maker() as session:
+    usage = {"connected": False}
+    _request_db_usage.set(usage)
+    session = LazySession(async_session_maker)
+    try:
         yield session
-        
+    finally:
+        await session.close()
+        session_usage["requests"] += 1
+        if not usage["connected"]:
+            session_usage["without_connection"] += 1
+
+
+shard_router = (
+    ShardRouter(
+        [create_engine_from_config(url) for url in DB_SHARD_URLS],
+        [create_engine_from_config(url) for url in DB_SHARD_PREVIOUS_URLS],
+        vnodes=DB_SHARD_VNODES,
+    )
+    if DB_SHARD_URLS
+    else None
+)
+
+
+async def get_shard_session(
+    short_code: str, session: AsyncSession = Depends(get_async_session)
+) -> AsyncSession:
+    """Сессия шарда, на котором лежит ссылка short_code из пути запроса."""
+    if shard_router is None:
+        yield session
+        return
+    async with shard_router.session_for(short_code) as shard_session:
+        yield shard_session
+
+
+@asynccontextmanager
+async def link_session(session: AsyncSession, short_code: str):
+    # Без шардирования это та же сессия запроса, закрывать её здесь не нужно
+    if shard_router is None:
+        yield session
+        return
+    async with shard_router.session_for(short_code) as shard_session:
+        yield shard_session
+
+
+async def rename_link(session: AsyncSession, link: Link, short_code: str) -> Link:
+    """Меняет short_code ссылки, загруженной в session.
+
+    Сравнивается шард, с которого ссылка на самом деле прочитана, с местом нового
+    кода: во время перешардирования ссылка может ещё лежать на прежнем шарде.
+    """
+    if shard_router is None or shard_router.placed_on(session, short_code):
+        link.short_code = short_code
+        await session.commit()
+        return link
+
+    async with shard_router.shard_for(short_code).session_maker() as target_session:
+        conflicts = await copy_urls(session, target_session, [link.url_id])
+        moved = copy_link(link, short_code)
+        inline_urls([moved], conflicts)
+        target_session.add(moved)
+        await target_session.commit()
+    await session.delete(link)
+    await session.commit()
+    return moved
+
+
+async def fan_out(session: AsyncSession, query_fn) -> list:
+    """Выполняет query_fn(session) на всех шардах параллельно, без шардов — в session."""
+    if shard_router is None:
+        return await query_fn(session)
+    return await shard_router.gather(query_fn)
+
+
+replica_router = (
+    ReplicaRouter(
+        [create_engine_from_config(url) for url in DB_REPLICA_URLS],
+        strategy=DB_REPLICA_STRATEGY,
+        max_lag=DB_REPLICA_MAX_LAG,
+        retry_after=DB_REPLICA_RETRY_AFTER,
+        read_your_writes_window=DB_READ_YOUR_WRITES_WINDOW,
+    )
+    if DB_REPLICA_URLS
+    else None
+)
+
+
+def all_engines() -> dict:
+    engines = {"primary": engine}
+    if shard_router is not None:
+        engines.update((shard.name, shard.engine) for shard in shard_router.all_shards())
+    if replica_router is not None:
+        engines.update((replica.name, replica.engine) for replica in replica_router.replicas)
+    return engines
+
+
+def _pool_collector(read):
+    def collect():
+        for name, target in all_engines().items():
+            status = get_pool_status(target)
+            # У SQLite свой пул без счётчиков
+            if "wait_time" in status:
+                yield (name,), read(status)
+    return collect
+
+
+CallbackHistogram(
+    "db_pool_wait_seconds", "Time spent waiting for a connection from the pool", ("engine",),
+    _pool_collector(lambda status: status["wait_time"]),
+)
+CallbackMetric(
+    "db_pool_timeouts_total", "Pool checkouts that timed out", "counter", ("engine",),
+    _pool_collector(lambda status: status["wait_time"]["timeouts"]),
+)
+CallbackMetric(
+    "db_pool_checked_out", "Connections currently checked out of the pool", "gauge", ("engine",),
+    _pool_collector(lambda status: status["checked_out"]),
+)
+CallbackMetric(
+    "db_pool_overflow", "Overflow connections currently open", "gauge", ("engine",),
+    _pool_collector(lambda status: status["overflow"]),
+)
+
+
+async def dispose_engines():
+    await engine.dispose()
+    if shard_router is not None:
+        await shard_router.dispose()
+    if replica_router is not None:
+        await replica_router.dispose()
+
+
+def read_your_writes_key(request: Request) -> str:
+    authorization = request.headers.get("authorization")
+    if authorization:
+        return authorization
+    return request.client.host if request.client else ""
+
+
+async def remember_write(request: Request):
+    """Отмечает запись клиента: метка в памяти воркера и в Redis для остальных воркеров."""
+    key = read_your_writes_key(request)
+    replica_router.remember_write(key)
+    await mark_recent_write(key, replica_router.read_your_writes_window)
+
+
+async def is_sticky(request: Request) -> bool:
+    """Клиент недавно записывал (в этом или другом воркере) и должен читать из основной БД."""
+    key = read_your_writes_key(request)
+    return replica_router.is_sticky(key) or await has_recent_write(key)
+
+
+@asynccontextmanager
+async def replica_session_scope(router: ReplicaRouter, replica):
+    """Сессия реплики, пока она открыта, учитывается в in_flight; None, если реплика недоступна."""
+    replica_session = await router.open_session(replica) if replica else None
+    if replica_session is None:
+        yield None
+        return
+
+    replica.in_flight += 1
+    try:
+        yield replica_session
+    finally:
+        replica.in_flight -= 1
+        await replica_session.close()
+
+
+def replica_session_maker(router: ReplicaRouter, replica):
+    """Фабрика сессий реплики для потоковых ответов; при недоступной реплике — основная БД."""
+
+    @asynccontextmanager
+    async def session_maker():
+        async with replica_session_scope(router, replica) as replica_session:
+            if replica_session is not None:
+                yield replica_session
+                return
+        async with async_session_maker() as session:
+            yield session
+
+    return session_maker
+
+
+@asynccontextmanager
+async def read_session_scope(request: Request, session: AsyncSession):
+    """Сессия для чтения: реплика, если она доступна и клиент недавно ничего не записывал."""
+    if shard_router is not None and request.path_params.get("short_code") is not None:
+        # При шардировании ссылку читаем с её шарда, реплики не используются
+        async with shard_router.session_for(request.path_params["short_code"]) as shard_session:
+            yield shard_session
+        return
+
+    router = replica_router
+    if router is None or await is_sticky(request):
+        yield session
+        return
+
+    async with replica_session_scope(router, router.choose()) as replica_session:
+        yield replica_session if replica_session is not None else session
+
+
+async def get_read_session(
+    request: Request, session: AsyncSession = Depends(get_async_session)
+) -> AsyncSession:
+    async with read_session_scope(request, session) as read_session:
+        yield read_session
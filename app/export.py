@@ -0,0 +1,304 @@
+"""Потоковая выгрузка ссылок и истории пользователя.
+
+Строки читаются курсорами на стороне сервера пачками по EXPORT_BATCH_SIZE и
+сразу пишутся в ответ, поэтому память процесса не зависит от размера выгрузки.
+Сначала идут ссылки по возрастанию short_code, затем история по возрастанию id.
+При шардировании потоки шардов сливаются в этом же порядке. История,
+перенесённая в холодные сегменты, вливается в поток истории по id; строки
+пользователя из сегментов читаются в память, как и в GET /links/expired.
+У каждой строки есть поле cursor: запрос с ?cursor=... продолжает выгрузку со
+следующей строки, так что оборванную или ограниченную limit выгрузку можно докачать.
+"""
+import base64
+import csv
+import heapq
+import io
+import json
+import uuid
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from sqlalchemy import bindparam, func, select
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+from app.coldstore import read_cold_history
+from app.database import (
+    async_session_maker,
+    is_sticky,
+    replica_router,
+    replica_session_maker,
+    shard_router,
+)
+from app.metrics import CallbackMetric, Counter
+from app.models import Link, LinkHistory, Url
+
+EXPORT_FIELDS = (
+    "kind", "short_code", "original_url", "custom_alias", "created_at", "expires_at",
+    "click_count", "last_accessed_at", "track_clicks", "cursor",
+)
+
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+# Сколько байт текста копить перед отправкой очередного куска ответа
+CHUNK_SIZE = 64 * 1024
+
+HISTORY_START = uuid.UUID(int=0)
+
+EXPORT_ROWS = Counter("export_rows_total", "Rows written by /links/export", ("format",))
+
+active_exports = {"count": 0}
+
+CallbackMetric("export_active", "Exports being streamed", "gauge", (), lambda: [((), active_exports["count"])])
+
+
+class ExportSlot:
+    """Место в лимите одновременных выгрузок; release можно вызывать повторно."""
+
+    def __init__(self):
+        self.released = False
+        active_exports["count"] += 1
+
+    @classmethod
+    def reserve(cls, limit: int):
+        """Занимает место, пока выгрузок меньше limit, иначе возвращает None."""
+        if active_exports["count"] >= limit:
+            return None
+        return cls()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            active_exports["count"] -= 1
+
+
+class ExportResponse(StreamingResponse):
+    """Освобождает место выгрузки и тогда, когда тело ответа так и не начало отправляться."""
+
+    def __init__(self, content, slot: ExportSlot, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.slot.release()
+
+
+@lru_cache(maxsize=None)
+def export_queries(dialect: str):
+    """Запросы выгрузки ссылок и истории для диалекта."""
+    short_code = Link.short_code
+    if dialect == "postgresql":
+        # Порядок строк должен совпадать со сравнением строк в Python при слиянии шардов
+        short_code = Link.short_code.collate("C")
+    links = (
+        select(
+            Link.short_code,
+            func.coalesce(Link.original_url, Url.url).label("original_url"),
+            Link.custom_alias,
+            Link.created_at,
+            Link.expires_at,
+            Link.click_count,
+            Link.last_accessed_at,
+            Link.track_clicks,
+        )
+        .outerjoin(Url, Url.id == Link.url_id)
+        .where(Link.user_id == bindparam("user_id"), short_code > bindparam("after"))
+        .order_by(short_code)
+    )
+    history = (
+        select(
+            LinkHistory.id,
+            LinkHistory.short_code,
+            func.coalesce(LinkHistory.original_url, Url.url).label("original_url"),
+            LinkHistory.created_at,
+            LinkHistory.expires_at,
+            LinkHistory.click_count,
+        )
+        .outerjoin(Url, Url.id == LinkHistory.url_id)
+        .where(LinkHistory.user_id == bindparam("user_id"), LinkHistory.id > bindparam("after"))
+        .order_by(LinkHistory.id)
+    )
+    return links, history
+
+
+async def export_session_makers(request: Request) -> list:
+    """Фабрики сессий для выгрузки.
+
+    Сессии открывает сам поток ответа: зависимости с yield закрываются до того,
+    как начнёт отправляться тело StreamingResponse. Реплика выбирается так же,
+    как в read_session_scope: клиент после записи читает из основной БД.
+    """
+    if shard_router is not None:
+        return [shard.session_maker for shard in shard_router.all_shards()]
+    router = replica_router
+    if router is None or await is_sticky(request):
+        return [async_session_maker]
+    replica = router.choose()
+    return [replica_session_maker(router, replica) if replica else async_session_maker]
+
+
+def encode_cursor(kind: str, key) -> str:
+    return base64.urlsafe_b64encode(f"{kind}:{key}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Возвращает (kind, ключ последней выгруженной строки); ValueError для чужих строк."""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    kind, _, key = raw.partition(":")
+    if kind == "link" and key:
+        return kind, key
+    if kind == "history":
+        return kind, uuid.UUID(key)
+    raise ValueError(f"Invalid export cursor: {cursor}")
+
+
+async def stream_rows(session_maker, query_index: int, params: dict, batch_size: int):
+    async with session_maker() as session:
+        query = export_queries(session.get_bind().dialect.name)[query_index]
+        result = await session.stream(query, params, execution_options={"yield_per": batch_size})
+        async for row in result:
+            yield row
+
+
+async def cold_history_rows(session_maker, user_id, after):
+    """Строки истории пользователя из холодных сегментов с id > after по возрастанию id."""
+    async with session_maker() as session:
+        rows = await read_cold_history(session, user_id)
+    for row in sorted((row for row in rows if row.id > after), key=lambda row: row.id):
+        yield row
+
+
+async def merge_sorted(streams, key):
+    """Слияние отсортированных по key потоков; строки с одинаковым ключом выдаются один раз.
+
+    Повторы возможны во время перешардирования, когда ссылка уже скопирована на
+    новый шард, но ещё не удалена со старого.
+    """
+    heap = []
+    try:
+        for index, stream in enumerate(streams):
+            row = await anext(stream, None)
+            if row is not None:
+                heap.append((key(row), index, row))
+        heapq.heapify(heap)
+        previous = None
+        while heap:
+            row_key, index, row = heap[0]
+            if row_key != previous:
+                yield row
+                previous = row_key
+            following = await anext(streams[index], None)
+            if following is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (key(following), index, following))
+    finally:
+        for stream in streams:
+            await stream.aclose()
+
+
+def link_record(row) -> dict:
+    return {
+        "kind": "link",
+        "short_code": row.short_code,
+        "original_url": row.original_url,
+        "custom_alias": row.custom_alias,
+        "created_at": row.created_at,
+        "expires_at": row.expires_at,
+        "click_count": row.click_count,
+        "last_accessed_at": row.last_accessed_at,
+        "track_clicks": row.track_clicks,
+        "cursor": encode_cursor("link", row.short_code),
+    }
+
+
+def history_record(row) -> dict:
+    return {
+        "kind": "history",
+        "short_code": row.short_code,
+        "original_url": row.original_url,
+        "custom_alias": None,
+        "created_at": row.created_at,
+        "expires_at": row.expires_at,
+        "click_count": row.click_count,
+        "last_accessed_at": None,
+        "track_clicks": None,
+        "cursor": encode_cursor("history", row.id),
+    }
+
+
+async def export_records(session_makers, user_id, cursor: str = None, limit: int = None, batch_size: int = 1000):
+    """Строки выгрузки пользователя после cursor, не больше limit."""
+    kind, after = decode_cursor(cursor) if cursor else ("link", "")
+    sources = []
+    if kind == "link":
+        sources.append((0, after, lambda row: row.short_code, link_record))
+        after = HISTORY_START
+    sources.append((1, after, lambda row: row.id, history_record))
+
+    written = 0
+    for query_index, after, key, to_record in sources:
+        if limit is not None and written >= limit:
+            return
+        params = {"user_id": user_id, "after": after}
+        streams = [stream_rows(maker, query_index, params, batch_size) for maker in session_makers]
+        if query_index == 1:
+            streams += [cold_history_rows(maker, user_id, after) for maker in session_makers]
+        rows = merge_sorted(streams, key)
+        try:
+            async for row in rows:
+                yield to_record(row)
+                written += 1
+                if limit is not None and written >= limit:
+                    return
+        finally:
+            await rows.aclose()
+
+
+def _text_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def encode_export(records, export_format: str, compress: bool = False, header: bool = True, slot=None):
+    """Кодирует строки в CSV или NDJSON кусками по CHUNK_SIZE, при compress — в gzip.
+
+    Место выгрузки slot освобождается, как только закончились строки.
+    """
+    rows_written = EXPORT_ROWS.labels(export_format)
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == "csv" else None
+    if writer is not None and header:
+        writer.writerow(EXPORT_FIELDS)
+
+    def take_chunk() -> bytes:
+        chunk = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(chunk) if compressor else chunk
+
+    try:
+        async for record in records:
+            if writer is not None:
+                writer.writerow([_text_value(record[field]) for field in EXPORT_FIELDS])
+            else:
+                buffer.write(json.dumps(record, default=_text_value, ensure_ascii=False))
+                buffer.write("\n")
+            rows_written.inc()
+            if buffer.tell() >= CHUNK_SIZE:
+                chunk = take_chunk()
+                if chunk:
+                    yield chunk
+        chunk = take_chunk()
+        if compressor is not None:
+            chunk += compressor.flush()
+        if chunk:
+            yield chunk
+    finally:
+        if slot is not None:
+            slot.release()
+        await records.aclose()
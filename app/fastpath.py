@@ -0,0 +1,86 @@
+import logging
+from datetime import datetime
+from urllib.parse import quote
+from starlette.routing import Route
+from app.http_cache import redirect_policy
+from app.redis import get_cache, link_key
+from app.tasks import click_queue
+
+logger = logging.getLogger(__name__)
+
+# Те же безопасные символы, что у starlette.responses.RedirectResponse
+LOCATION_SAFE = ":/%#?=@[]!$&'()*+,;"
+
+
+_static_paths = {}
+
+
+def static_paths(app) -> frozenset:
+    # Пути вроде /docs или /openapi.json тоже из одного сегмента, их не трогаем
+    paths = _static_paths.get(app)
+    if paths is None:
+        paths = _static_paths[app] = frozenset(
+            route.path for route in getattr(app, "routes", [])
+            if isinstance(route, Route) and "{" not in route.path
+        )
+    return paths
+
+
+def redirect_short_code(scope):
+    """Короткий код, если запрос — GET /{short_code}, иначе None."""
+    if scope["type"] != "http" or scope["method"] != "GET":
+        return None
+    path = scope["path"]
+    if path.count("/") != 1 or len(path) < 2 or path in static_paths(scope.get("app")):
+        return None
+    return path[1:].strip()
+
+
+class RedirectFastPath:
+    """ASGI-обработчик GET /{short_code}, который отвечает редиректом прямо из кэша.
+
+    Без внедрения зависимостей FastAPI и без объектов Request/Response: при попадании
+    в кэш ответ — это статус и заголовок Location. Промах, истёкшая ссылка или ошибка
+    передаются обычному обработчику redirect_link.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        short_code = redirect_short_code(scope)
+        if not short_code:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            cached_link = await get_cache(link_key(short_code))
+        except Exception as e:
+            logger.error(f"Fast redirect lookup failed for {short_code}: {e!r}")
+            cached_link = None
+
+        if not cached_link:
+            await self.app(scope, receive, send)
+            return
+        expires_at = cached_link.get("expires_at")
+        if expires_at and expires_at < datetime.utcnow():
+            await self.app(scope, receive, send)
+            return
+
+        track_clicks = cached_link.get("track_clicks", True)
+        status, cache_control = redirect_policy(track_clicks, expires_at)
+        location = quote(cached_link["original_url"], safe=LOCATION_SAFE).encode("latin-1")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"location", location),
+                (b"cache-control", cache_control.encode()),
+                (b"content-length", b"0"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b""})
+        if not track_clicks:
+            return
+        # Переход учитывается после отправки ответа
+        await click_queue.submit(short_code, (1, datetime.utcnow()))
@@ -0,0 +1,37 @@
+import hashlib
+from datetime import datetime
+from config import REDIRECT_MAX_AGE
+
+# Политика кэширования ответов браузерами и CDN.
+# Ссылки с учётом переходов отдаются как 307 + no-store, чтобы каждый переход
+# доходил до сервера; без учёта — как постоянный 308, который можно кэшировать
+# до истечения ссылки.
+
+
+def redirect_policy(track_clicks: bool, expires_at: datetime = None, now: datetime = None):
+    """Возвращает (статус, Cache-Control) для редиректа."""
+    if track_clicks:
+        return 307, "no-store"
+    max_age = REDIRECT_MAX_AGE
+    if expires_at is not None:
+        remaining = (expires_at - (now or datetime.utcnow())).total_seconds()
+        max_age = max(0, min(max_age, int(remaining)))
+    return 308, f"public, max-age={max_age}"
+
+
+def stats_etag(stats: dict) -> str:
+    fingerprint = "|".join(
+        str(stats.get(field))
+        for field in ("original_url", "created_at", "click_count", "last_accessed_at")
+    )
+    return f'W/"{hashlib.md5(fingerprint.encode()).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Сравнение слабое: префикс W/ не учитывается
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
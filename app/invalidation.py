@@ -0,0 +1,139 @@
+import asyncio
+import functools
+import logging
+from app.redis import (
+    cache_codec,
+    client_for,
+    direct_key,
+    group_by_client,
+    link_key,
+    on_node,
+    resilient,
+    stats_key,
+)
+
+logger = logging.getLogger(__name__)
+
+# Все изменения ссылок проходят через этот модуль: он удаляет производные ключи
+# и увеличивает версию ссылки. У статистики своя версия: переходы меняют её
+# постоянно, и общая версия не давала бы загрузчику редиректа записать кэш.
+# Локальных кэшей по short_code в процессах нет, поэтому оповещений между
+# процессами тоже нет: все кэши ссылок живут в Redis
+
+# Версия живёт дольше любой загрузки из БД, после этого ключ можно забыть
+VERSION_TTL = 3600
+
+# Первые ARGV[2] ключей — версии, они увеличиваются; остальные удаляются
+INVALIDATE_SCRIPT = """
+local versions = tonumber(ARGV[2])
+for i = 1, #KEYS do
+    if i <= versions then
+        redis.call('INCR', KEYS[i])
+        redis.call('EXPIRE', KEYS[i], ARGV[1])
+    else
+        redis.call('DEL', KEYS[i])
+    end
+end
+return 1
+"""
+
+# Записывает значение, только если версия ссылки не изменилась с начала загрузки
+SET_IF_VERSION_SCRIPT = """
+local current = redis.call('GET', KEYS[2]) or ''
+if current ~= ARGV[3] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+
+def version_key(short_code: str) -> str:
+    return f"version:{{{short_code}}}"
+
+
+def stats_version_key(short_code: str) -> str:
+    return f"version:stats:{{{short_code}}}"
+
+
+async def _get_version(key: str) -> str:
+    version = await client_for(key).get(key)
+    return version.decode() if version else ""
+
+
+@resilient(fallback="", node=version_key)
+async def link_version(short_code: str) -> str:
+    return await _get_version(version_key(short_code))
+
+
+@resilient(fallback="", node=stats_version_key)
+async def stats_version(short_code: str) -> str:
+    return await _get_version(stats_version_key(short_code))
+
+
+@resilient(fallback=False, node=direct_key)
+async def set_cache_if_version(
+    key: str, value, short_code: str, version: str, expire: int = 60, versioned_by=version_key
+) -> bool:
+    """Записывает key, если версия versioned_by(short_code) всё ещё равна version."""
+    stored = await client_for(key).eval(
+        SET_IF_VERSION_SCRIPT, 2, key, versioned_by(short_code),
+        cache_codec.encode(value), expire, version,
+    )
+    if not stored:
+        logger.info(f"Skipped stale cache write for key: {key}")
+    return bool(stored)
+
+
+async def _invalidate_on_node(client, short_codes, versions_for, keys_for):
+    async with client.pipeline(transaction=False) as pipe:
+        for short_code in short_codes:
+            versions = versions_for(short_code)
+            keys = keys_for(short_code)
+            pipe.eval(
+                INVALIDATE_SCRIPT, len(versions) + len(keys),
+                *versions, *keys, VERSION_TTL, len(versions),
+            )
+        await pipe.execute()
+
+
+async def _invalidate(short_codes, versions_for, keys_for):
+    by_client = group_by_client(short_codes, key_for=version_key)
+    await asyncio.gather(*(
+        on_node(client, functools.partial(_invalidate_on_node, client, codes, versions_for, keys_for))
+        for client, codes in by_client.items()
+    ))
+
+
+async def invalidate_links(*short_codes: str):
+    """Ссылки изменены или удалены: сбрасываются все закэшированные данные о них."""
+    short_codes = list(dict.fromkeys(short_codes))
+    if not short_codes:
+        return
+    await _invalidate_links(short_codes)
+
+
+@resilient()
+async def _invalidate_links(short_codes):
+    await _invalidate(
+        short_codes,
+        lambda short_code: [version_key(short_code), stats_version_key(short_code)],
+        lambda short_code: [link_key(short_code), stats_key(short_code)],
+    )
+
+
+async def invalidate_stats(short_codes):
+    """Изменилась только статистика, кэш редиректа и версия ссылки остаются в силе."""
+    short_codes = list(dict.fromkeys(short_codes))
+    if not short_codes:
+        return
+    await _invalidate_stats(short_codes)
+
+
+@resilient()
+async def _invalidate_stats(short_codes):
+    await _invalidate(
+        short_codes,
+        lambda short_code: [stats_version_key(short_code)],
+        lambda short_code: [stats_key(short_code)],
+    )
@@ -0,0 +1,213 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+
+# Формат текстовой выдачи Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин гистограмм длительности, в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# scope текущего HTTP-запроса; по нему определяется обработчик, к которому относятся запросы к БД
+_request_scope = ContextVar("metrics_request_scope", default=None)
+
+
+def bind_request_scope(scope):
+    return _request_scope.set(scope)
+
+
+def unbind_request_scope(token):
+    _request_scope.reset(token)
+
+
+def current_request_scope():
+    return _request_scope.get()
+
+
+def current_handler() -> str:
+    scope = _request_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return route.name if route is not None else "unmatched"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def histogram_lines(name: str, labels: str, bounds, cumulative, count, total) -> list:
+    """Строки гистограммы; cumulative — накопленные счётчики для каждой границы bounds."""
+    prefix = labels[1:-1] + "," if labels else ""
+    lines = [
+        f'{name}_bucket{{{prefix}le="{bound}"}} {value}'
+        for bound, value in zip(bounds, cumulative)
+    ]
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {count}')
+    lines.append(f"{name}_sum{labels} {total}")
+    lines.append(f"{name}_count{labels} {count}")
+    return lines
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class HistogramChild:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metric:
+    """Метрика с набором меток.
+
+    labels(...) возвращает дочерний объект для конкретных значений меток. На
+    горячих путях его получают один раз и сохраняют, чтобы запрос только
+    увеличивал счётчик, не создавая ни кортежей, ни словарей.
+    """
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def sample_lines(self) -> list:
+        raise NotImplementedError
+
+    def expose(self) -> list:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.sample_lines(),
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def sample_lines(self) -> list:
+        return [
+            f"{self.name}{format_labels(self.labelnames, values)} {child.value}"
+            for values, child in list(self._children.items())
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def sample_lines(self) -> list:
+        lines = []
+        for values, child in list(self._children.items()):
+            cumulative = []
+            running = 0
+            for count in child.counts[:-1]:
+                running += count
+                cumulative.append(running)
+            labels = format_labels(self.labelnames, values)
+            lines.extend(histogram_lines(self.name, labels, self.buckets, cumulative, child.count, child.sum))
+        return lines
+
+
+class CallbackMetric(Metric):
+    """Метрика, значения которой читаются из состояния приложения в момент сбора.
+
+    collect() возвращает пары (значения меток, число).
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames, collect, registry=None):
+        self.kind = kind
+        self.collect = collect
+        super().__init__(name, documentation, labelnames, registry)
+
+    def sample_lines(self) -> list:
+        return [
+            f"{self.name}{format_labels(self.labelnames, values)} {value}"
+            for values, value in self.collect()
+        ]
+
+
+class CallbackHistogram(CallbackMetric):
+    """collect() возвращает пары (значения меток, снимок в формате PoolWaitHistogram.snapshot())."""
+
+    def __init__(self, name: str, documentation: str, labelnames, collect, registry=None):
+        super().__init__(name, documentation, "histogram", labelnames, collect, registry)
+
+    def sample_lines(self) -> list:
+        lines = []
+        for values, snapshot in self.collect():
+            buckets = {bound: count for bound, count in snapshot["buckets"].items() if bound != "+Inf"}
+            labels = format_labels(self.labelnames, values)
+            lines.extend(histogram_lines(
+                self.name, labels, buckets.keys(), buckets.values(), snapshot["count"], snapshot["sum"]
+            ))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
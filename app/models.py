@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from sqlalchemy import Column, String, Boolean, Integer, ForeignKey, DateTime
+from sqlalchemy import BigInteger, Column, String, Boolean, Integer, ForeignKey, DateTime, UniqueConstraint, true
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
@@ -24,18 +24,30 @@ class User(Base):
         foreign_keys="[LinkHistory.user_id]"
     )
 
+class Url(Base):
+    __tablename__ = "urls"
+
+    # Первые 8 байт SHA-256 адреса (app/urls.py): ключ одинаков на всех шардах
+    # и вычисляется без обращения к БД
+    id = Column(BigInteger, primary_key=True, autoincrement=False)
+    url = Column(String, nullable=False)
+
 class Link(Base):
     __tablename__ = "links"
 
     short_code = Column(String(10), primary_key=True, index=True)
     custom_alias = Column(String(), default=None) 
-    original_url = Column(String, nullable=False)
+    # Адрес хранится либо здесь, либо в таблице urls по url_id (NORMALIZE_URLS)
+    original_url = Column(String, nullable=True)
+    url_id = Column(BigInteger, ForeignKey("urls.id"), nullable=True, index=True)
     
     created_at = Column(DateTime, default=lambda: datetime.utcnow().replace(tzinfo=None))
     updated_at = Column(DateTime, default=lambda: datetime.utcnow().replace(tzinfo=None), onupdate=lambda: datetime.utcnow().replace(tzinfo=None))
     last_accessed_at = Column(DateTime, nullable=True)
     click_count = Column(Integer, default=0)
     expires_at = Column(DateTime, nullable=True, default=default_expires_at)
+    # Без учёта переходов редирект постоянный и кэшируется браузерами
+    track_clicks = Column(Boolean, nullable=False, default=True, server_default=true())
 
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
 
@@ -46,10 +58,29 @@ class LinkHistory(Base):
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     short_code = Column(String(10), nullable=False) 
-    original_url = Column(String, nullable=False)
+    original_url = Column(String, nullable=True)
+    url_id = Column(BigInteger, ForeignKey("urls.id"), nullable=True)
     expires_at = Column(DateTime, nullable=False)
     click_count = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
-    user = relationship("User", back_populates="link_histories")
\ No newline at end of file
+    user = relationship("User", back_populates="link_histories")
+
+class HistorySegment(Base):
+    """Файл холодного хранилища с частью link_history (app/coldstore.py)."""
+    __tablename__ = "link_history_segments"
+    __table_args__ = (UniqueConstraint("month", "bucket", "buckets"),)
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Месяц истечения ссылок "ГГГГ-ММ" и корзина пользователей из buckets
+    month = Column(String(7), nullable=False)
+    bucket = Column(Integer, nullable=False)
+    buckets = Column(Integer, nullable=False)
+    # Путь относительно COLD_STORAGE_DIR
+    path = Column(String, nullable=False)
+    rows = Column(Integer, nullable=False)
+    size_bytes = Column(BigInteger, nullable=False)
+    min_expires_at = Column(DateTime, nullable=False)
+    max_expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,191 @@
+import hashlib
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from config import (
+    PROFILE_HEADER,
+    PROFILE_INTERVAL,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_SECRET,
+    PROFILE_STORE_SIZE,
+)
+
+# Стек, когда задача запроса ждёт (ввод-вывод, пул соединений, другие задачи цикла)
+AWAITING = "[awaiting]"
+
+
+def sign_profile_token(ttl: int = 300, secret: str = PROFILE_SECRET, now: float = None) -> str:
+    expires = str(int((now or time.time()) + ttl))
+    signature = hmac.new(secret.encode(), expires.encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{signature}"
+
+
+def verify_profile_token(token: str, secret: str = PROFILE_SECRET, now: float = None) -> bool:
+    expires, _, signature = token.partition(".")
+    if not secret or not expires.isdigit() or int(expires) < (now or time.time()):
+        return False
+    expected = hmac.new(secret.encode(), expires.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature, expected)
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    # co_qualname появился в Python 3.11
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Статистический профилировщик одного запроса.
+
+    Отдельный поток каждые interval секунд снимает стек потока цикла событий.
+    Если в стеке есть корневой кадр запроса, записывается путь от него до
+    текущей функции, иначе задача запроса в этот момент ждала — отсчёт
+    попадает в AWAITING. Так профиль показывает и время CPU, и время ожидания.
+    """
+
+    def __init__(self, root_frame, interval: float = PROFILE_INTERVAL):
+        self.root_frame = root_frame
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            self.stacks[self._fold(frame)] += 1
+
+    def _fold(self, frame) -> str:
+        labels = []
+        while frame is not None:
+            labels.append(frame_label(frame))
+            if frame is self.root_frame:
+                return ";".join(reversed(labels))
+            frame = frame.f_back
+        return AWAITING
+
+
+class Profile:
+    _ids = itertools.count(1)
+
+    def __init__(self, method: str, path: str, reason: str, interval: float):
+        self.id = next(self._ids)
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.interval = interval
+        self.started_at = datetime.utcnow()
+        self.route = None
+        self.status = None
+        self.duration_ms = None
+        self.stacks = Counter()
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "reason": self.reason,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.duration_ms,
+            "samples": sum(self.stacks.values()),
+            "interval_ms": self.interval * 1000,
+        }
+
+    def folded(self) -> str:
+        """Свёрнутые стеки («стек количество»), их принимают flamegraph.pl и speedscope."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    """Последние size профилей; более старые вытесняются."""
+
+    def __init__(self, size: int = PROFILE_STORE_SIZE):
+        self.profiles = deque(maxlen=size)
+
+    def add(self, profile: Profile):
+        self.profiles.append(profile)
+
+    def get(self, profile_id: int):
+        for profile in self.profiles:
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    def list(self) -> list:
+        return [profile.summary() for profile in reversed(self.profiles)]
+
+
+profile_store = ProfileStore()
+
+
+class ProfilingMiddleware:
+    """Профилирует запросы с подписанным заголовком PROFILE_HEADER и долю sample_rate остальных.
+
+    Подключается только при PROFILING_ENABLED; остальные запросы проходят
+    после проверки заголовка без дополнительной работы.
+    """
+
+    def __init__(self, app, store: ProfileStore = profile_store, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 interval: float = PROFILE_INTERVAL, header: str = PROFILE_HEADER):
+        self.app = app
+        self.store = store
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.header = header.lower().encode()
+
+    def _reason(self, scope):
+        for name, value in scope["headers"]:
+            if name == self.header:
+                return "header" if verify_profile_token(value.decode("latin-1")) else None
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        reason = self._reason(scope) if scope["type"] == "http" else None
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope["method"], scope["path"], reason, self.interval)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+            await send(message)
+
+        sampler = StackSampler(sys._getframe(), self.interval)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            sampler.stop()
+            profile.duration_ms = (time.perf_counter() - start) * 1000
+            route = scope.get("route")
+            profile.route = route.path if route is not None else None
+            profile.stacks = sampler.stacks
+            self.store.add(profile)
+
+
+if __name__ == "__main__":
+    # Токен для заголовка: python -m app.profiling [ttl]
+    print(sign_profile_token(int(sys.argv[1]) if len(sys.argv) > 1 else 300))
@@ -0,0 +1,69 @@
+from sqlalchemy import bindparam, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import Link, LinkHistory
+from app.urls import url_id_for
+
+# Запросы горячих путей выбирают только нужные колонки и собираются один раз при
+# импорте: строки результата не превращаются в ORM-объекты и не попадают в identity map,
+# а скомпилированный SQL берётся из кэша движка по одному и тому же объекту запроса.
+
+# Для нормализованных ссылок original_url пуст, адрес находится по url_id (app/urls.py)
+
+REDIRECT_TARGET = select(Link.original_url, Link.url_id, Link.expires_at, Link.track_clicks).where(
+    Link.short_code == bindparam("short_code")
+)
+
+LINK_STATS = select(
+    Link.original_url,
+    Link.url_id,
+    Link.created_at,
+    Link.click_count,
+    Link.last_accessed_at,
+    Link.user_id,
+).where(Link.short_code == bindparam("short_code"))
+
+LINKS_BY_URL = select(
+    Link.short_code,
+    Link.original_url,
+    Link.expires_at,
+    Link.created_at,
+    Link.user_id,
+).where(or_(Link.original_url == bindparam("original_url"), Link.url_id == bindparam("url_id")))
+
+EXPIRED_LINKS = select(
+    LinkHistory.short_code,
+    LinkHistory.original_url,
+    LinkHistory.url_id,
+    LinkHistory.expires_at,
+    LinkHistory.click_count,
+    LinkHistory.created_at,
+).where(LinkHistory.user_id == bindparam("user_id"))
+
+SHORT_CODE_EXISTS = select(Link.short_code).where(Link.short_code == bindparam("short_code"))
+
+
+async def fetch_redirect_target(session: AsyncSession, short_code: str):
+    result = await session.execute(REDIRECT_TARGET, {"short_code": short_code})
+    return result.first()
+
+
+async def fetch_link_stats(session: AsyncSession, short_code: str):
+    result = await session.execute(LINK_STATS, {"short_code": short_code})
+    return result.first()
+
+
+async def fetch_links_by_url(session: AsyncSession, original_url: str):
+    result = await session.execute(
+        LINKS_BY_URL, {"original_url": original_url, "url_id": url_id_for(original_url)}
+    )
+    return result.all()
+
+
+async def fetch_expired_links(session: AsyncSession, user_id):
+    result = await session.execute(EXPIRED_LINKS, {"user_id": user_id})
+    return result.all()
+
+
+async def short_code_exists(session: AsyncSession, short_code: str) -> bool:
+    result = await session.execute(SHORT_CODE_EXISTS, {"short_code": short_code})
+    return result.scalars().first() is not None
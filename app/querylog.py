@@ -0,0 +1,176 @@
+import functools
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.metrics import (
+    Counter as MetricCounter,
+    Histogram,
+    bind_request_scope,
+    current_handler,
+    current_request_scope,
+    unbind_request_scope,
+)
+from app.tracing import current_span, tracer
+from config import QUERY_BUDGET_DEFAULT, QUERY_BUDGETS, SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
+
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "SQL statement execution time by request handler", ("handler",)
+)
+QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "SQL statements executed by one request", ("handler",),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100),
+)
+QUERY_BUDGET_EXCEEDED = MetricCounter(
+    "db_query_budget_exceeded_total", "Requests that ran more SQL statements than their budget", ("handler",)
+)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"\$\d+|%\(\w+\)s|%s|(?<!:):\w+|\?")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+# Сколько самых частых запросов показывать в сообщении assert_max_queries
+REPORT_LIMIT = 5
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(statement: str) -> str:
+    """Текст запроса без значений: литералы и параметры заменены на ?, списки IN свёрнуты.
+
+    Одинаковые по форме запросы с разными параметрами дают один отпечаток,
+    а в журнал не попадают данные пользователей.
+    """
+    text = _STRING.sub("?", statement)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _IN_LIST.sub("(?)", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+class QueryLog:
+    __slots__ = ("count", "total", "fingerprints")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.fingerprints = Counter()
+
+    def add(self, statement_fingerprint: str, duration: float):
+        self.count += 1
+        self.total += duration
+        self.fingerprints[statement_fingerprint] += 1
+
+    def repeated(self) -> dict:
+        return {fp: count for fp, count in self.fingerprints.items() if count > 1}
+
+    def report(self) -> str:
+        return "; ".join(f"{count}x {fp}" for fp, count in self.fingerprints.most_common(REPORT_LIMIT))
+
+
+_captures = ContextVar("query_captures", default=())
+
+
+def record_query(statement: str, duration: float, handler: str) -> str:
+    """Вызывается из обработчика событий движка после каждого SQL-запроса."""
+    statement_fingerprint = fingerprint(statement)
+    scope = current_request_scope()
+    if scope is not None:
+        log = scope.get("query_log")
+        if log is None:
+            log = scope["query_log"] = QueryLog()
+        log.add(statement_fingerprint, duration)
+    for capture in _captures.get():
+        capture.add(statement_fingerprint, duration)
+    if duration * 1000 >= SLOW_QUERY_MS:
+        logger.warning(f"Slow query in {handler}: {duration * 1000:.1f} ms {statement_fingerprint}")
+    return statement_fingerprint
+
+
+# Обработчики стоят на классе Engine и срабатывают для всех движков, включая шарды и реплики
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+    handler = current_handler()
+    DB_QUERY_SECONDS.labels(handler).observe(duration)
+    statement_fingerprint = record_query(statement, duration, handler)
+    if current_span() is not None:
+        end = time.time_ns()
+        tracer.record("db.query", end - int(duration * 1e9), end, {"db.statement": statement_fingerprint})
+
+
+@event.listens_for(Engine, "handle_error")
+def _drop_query_timer(context):
+    starts = context.connection.info.get("query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def check_query_budget(handler: str, log: QueryLog):
+    QUERIES_PER_REQUEST.labels(handler).observe(log.count)
+    budget = QUERY_BUDGETS.get(handler, QUERY_BUDGET_DEFAULT)
+    if log.count <= budget:
+        return
+    QUERY_BUDGET_EXCEEDED.labels(handler).inc()
+    message = f"{handler} ran {log.count} queries, budget is {budget}"
+    repeated = log.repeated()
+    if repeated:
+        message += "; repeated: " + "; ".join(f"{count}x {fp}" for fp, count in repeated.items())
+    logger.warning(message)
+
+
+class QueryBudgetMiddleware:
+    """Собирает запросы к БД каждого HTTP-запроса и проверяет бюджет маршрута.
+
+    Бюджеты задаются по имени обработчика в QUERY_BUDGETS, остальным
+    маршрутам достаётся QUERY_BUDGET_DEFAULT. Превышение пишется в журнал
+    вместе с повторяющимися запросами (признак N+1).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = bind_request_scope(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            unbind_request_scope(token)
+            log = scope.get("query_log")
+            route = scope.get("route")
+            if log is not None and route is not None:
+                check_query_budget(route.name, log)
+
+
+@contextmanager
+def capture_queries():
+    """Собирает запросы к БД, выполненные внутри блока, в том числе обработчиками HTTP-запросов."""
+    log = QueryLog()
+    token = _captures.set((*_captures.get(), log))
+    try:
+        yield log
+    finally:
+        _captures.reset(token)
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """Для тестов: блок не должен выполнить больше limit запросов к БД."""
+    with capture_queries() as log:
+        yield log
+    assert log.count <= limit, f"Expected at most {limit} queries, got {log.count}: {log.report()}"
@@ -1,12 +1,106 @@
-from config import REDIS_HOST, REDIS_PORT
+from config import (
+    CACHE_CODEC,
+    REDIS_BREAKER_FAILURES,
+    REDIS_BREAKER_RESET,
+    REDIS_CLUSTER,
+    REDIS_CONNECT_TIMEOUT,
+    REDIS_HOST,
+    REDIS_NODES,
+    REDIS_PORT,
+    REDIS_SOCKET_TIMEOUT,
+)
+import asyncio
+import functools
+import hashlib
 import json
+import struct
+import time
+import weakref
+import msgpack
 import redis.asyncio as redis
-from datetime import datetime
+from datetime import datetime, timedelta
+from redis.asyncio.cluster import ClusterNode, RedisCluster
+from redis.exceptions import RedisError
+from app.metrics import CallbackMetric, Counter
+from app.sharding import HashRing
+from app.tracing import tracer
 
 REDIS_HOST = REDIS_HOST
 REDIS_PORT = REDIS_PORT
 
-redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+# Значения кэша бинарные, поэтому ответы Redis не декодируются в строки
+REDIS_CLIENT_OPTIONS = {
+    "socket_timeout": REDIS_SOCKET_TIMEOUT,
+    "socket_connect_timeout": REDIS_CONNECT_TIMEOUT,
+}
+
+
+def parse_node(node: str):
+    host, _, port = node.rpartition(":")
+    return host, int(port)
+
+
+def hash_tag(key: str) -> str:
+    """Часть ключа в {}, по которой выбирается узел (как hash tag в Redis Cluster)."""
+    start = key.find("{")
+    if start != -1:
+        end = key.find("}", start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+if REDIS_CLUSTER:
+    # Кластер сам раскладывает ключи по слотам и делит многоключевые команды
+    redis_client = RedisCluster(
+        startup_nodes=[ClusterNode(*parse_node(node)) for node in REDIS_NODES],
+        **REDIS_CLIENT_OPTIONS,
+    )
+    redis_node_clients = [redis_client]
+elif REDIS_NODES:
+    redis_node_clients = [
+        redis.Redis(host=host, port=port, **REDIS_CLIENT_OPTIONS)
+        for host, port in map(parse_node, REDIS_NODES)
+    ]
+    redis_client = redis_node_clients[0]
+else:
+    redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, **REDIS_CLIENT_OPTIONS)
+    redis_node_clients = [redis_client]
+
+redis_ring = HashRing(range(len(redis_node_clients))) if len(redis_node_clients) > 1 else None
+
+
+def client_for(key: str):
+    if redis_ring is None:
+        return redis_client
+    return redis_node_clients[redis_ring.node_for(hash_tag(key))]
+
+
+def all_clients() -> list:
+    return redis_node_clients if redis_ring is not None else [redis_client]
+
+
+def group_by_client(items, key_for=None) -> dict:
+    groups = {}
+    for item in items:
+        groups.setdefault(client_for(key_for(item) if key_for else item), []).append(item)
+    return groups
+
+
+async def close_redis():
+    clients = {id(client): client for client in [*redis_node_clients, redis_client]}
+    for client in clients.values():
+        await client.aclose()
+
+
+# Ключи одной ссылки содержат {short_code} и попадают на один узел,
+# поэтому их можно менять одним конвейером или скриптом
+def link_key(short_code: str) -> str:
+    return f"link:{{{short_code}}}"
+
+
+def stats_key(short_code: str) -> str:
+    return f"stats:{{{short_code}}}"
 
 import logging
 
@@ -14,38 +108,417 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-async def set_cache(key: str, value, expire: int = 60):
-    if "created_at" in value and isinstance(value["created_at"], datetime):
-        value["created_at"] = value["created_at"].isoformat()
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.opened_total = 0
+        self.short_circuited = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        # После паузы пропускаем один пробный вызов, остальные идут мимо Redis
+        if state == self.HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        self.short_circuited += 1
+        return False
+
+    def release_probe(self):
+        # Вызов прервали не из-за Redis: следующий вызов снова может стать пробным
+        self.probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.probing:
+                self.opened_total += 1
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened_total": self.opened_total,
+            "short_circuited": self.short_circuited,
+        }
+
+
+# Выключатель у каждого узла свой: отказ одного узла из REDIS_NODES не отключает остальные
+redis_breakers = weakref.WeakKeyDictionary()
+
+
+def breaker_for(client) -> CircuitBreaker:
+    breaker = redis_breakers.get(client)
+    if breaker is None:
+        breaker = redis_breakers[client] = CircuitBreaker(REDIS_BREAKER_FAILURES, REDIS_BREAKER_RESET)
+    return breaker
+
+
+def node_name(client) -> str:
+    if isinstance(client, RedisCluster):
+        return "cluster"
+    options = client.connection_pool.connection_kwargs
+    return f"{options.get('host')}:{options.get('port')}"
+
+
+def breakers_status() -> dict:
+    return {node_name(client): breaker_for(client).status() for client in all_clients()}
+
+
+CallbackMetric(
+    "redis_breaker_state", "Current Redis circuit breaker state", "gauge", ("node", "state"),
+    lambda: [((node_name(client), state), int(breaker_for(client).state == state))
+             for client in all_clients()
+             for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)],
+)
+CallbackMetric(
+    "redis_breaker_short_circuited_total", "Redis calls skipped while the breaker was open", "counter", ("node",),
+    lambda: [((node_name(client),), breaker_for(client).short_circuited) for client in all_clients()],
+)
+
+REDIS_ERRORS = (RedisError, OSError, asyncio.TimeoutError)
+
+
+class BreakerOpen(RedisError):
+    """Выключатель узла открыт, вызов к узлу не отправлялся."""
+
+
+async def on_node(client, call):
+    """Выполняет call() на узле client через выключатель этого узла."""
+    breaker = breaker_for(client)
+    if not breaker.allow():
+        raise BreakerOpen()
+    try:
+        result = await call()
+    except REDIS_ERRORS:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release_probe()
+        raise
+    breaker.record_success()
+    return result
+
+
+def direct_key(key: str) -> str:
+    return key
+
+
+def resilient(fallback=None, node=None):
+    """Ошибки и таймауты Redis не пробрасываются: вызов возвращает fallback.
+
+    node(первый аргумент) даёт ключ, по узлу которого выбирается выключатель.
+    Без node функция обращается к нескольким узлам и сама проводит вызовы
+    каждого узла через on_node. Пока узел недоступен, вызовы к нему сразу
+    возвращают fallback, и запрос обслуживается из базы данных.
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            try:
+                if node is None:
+                    return await fn(*args, **kwargs)
+                return await on_node(client_for(node(args[0])), lambda: fn(*args, **kwargs))
+            except BreakerOpen:
+                return fallback
+            except REDIS_ERRORS as e:
+                logger.warning(f"Redis call {fn.__name__} failed: {e!r}")
+                return fallback
+
+        return wrapper
+
+    return decorator
+
+
+LEGACY_DATETIME_FIELDS = ("created_at", "last_accessed_at", "expires_at")
+
+
+class JsonCodec:
+    """Прежний формат: JSON без байта версии, даты в isoformat."""
+
+    version = None
+
+    def encode(self, value: dict) -> bytes:
+        value = {
+            k: v.isoformat() if isinstance(v, datetime) else v for k, v in value.items()
+        }
+        return json.dumps(value).encode()
+
+    def decode(self, data: bytes) -> dict:
+        loaded_data = json.loads(data)
+        for field in LEGACY_DATETIME_FIELDS:
+            if loaded_data.get(field):
+                loaded_data[field] = datetime.fromisoformat(loaded_data[field])
+        return loaded_data
+
 
-    if "last_accessed_at" in value and isinstance(value["last_accessed_at"], datetime):
-        value["last_accessed_at"] = value["last_accessed_at"].isoformat()
+EPOCH = datetime(1970, 1, 1)
+NAIVE_DATETIME_EXT = 1
+AWARE_DATETIME_EXT = 2
+_timestamp = struct.Struct(">qI")
 
+
+def _pack_ext(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            delta = value - EPOCH
+            return msgpack.ExtType(
+                NAIVE_DATETIME_EXT,
+                _timestamp.pack(delta.days * 86400 + delta.seconds, delta.microseconds),
+            )
+        return msgpack.ExtType(AWARE_DATETIME_EXT, value.isoformat().encode())
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _unpack_ext(code: int, data: bytes):
+    if code == NAIVE_DATETIME_EXT:
+        seconds, microseconds = _timestamp.unpack(data)
+        return EPOCH + timedelta(seconds=seconds, microseconds=microseconds)
+    if code == AWARE_DATETIME_EXT:
+        return datetime.fromisoformat(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+class MsgpackCodec:
+    """Компактный бинарный формат: байт версии + msgpack, даты — расширенным типом."""
+
+    version = 1
+
+    def __init__(self):
+        self._prefix = bytes([self.version])
+        self._packer = msgpack.Packer(default=_pack_ext, use_bin_type=True)
+
+    def encode(self, value: dict) -> bytes:
+        return self._prefix + self._packer.pack(value)
+
+    def decode(self, data: bytes) -> dict:
+        return msgpack.unpackb(data[1:], ext_hook=_unpack_ext, raw=False)
+
+
+CODECS = {"json": JsonCodec(), "msgpack": MsgpackCodec()}
+CODECS_BY_VERSION = {codec.version: codec for codec in CODECS.values() if codec.version}
+
+# Чем записывать значения; читаются все известные форматы
+cache_codec = CODECS[CACHE_CODEC]
+
+
+def decode_value(data: bytes) -> dict:
+    codec = CODECS_BY_VERSION.get(data[0])
+    if codec is None:
+        # Записи без байта версии сохранены прежним JSON-форматом
+        codec = CODECS["json"]
+    return codec.decode(data)
+
+
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Redis cache lookups by key family and result", ("family", "result"))
+
+# Счётчики заранее привязаны к меткам, чтобы чтение кэша не создавало объектов
+CACHE_FAMILIES = tuple(
+    (f"{family}:", family, CACHE_LOOKUPS.labels(family, "hit"), CACHE_LOOKUPS.labels(family, "miss"))
+    for family in ("link", "stats")
+)
+CACHE_OTHER = ("", "other", CACHE_LOOKUPS.labels("other", "hit"), CACHE_LOOKUPS.labels("other", "miss"))
+
+
+def cache_family(key: str) -> tuple:
+    for family in CACHE_FAMILIES:
+        if key.startswith(family[0]):
+            return family
+    return CACHE_OTHER
+
+
+@resilient(node=direct_key)
+async def set_cache(key: str, value, expire: int = 60):
     logger.info(
         f"Setting cache for key: {key} with value: {value} and expire time: {expire}"
     )
 
-    await redis_client.set(key, json.dumps(value), ex=expire)
+    with tracer.span("cache.encode"):
+        data = cache_codec.encode(value)
+    with tracer.span("redis.set") as span:
+        span.set("cache.family", cache_family(key)[1])
+        await client_for(key).set(key, data, ex=expire)
 
 
+@resilient(node=direct_key)
 async def get_cache(key: str):
-    logger.info(f"Getting cache for key: {key}")
-    data = await redis_client.get(key)
+    _, family, hits, misses = cache_family(key)
+    with tracer.span("redis.get") as span:
+        span.set("cache.family", family)
+        data = await client_for(key).get(key)
+        span.set("cache.hit", bool(data))
     if data:
-        loaded_data = json.loads(data)
-        if "created_at" in loaded_data:
-            loaded_data["created_at"] = datetime.fromisoformat(
-                loaded_data["created_at"]
-            )
-        if "last_accessed_at" in loaded_data and loaded_data["last_accessed_at"]:
-            loaded_data["last_accessed_at"] = datetime.fromisoformat(
-                loaded_data["last_accessed_at"]
-            )
-        logger.info(f"Cache hit for key: {key}")
-        return loaded_data
-    logger.info(f"Cache miss for key: {key}")
+        hits.inc()
+        with tracer.span("cache.decode"):
+            return decode_value(data)
+    misses.inc()
     return None
 
 
+@resilient(node=direct_key)
 async def delete_cache(key: str):
-    await redis_client.delete(key)
+    await client_for(key).delete(key)
+
+
+# Метка недавней записи клиента видна всем воркерам и живёт окно read-your-writes.
+# В ключе хеш: идентификатор клиента — это заголовок Authorization
+def recent_write_key(client_key: str) -> str:
+    return f"ryw:{hashlib.sha256(client_key.encode()).hexdigest()}"
+
+
+@resilient(node=recent_write_key)
+async def mark_recent_write(client_key: str, window: float):
+    key = recent_write_key(client_key)
+    await client_for(key).set(key, 1, px=max(int(window * 1000), 1))
+
+
+@resilient(fallback=False, node=recent_write_key)
+async def has_recent_write(client_key: str) -> bool:
+    key = recent_write_key(client_key)
+    return bool(await client_for(key).exists(key))
+
+
+# Переходы копятся в Redis и периодически переносятся в БД (app/tasks.py),
+# поэтому редирект из кэша не обращается к базе данных.
+# Множество ссылок с непереданными переходами у каждого узла своё
+CLICKS_DIRTY_KEY = "clicks:dirty"
+
+# Атомарно забирает и удаляет счётчик: в кластере MULTI недоступен, а скрипт
+# с одним ключом выполняется на узле этого ключа
+POP_CLICKS_SCRIPT = """
+local data = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return data
+"""
+
+
+def clicks_key(short_code: str) -> str:
+    return f"clicks:{{{short_code}}}"
+
+
+async def _add_pending_clicks(pending: dict, overwrite_last: bool):
+    # Один конвейер на узел, узлы обрабатываются параллельно
+    async def add(client, codes):
+        async with client.pipeline(transaction=False) as pipe:
+            for short_code in codes:
+                count, last_accessed_at = pending[short_code]
+                key = clicks_key(short_code)
+                pipe.hincrby(key, "count", count)
+                if overwrite_last:
+                    pipe.hset(key, "last_accessed_at", last_accessed_at.isoformat())
+                else:
+                    pipe.hsetnx(key, "last_accessed_at", last_accessed_at.isoformat())
+                pipe.sadd(CLICKS_DIRTY_KEY, short_code)
+            await pipe.execute()
+
+    groups = group_by_client(pending, key_for=clicks_key)
+    await asyncio.gather(
+        *(on_node(client, functools.partial(add, client, codes)) for client, codes in groups.items())
+    )
+
+
+@resilient(fallback=False)
+async def record_clicks(clicks: dict) -> bool:
+    """Добавляет переходы {short_code: (count, last_accessed_at)} к счётчикам."""
+    await _add_pending_clicks(clicks, overwrite_last=True)
+    return True
+
+
+async def record_click(short_code: str, accessed_at: str) -> bool:
+    return await record_clicks({short_code: (1, datetime.fromisoformat(accessed_at))})
+
+
+def parse_pending_clicks(data: dict):
+    return int(data[b"count"]), datetime.fromisoformat(data[b"last_accessed_at"].decode())
+
+
+def _pairs_to_dict(pairs: list) -> dict:
+    return dict(zip(pairs[::2], pairs[1::2]))
+
+
+@resilient(fallback=(0, None), node=clicks_key)
+async def get_pending_clicks(short_code: str):
+    key = clicks_key(short_code)
+    data = await client_for(key).hgetall(key)
+    if not data:
+        return 0, None
+    return parse_pending_clicks(data)
+
+
+async def _pop_node_clicks(client, limit: int) -> dict:
+    codes = [code.decode() for code in await client.spop(CLICKS_DIRTY_KEY, limit) or []]
+    if not codes:
+        return {}
+    async with client.pipeline(transaction=False) as pipe:
+        for short_code in codes:
+            pipe.eval(POP_CLICKS_SCRIPT, 1, clicks_key(short_code))
+        results = await pipe.execute()
+    return {
+        short_code: parse_pending_clicks(_pairs_to_dict(pairs))
+        for short_code, pairs in zip(codes, results)
+        if pairs
+    }
+
+
+@resilient(fallback={})
+async def pop_pending_clicks(limit: int = 1000) -> dict:
+    """Забирает накопленные переходы: {short_code: (count, last_accessed_at)}.
+
+    Ошибка одного узла не отменяет переходы, уже забранные с остальных.
+    """
+    pending = {}
+    errors = []
+    for node_pending in await asyncio.gather(
+        *(on_node(client, functools.partial(_pop_node_clicks, client, limit)) for client in all_clients()),
+        return_exceptions=True,
+    ):
+        if isinstance(node_pending, BaseException):
+            errors.append(node_pending)
+        else:
+            pending.update(node_pending)
+    if errors and not pending:
+        raise errors[0]
+    for error in errors:
+        if not isinstance(error, BreakerOpen):
+            logger.warning(f"Redis call pop_pending_clicks failed on a node: {error!r}")
+    return pending
+
+
+async def restore_pending_clicks(pending: dict):
+    """Возвращает переходы в Redis; ошибка пробрасывается, чтобы вызывающий не потерял их."""
+    # Время последнего перехода не перезаписывает более новое, накопленное за это время
+    await _add_pending_clicks(pending, overwrite_last=False)
+
+
+@resilient()
+async def move_pending_clicks(old_code: str, new_code: str):
+    key = clicks_key(old_code)
+    client = client_for(key)
+    pairs = await on_node(client, functools.partial(client.eval, POP_CLICKS_SCRIPT, 1, key))
+    if pairs:
+        await restore_pending_clicks({new_code: parse_pending_clicks(_pairs_to_dict(pairs))})
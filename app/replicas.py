@@ -0,0 +1,123 @@
+import itertools
+import logging
+import time
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+# Отставание реплики Postgres в секундах; 0, если всё полученное WAL уже применено
+PG_REPLICATION_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+STRATEGIES = ("round_robin", "least_busy")
+
+
+class Replica:
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.session_maker = async_sessionmaker(engine, expire_on_commit=False)
+        self.in_flight = 0
+        self.down_until = 0.0
+        self.lag = None
+
+    @property
+    def name(self) -> str:
+        return self.engine.url.render_as_string(hide_password=True)
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+
+class ReplicaRouter:
+    def __init__(
+        self,
+        engines,
+        strategy: str = "round_robin",
+        max_lag: float = 5.0,
+        retry_after: float = 30.0,
+        read_your_writes_window: float = 5.0,
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown replica strategy: {strategy}")
+        self.replicas = [Replica(engine) for engine in engines]
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.retry_after = retry_after
+        self.read_your_writes_window = read_your_writes_window
+        self._round_robin = itertools.count()
+        self._recent_writes = {}
+
+    def choose(self) -> Optional[Replica]:
+        available = [replica for replica in self.replicas if replica.available]
+        if not available:
+            return None
+        if self.strategy == "least_busy":
+            return min(available, key=lambda replica: replica.in_flight)
+        return available[next(self._round_robin) % len(available)]
+
+    def mark_down(self, replica: Replica, reason):
+        replica.down_until = time.monotonic() + self.retry_after
+        logger.warning(f"Replica {replica.name} is unavailable for {self.retry_after}s: {reason}")
+
+    def remember_write(self, key: str):
+        now = time.monotonic()
+        if len(self._recent_writes) > 10000:
+            self._recent_writes = {
+                k: ts for k, ts in self._recent_writes.items()
+                if now - ts < self.read_your_writes_window
+            }
+        self._recent_writes[key] = now
+
+    def is_sticky(self, key: str) -> bool:
+        written_at = self._recent_writes.get(key)
+        return written_at is not None and time.monotonic() - written_at < self.read_your_writes_window
+
+    async def open_session(self, replica: Replica) -> Optional[AsyncSession]:
+        # Соединение берём сразу, чтобы при недоступной реплике успеть уйти на основную БД
+        session = replica.session_maker()
+        try:
+            await session.connection()
+        except Exception as e:
+            await session.close()
+            self.mark_down(replica, e)
+            return None
+        return session
+
+    async def measure_lag(self, replica: Replica) -> float:
+        async with replica.engine.connect() as conn:
+            if replica.engine.dialect.name != "postgresql":
+                await conn.execute(text("SELECT 1"))
+                return 0.0
+            return float((await conn.execute(PG_REPLICATION_LAG_QUERY)).scalar() or 0)
+
+    async def check_replicas(self):
+        for replica in self.replicas:
+            try:
+                replica.lag = await self.measure_lag(replica)
+            except Exception as e:
+                self.mark_down(replica, e)
+                continue
+            if replica.lag > self.max_lag:
+                self.mark_down(replica, f"lag {replica.lag:.1f}s exceeds {self.max_lag}s")
+            else:
+                replica.down_until = 0.0
+
+    def status(self) -> list:
+        return [
+            {
+                "replica": replica.name,
+                "available": replica.available,
+                "in_flight": replica.in_flight,
+                "lag": replica.lag,
+            }
+            for replica in self.replicas
+        ]
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.engine.dispose()
@@ -0,0 +1,71 @@
+import time
+from app.fastpath import redirect_short_code
+from app.metrics import Histogram, bind_request_scope, unbind_request_scope
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("route", "method", "status")
+)
+
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+REDIRECT_ROUTE = "/{short_code}"
+UNMATCHED_ROUTE = "unmatched"
+# Метод приходит от клиента как есть, прочие значения сводятся в одну метку
+KNOWN_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"))
+OTHER_METHOD = "other"
+
+
+class RequestMetricsMiddleware:
+    """Замеряет время ответа по шаблону маршрута, методу и классу статуса.
+
+    Стоит снаружи остальных middleware, поэтому учитывает и ответы быстрого
+    редиректа. Дочерние гистограммы создаются при первом запросе к маршруту,
+    дальше запрос находит их двумя поисками в словаре и индексом в списке.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._children = {}
+
+    def _children_for(self, route_path: str, method: str) -> list:
+        by_method = self._children.get(route_path)
+        if by_method is None:
+            by_method = self._children[route_path] = {}
+        children = by_method.get(method)
+        if children is None:
+            children = by_method[method] = [
+                HTTP_REQUEST_SECONDS.labels(route_path, method, status_class) for status_class in STATUS_CLASSES
+            ]
+        return children
+
+    def _route_path(self, scope) -> str:
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        # Попадание в кэш быстрого редиректа до маршрутизации не доходит
+        if redirect_short_code(scope):
+            return REDIRECT_ROUTE
+        return UNMATCHED_ROUTE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = bind_request_scope(scope)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            unbind_request_scope(token)
+            method = scope["method"] if scope["method"] in KNOWN_METHODS else OTHER_METHOD
+            children = self._children_for(self._route_path(scope), method)
+            index = min(max(status // 100, 1), 5) - 1
+            children[index].observe(time.perf_counter() - start)
@@ -0,0 +1,84 @@
+"""Онлайн-перешардирование ссылок.
+
+Приложение на время переноса запускается с DB_SHARD_URLS=<новые шарды> и
+DB_SHARD_PREVIOUS_URLS=<старые шарды>: новые ссылки пишутся по новому кольцу,
+а чтения ищут ссылку на новом шарде и, если её там ещё нет, на старом.
+
+    python -m app.reshard --from URL1,URL2 --to URL1,URL2,URL3
+"""
+import argparse
+import asyncio
+import logging
+from collections import defaultdict
+from sqlalchemy import select
+from app.database import create_engine_from_config
+from app.models import Link
+from app.sharding import ShardRouter, move_links
+from config import DB_SHARD_VNODES
+
+logger = logging.getLogger(__name__)
+
+
+async def reshard(router: ShardRouter, batch_size: int = 500, dry_run: bool = False) -> dict:
+    """Переносит ссылки со старых шардов на те, что им назначает новое кольцо.
+
+    Каждый шард обходится по диапазонам short_code (keyset-пагинация), так что
+    за раз блокируется и переносится не больше batch_size строк.
+    """
+    moved = defaultdict(int)
+    for source in router.previous_shards.values():
+        last_code = ""
+        while True:
+            async with source.session_maker() as source_session:
+                links = (
+                    await source_session.execute(
+                        select(Link)
+                        .where(Link.short_code > last_code)
+                        .order_by(Link.short_code)
+                        .limit(batch_size)
+                    )
+                ).scalars().all()
+                if not links:
+                    break
+                last_code = links[-1].short_code
+
+                by_target = defaultdict(list)
+                for link in links:
+                    target = router.shard_for(link.short_code)
+                    if target is not source:
+                        by_target[target].append(link)
+
+                for target, target_links in by_target.items():
+                    key = f"{source.name} -> {target.name}"
+                    if not dry_run:
+                        async with target.session_maker() as target_session:
+                            await move_links(source_session, target_session, target_links)
+                    moved[key] += len(target_links)
+                    logger.info(f"Moved {len(target_links)} links {key} up to {last_code}")
+    return dict(moved)
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move links between shards after the shard list changes")
+    parser.add_argument("--from", dest="source_urls", required=True, help="Current shard URLs, comma separated")
+    parser.add_argument("--to", dest="target_urls", required=True, help="New shard URLs, comma separated")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    def engines(urls):
+        return [create_engine_from_config(url.strip()) for url in urls.split(",") if url.strip()]
+
+    router = ShardRouter(engines(args.target_urls), engines(args.source_urls), vnodes=DB_SHARD_VNODES)
+    await router.create_tables()
+    try:
+        moved = await reshard(router, batch_size=args.batch_size, dry_run=args.dry_run)
+    finally:
+        await router.dispose()
+    for key, count in moved.items():
+        print(f"{key}: {count}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
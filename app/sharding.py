@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+from bisect import bisect
+from contextlib import asynccontextmanager
+from sqlalchemy import Column, MetaData, Table, delete, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from app.models import HistorySegment, Link, LinkHistory, Url
+from app.urls import copy_urls, inline_urls
+
+
+def ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Консистентное хеширование: ключ принадлежит ближайшей по часовой стрелке точке узла."""
+
+    def __init__(self, nodes, vnodes: int = 64):
+        self.nodes = list(nodes)
+        points = sorted(
+            (ring_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str):
+        if not self._nodes:
+            raise LookupError("Hash ring is empty")
+        return self._nodes[bisect(self._hashes, ring_hash(key)) % len(self._nodes)]
+
+
+def shard_metadata() -> MetaData:
+    # На шардах нет таблицы users, поэтому копии таблиц создаются без внешних ключей
+    metadata = MetaData()
+    for table in (Url.__table__, Link.__table__, LinkHistory.__table__, HistorySegment.__table__):
+        Table(
+            table.name,
+            metadata,
+            *[
+                Column(column.name, column.type, primary_key=column.primary_key,
+                       nullable=column.nullable, index=column.index)
+                for column in table.columns
+            ],
+        )
+    return metadata
+
+
+class Shard:
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        self.session_maker = async_sessionmaker(engine, expire_on_commit=False)
+
+
+class ShardRouter:
+    def __init__(self, engines, previous_engines=(), vnodes: int = 64):
+        self.shards = self._make_shards(engines)
+        self.ring = HashRing(self.shards, vnodes)
+        # Во время перешардирования ссылка может ещё лежать на шарде из прежнего кольца
+        self.previous_shards = self._make_shards(previous_engines, known=self.shards)
+        self.previous_ring = HashRing(self.previous_shards, vnodes) if self.previous_shards else None
+
+    @staticmethod
+    def _make_shards(engines, known=None) -> dict:
+        known = known or {}
+        shards = {}
+        for engine in engines:
+            name = engine.url.render_as_string(hide_password=True)
+            shards[name] = known.get(name) or Shard(name, engine)
+        return shards
+
+    def shard_for(self, short_code: str) -> Shard:
+        return self.shards[self.ring.node_for(short_code)]
+
+    def same_shard(self, first_code: str, second_code: str) -> bool:
+        return self.ring.node_for(first_code) == self.ring.node_for(second_code)
+
+    def placed_on(self, session: AsyncSession, short_code: str) -> bool:
+        """Сессия открыта на шарде, куда short_code попадает по текущему кольцу."""
+        return session.bind is self.shard_for(short_code).engine
+
+    async def locate(self, short_code: str) -> Shard:
+        shard = self.shard_for(short_code)
+        if self.previous_ring is None:
+            return shard
+        previous = self.previous_shards[self.previous_ring.node_for(short_code)]
+        if previous is shard:
+            return shard
+        async with shard.session_maker() as session:
+            found = await session.scalar(select(Link.short_code).where(Link.short_code == short_code))
+        return shard if found else previous
+
+    @asynccontextmanager
+    async def session_for(self, short_code: str) -> AsyncSession:
+        shard = await self.locate(short_code)
+        async with shard.session_maker() as session:
+            yield session
+
+    def all_shards(self) -> list:
+        shards = list(self.shards.values())
+        shards.extend(shard for shard in self.previous_shards.values() if shard not in shards)
+        return shards
+
+    async def gather(self, query_fn) -> list:
+        """Параллельно выполняет query_fn(session) на каждом шарде и объединяет списки."""
+
+        async def run(shard):
+            async with shard.session_maker() as session:
+                return await query_fn(session)
+
+        results = await asyncio.gather(*(run(shard) for shard in self.all_shards()))
+        return [row for rows in results for row in rows]
+
+    async def create_tables(self):
+        metadata = shard_metadata()
+        for shard in self.all_shards():
+            async with shard.engine.begin() as conn:
+                await conn.run_sync(metadata.create_all)
+
+    async def dispose(self):
+        for shard in self.all_shards():
+            await shard.engine.dispose()
+
+
+def copy_link(link: Link, short_code: str) -> Link:
+    return Link(
+        short_code=short_code,
+        custom_alias=link.custom_alias,
+        original_url=link.original_url,
+        url_id=link.url_id,
+        created_at=link.created_at,
+        updated_at=link.updated_at,
+        last_accessed_at=link.last_accessed_at,
+        click_count=link.click_count,
+        expires_at=link.expires_at,
+        track_clicks=link.track_clicks,
+        user_id=link.user_id,
+    )
+
+
+async def move_links(source: AsyncSession, target: AsyncSession, links) -> int:
+    """Копирует ссылки и их историю в target, затем удаляет их из source."""
+    codes = [link.short_code for link in links]
+    if not codes:
+        return 0
+    history = (
+        await source.execute(select(LinkHistory).where(LinkHistory.short_code.in_(codes)))
+    ).scalars().all()
+    copied_history = set(
+        (await target.execute(
+            select(LinkHistory.id).where(LinkHistory.id.in_([entry.id for entry in history]))
+        )).scalars()
+    )
+
+    conflicts = await copy_urls(
+        source, target, [link.url_id for link in links] + [entry.url_id for entry in history]
+    )
+    existing = set(
+        (await target.execute(select(Link.short_code).where(Link.short_code.in_(codes)))).scalars()
+    )
+    copies = [copy_link(link, link.short_code) for link in links if link.short_code not in existing]
+    copies += [
+        LinkHistory(
+            id=entry.id,
+            short_code=entry.short_code,
+            original_url=entry.original_url,
+            url_id=entry.url_id,
+            expires_at=entry.expires_at,
+            click_count=entry.click_count,
+            created_at=entry.created_at,
+            user_id=entry.user_id,
+        )
+        for entry in history
+        if entry.id not in copied_history
+    ]
+    inline_urls(copies, conflicts)
+    target.add_all(copies)
+    # Сначала фиксируем копию, и только потом удаляем оригинал: при сбое строка не теряется
+    await target.commit()
+
+    await source.execute(delete(LinkHistory).where(LinkHistory.short_code.in_(codes)))
+    await source.execute(delete(Link).where(Link.short_code.in_(codes)))
+    await source.commit()
+    return len(codes)
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class TaskSupervisor:
+    """Отслеживает фоновые корутины процесса и останавливает их при завершении.
+
+    Служебные циклы (service=True) при остановке отменяются, разовые задачи
+    дорабатывают до дедлайна. Цикл, переданный функцией, а не корутиной,
+    после ошибки перезапускается с паузой, которая удваивается от
+    restart_delay до restart_max_delay. Затем выполняются сбросы буферов (on_drain) —
+    тоже в пределах дедлайна — и закрытие соединений (on_close), которое
+    выполняется всегда.
+    """
+
+    def __init__(self, restart_delay: float = 1.0, restart_max_delay: float = 60.0):
+        self.accepting = True
+        self.tasks = set()
+        self.services = set()
+        self.restarts = Counter()
+        self.restart_delay = restart_delay
+        self.restart_max_delay = restart_max_delay
+        self._drain_hooks = []
+        self._close_hooks = []
+
+    def spawn(self, coro, name: str = None, service: bool = False) -> asyncio.Task:
+        if not self.accepting:
+            if asyncio.iscoroutine(coro):
+                coro.close()
+            raise RuntimeError("Supervisor is shutting down, no new tasks are accepted")
+        if not asyncio.iscoroutine(coro):
+            coro = self._restarting(coro, name or coro.__name__)
+        task = asyncio.create_task(coro, name=name)
+        (self.services if service else self.tasks).add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        self.services.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background task {task.get_name()} failed: {task.exception()!r}")
+
+    async def _restarting(self, factory, name: str):
+        failures = 0
+        while True:
+            started = time.monotonic()
+            try:
+                return await factory()
+            except Exception as e:
+                if not self.accepting:
+                    raise
+                # Цикл, проработавший дольше максимальной паузы, снова перезапускается быстро
+                if time.monotonic() - started > self.restart_max_delay:
+                    failures = 0
+                delay = min(self.restart_max_delay, self.restart_delay * 2 ** failures)
+                failures += 1
+                self.restarts[name] += 1
+                logger.error(f"Background task {name} failed: {e!r}, restarting in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def on_drain(self, hook):
+        self._drain_hooks.append(hook)
+        return hook
+
+    def on_close(self, hook):
+        self._close_hooks.append(hook)
+        return hook
+
+    def status(self) -> dict:
+        return {
+            "accepting": self.accepting,
+            "tasks": len(self.tasks),
+            "services": sorted(task.get_name() for task in self.services),
+            "restarts": dict(self.restarts),
+        }
+
+    async def shutdown(self, timeout: float):
+        self.accepting = False
+        deadline = time.monotonic() + timeout
+        try:
+            if self.tasks:
+                _, pending = await asyncio.wait(set(self.tasks), timeout=timeout)
+                if pending:
+                    logger.warning(f"Cancelling {len(pending)} background tasks after deadline")
+                    await self._cancel(pending)
+            await self._cancel(set(self.services))
+
+            for hook in self._drain_hooks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"Shutdown deadline passed, skipping {hook.__name__}")
+                    continue
+                try:
+                    await asyncio.wait_for(hook(), remaining)
+                except Exception as e:
+                    logger.error(f"Shutdown drain {hook.__name__} failed: {e!r}")
+        finally:
+            for hook in self._close_hooks:
+                try:
+                    await hook()
+                except Exception as e:
+                    logger.error(f"Shutdown close {hook.__name__} failed: {e!r}")
+
+    @staticmethod
+    async def _cancel(tasks):
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+supervisor = TaskSupervisor()
@@ -1,20 +1,59 @@
 import asyncio
-from datetime import datetime
+import fcntl
+import logging
+import os
+import time
+from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import delete
+from sqlalchemy import delete, update
 from app.models import Link, LinkHistory
-from app.database import async_session_maker 
+from app.coldstore import compact_history
+from app.database import async_session_maker, replica_router, shard_router
+from app.invalidation import invalidate_links, invalidate_stats
+from app.metrics import CallbackMetric, Counter, Histogram
+from app.tracing import traced
+from app.redis import pop_pending_clicks, record_clicks, restore_pending_clicks
+from app.supervisor import supervisor
+from app.workqueue import CoalescingQueue
+from config import (
+    BACKGROUND_LOCK_FILE,
+    BACKGROUND_LOCK_RETRY,
+    CLICK_FLUSH_BATCH,
+    CLICK_FLUSH_INTERVAL,
+    CLICK_QUEUE_BATCH,
+    CLICK_QUEUE_POLICY,
+    CLICK_QUEUE_PUT_TIMEOUT,
+    CLICK_QUEUE_SIZE,
+    CLICK_QUEUE_WORKERS,
+    COLD_AFTER_DAYS,
+    COLD_COMPACTION_INTERVAL,
+    COLD_STORAGE_DIR,
+    DB_REPLICA_CHECK_INTERVAL,
+)
 
+logger = logging.getLogger(__name__)
+
+EXPIRY_SWEEP_SECONDS = Histogram(
+    "expiry_sweep_duration_seconds", "Duration of one expired links sweep over a database",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+EXPIRED_LINKS_MOVED = Counter("expired_links_moved_total", "Expired links moved to link_history")
+
+
+@traced("job.delete_expired_links", job=True)
 async def delete_expired_links(db: AsyncSession):
+    start = time.perf_counter()
     current_time = datetime.utcnow()
     result = await db.execute(select(Link).filter(Link.expires_at < current_time))
     expired_links = result.scalars().all()
 
+    moved = []
     for link in expired_links:
         link_history = LinkHistory(
             short_code=link.short_code,
             original_url=link.original_url,
+            url_id=link.url_id,
             expires_at=link.expires_at,
             click_count=link.click_count,
             user_id=link.user_id
@@ -22,10 +61,202 @@ async def delete_expired_links(db: AsyncSession):
         db.add(link_history)
         await db.execute(delete(Link).where(Link.short_code == link.short_code))
         await db.commit()
-        print(f"Moved expired link {link.short_code} to history and deleted.")
+        moved.append(link.short_code)
+
+    await invalidate_links(*moved)
+    EXPIRED_LINKS_MOVED.inc(len(moved))
+    EXPIRY_SWEEP_SECONDS.observe(time.perf_counter() - start)
+    if moved:
+        logger.info(f"Moved {len(moved)} expired links to history")
+
+
+def link_session_makers():
+    if shard_router is None:
+        return [async_session_maker]
+    return [shard.session_maker for shard in shard_router.all_shards()]
+
+
+def session_maker_for(short_code: str):
+    if shard_router is None:
+        return async_session_maker
+    return shard_router.shard_for(short_code).session_maker
+
+
+async def count_clicks(clicks: dict):
+    """Учитывает пачку переходов {short_code: (count, last_accessed_at)}."""
+    if await record_clicks(clicks):
+        return
+    # Redis недоступен: переходы сразу записываем в БД, чтобы они не потерялись
+    by_session_maker = {}
+    for short_code, click in clicks.items():
+        by_session_maker.setdefault(session_maker_for(short_code), {})[short_code] = click
+    for session_maker, clicks_by_code in by_session_maker.items():
+        async with session_maker() as session:
+            for short_code, (count, last_accessed_at) in clicks_by_code.items():
+                await session.execute(
+                    update(Link)
+                    .where(Link.short_code == short_code)
+                    .values(
+                        click_count=Link.click_count + count,
+                        last_accessed_at=last_accessed_at,
+                    )
+                )
+            await session.commit()
+
+
+def merge_clicks(old, new):
+    return old[0] + new[0], max(old[1], new[1])
+
+
+def merge_pending(target: dict, pending: dict):
+    for short_code, clicks in pending.items():
+        target[short_code] = merge_clicks(target[short_code], clicks) if short_code in target else clicks
+
+
+# Переходы учитываются после ответа: одинаковые коды, ждущие в очереди,
+# складываются в один счётчик, а пачка уходит в Redis одним конвейером
+click_queue = CoalescingQueue(
+    "clicks",
+    count_clicks,
+    merge=merge_clicks,
+    maxsize=CLICK_QUEUE_SIZE,
+    workers=CLICK_QUEUE_WORKERS,
+    batch_size=CLICK_QUEUE_BATCH,
+    policy=CLICK_QUEUE_POLICY,
+    put_timeout=CLICK_QUEUE_PUT_TIMEOUT,
+)
+
+CallbackMetric(
+    "work_queue_depth", "Items waiting in a background work queue", "gauge", ("queue",),
+    lambda: [((click_queue.name,), len(click_queue.pending))],
+)
+CallbackMetric(
+    "work_queue_items_total", "Background work queue items by outcome", "counter", ("queue", "event"),
+    lambda: [((click_queue.name, event), value) for event, value in click_queue.stats.items()],
+)
+
+
+# Переходы, которые не удалось ни записать в БД, ни вернуть в Redis:
+# следующий сброс записывает их вместе с новыми
+unflushed_clicks = {}
+
+
+@traced("job.flush_click_counters", job=True)
+async def flush_click_counters(batch_size: int = CLICK_FLUSH_BATCH) -> int:
+    pending = dict(await pop_pending_clicks(batch_size))
+    merge_pending(pending, unflushed_clicks)
+    unflushed_clicks.clear()
+    if not pending:
+        return 0
+
+    by_session_maker = {}
+    for short_code, clicks in pending.items():
+        by_session_maker.setdefault(session_maker_for(short_code), {})[short_code] = clicks
+
+    flushed = {}
+    try:
+        for session_maker, clicks_by_code in by_session_maker.items():
+            async with session_maker() as session:
+                for short_code, (count, last_accessed_at) in clicks_by_code.items():
+                    await session.execute(
+                        update(Link)
+                        .where(Link.short_code == short_code)
+                        .values(
+                            click_count=Link.click_count + count,
+                            last_accessed_at=last_accessed_at,
+                        )
+                    )
+                await session.commit()
+            flushed.update(clicks_by_code)
+    except (Exception, asyncio.CancelledError):
+        # Непереданные в БД переходы возвращаем в Redis до следующей попытки,
+        # в том числе если задачу отменили при остановке процесса
+        remaining = {k: v for k, v in pending.items() if k not in flushed}
+        try:
+            await restore_pending_clicks(remaining)
+        except (Exception, asyncio.CancelledError) as e:
+            logger.warning(f"Failed to restore {len(remaining)} click counters to Redis, keeping them: {e!r}")
+            merge_pending(unflushed_clicks, remaining)
+        raise
+    finally:
+        await invalidate_stats(list(flushed))
+    return len(flushed)
+
 
 async def periodic_task():
     while True:
-        async with async_session_maker() as session:
-            await delete_expired_links(session)
+        # Перед переносом в историю досчитываем переходы по истекающим ссылкам
+        try:
+            await flush_click_counters()
+        except Exception as e:
+            logger.error(f"Failed to flush click counters: {e}")
+        for session_maker in link_session_makers():
+            try:
+                async with session_maker() as session:
+                    await delete_expired_links(session)
+            except Exception as e:
+                logger.error(f"Failed to delete expired links: {e}")
         await asyncio.sleep(300)
+
+
+async def cold_compaction_task():
+    while True:
+        older_than = datetime.utcnow() - timedelta(days=COLD_AFTER_DAYS)
+        for session_maker in link_session_makers():
+            try:
+                async with session_maker() as session:
+                    await compact_history(session, older_than)
+            except Exception as e:
+                logger.error(f"Failed to compact link history: {e}")
+        await asyncio.sleep(COLD_COMPACTION_INTERVAL)
+
+
+async def replica_health_task():
+    while True:
+        await replica_router.check_replicas()
+        await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+
+
+async def drain_click_counters():
+    while await flush_click_counters() >= CLICK_FLUSH_BATCH:
+        pass
+
+
+async def click_flush_task():
+    while True:
+        await asyncio.sleep(CLICK_FLUSH_INTERVAL)
+        try:
+            await drain_click_counters()
+        except Exception as e:
+            logger.error(f"Failed to flush click counters: {e}")
+
+
+_background_lock = None
+
+
+def acquire_background_lock(path: str = BACKGROUND_LOCK_FILE) -> bool:
+    """Берёт блокировку без ожидания; она держится, пока процесс жив."""
+    global _background_lock
+    if _background_lock is not None:
+        return True
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _background_lock = lock_file
+    return True
+
+
+async def background_jobs_task():
+    # Если процесс с блокировкой завершится, задачи подхватит другой воркер
+    while not acquire_background_lock():
+        await asyncio.sleep(BACKGROUND_LOCK_RETRY)
+    logger.info(f"Background jobs run in process {os.getpid()}")
+    # Каждое задание — отдельный цикл супервизора: упавшее перезапускается, остальные не затрагиваются
+    jobs = [periodic_task, click_flush_task]
+    if COLD_STORAGE_DIR:
+        jobs.append(cold_compaction_task)
+    for job in jobs:
+        supervisor.spawn(job, name=job.__name__, service=True)
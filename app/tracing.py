@@ -0,0 +1,340 @@
+import asyncio
+import functools
+import json
+import logging
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+import httpx
+from config import (
+    OTLP_ENDPOINT,
+    TRACE_BUFFER_SIZE,
+    TRACE_FILE,
+    TRACE_FLUSH_INTERVAL,
+    TRACE_SAMPLE_RATE,
+    TRACE_TRUST_PARENT,
+    TRACING_EXPORTER,
+)
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "short-links"
+
+_current_span = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "start", "end", "attributes", "error", "_token")
+
+    def __init__(self, tracer, name: str, trace_id: str, parent_id: str = None, attributes: dict = None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+        self._token = None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.error = repr(exc)
+        self.end = time.time_ns()
+        self.tracer.finish(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start,
+            "end_time_unix_nano": self.end,
+            "duration_ms": (self.end - self.start) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class NoopSpan:
+    """Заглушка для невыбранных трасс: ничего не создаёт и не записывает."""
+
+    __slots__ = ()
+
+    def set(self, key: str, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(spans) -> dict:
+    """Тело запроса OTLP/HTTP в JSON-кодировке (ExportTraceServiceRequest)."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": [
+                    {
+                        "traceId": span.trace_id,
+                        "spanId": span.span_id,
+                        "parentSpanId": span.parent_id or "",
+                        "name": span.name,
+                        "kind": 1,
+                        "startTimeUnixNano": str(span.start),
+                        "endTimeUnixNano": str(span.end),
+                        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                        "status": {"code": 2, "message": span.error} if span.error else {"code": 0},
+                    }
+                    for span in spans
+                ],
+            }],
+        }],
+    }
+
+
+class MemoryExporter:
+    """Последние size спанов в памяти процесса; видны в GET /internal/traces."""
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE):
+        self.spans = deque(maxlen=size)
+
+    async def export(self, spans):
+        self.spans.extend(spans)
+
+
+class NDJSONExporter:
+    """Дописывает спаны в файл, по одному JSON-объекту на строку."""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+
+    def _write(self, lines: str):
+        with open(self.path, "a", encoding="utf-8") as trace_file:
+            trace_file.write(lines)
+
+    async def export(self, spans):
+        lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+        await asyncio.to_thread(self._write, lines)
+
+
+class OTLPExporter:
+    """Отправляет спаны коллектору OpenTelemetry по OTLP/HTTP (JSON)."""
+
+    def __init__(self, endpoint: str = OTLP_ENDPOINT, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    async def export(self, spans):
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.post(self.endpoint, json=otlp_payload(spans))
+            response.raise_for_status()
+
+
+EXPORTERS = {
+    "memory": MemoryExporter,
+    "ndjson": NDJSONExporter,
+    "otlp": OTLPExporter,
+}
+
+
+class Tracer:
+    """Создаёт спаны и копит завершённые до отправки экспортёру.
+
+    Решение о записи трассы принимается в корневом спане (head sampling):
+    в невыбранной трассе span() возвращает NOOP_SPAN, и вложенные вызовы
+    обходятся одним чтением contextvar. Буфер ограничен max_buffer,
+    лишние спаны отбрасываются.
+    """
+
+    def __init__(self, exporter=None, sample_rate: float = TRACE_SAMPLE_RATE, max_buffer: int = TRACE_BUFFER_SIZE):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.max_buffer = max_buffer
+        self.buffer = []
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def should_sample(self) -> bool:
+        return self.exporter is not None and random.random() < self.sample_rate
+
+    def start_trace(self, name: str, sampled: bool = None, trace_id: str = None, parent_id: str = None,
+                    attributes: dict = None):
+        """Корневой спан запроса или фоновой задачи."""
+        if self.exporter is None:
+            return NOOP_SPAN
+        if sampled is None:
+            sampled = self.should_sample()
+        if not sampled:
+            return NOOP_SPAN
+        return Span(self, name, trace_id or f"{random.getrandbits(128):032x}", parent_id, attributes)
+
+    def span(self, name: str, attributes: dict = None):
+        # Атрибуты на горячих путях лучше задавать через span.set: у NOOP_SPAN это пустой вызов
+        parent = _current_span.get()
+        if parent is None:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+    def record(self, name: str, start: int, end: int, attributes: dict = None):
+        """Спан уже завершённой операции, например SQL-запроса из события движка."""
+        parent = _current_span.get()
+        if parent is None:
+            return
+        span = Span(self, name, parent.trace_id, parent.span_id, attributes)
+        span.start = start
+        span.end = end
+        self.finish(span)
+
+    def finish(self, span: Span):
+        if len(self.buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self.buffer.append(span)
+
+    async def flush(self):
+        if not self.buffer or self.exporter is None:
+            return
+        spans, self.buffer = self.buffer, []
+        try:
+            await self.exporter.export(spans)
+        except Exception as e:
+            logger.error(f"Failed to export {len(spans)} spans: {e!r}")
+
+    async def flush_task(self):
+        while True:
+            await asyncio.sleep(TRACE_FLUSH_INTERVAL)
+            await self.flush()
+
+
+def create_tracer(name: str = TRACING_EXPORTER) -> Tracer:
+    if not name:
+        return Tracer()
+    if name not in EXPORTERS:
+        raise ValueError(f"Unknown tracing exporter: {name}")
+    return Tracer(EXPORTERS[name]())
+
+
+tracer = create_tracer()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def traced(name: str, job: bool = False):
+    """Оборачивает корутину в спан; job=True начинает новую трассу, если её ещё нет.
+
+    Фоновые задачи редки, поэтому их трассы записываются всегда.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            span = tracer.span(name)
+            if job and span is NOOP_SPAN:
+                span = tracer.start_trace(name, sampled=True)
+            with span:
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def parse_traceparent(value: str):
+    """(trace_id, parent_id, sampled) из заголовка W3C traceparent или None.
+
+    flags — шестнадцатеричный байт, sampled — его младший бит.
+    """
+    parts = value.split("-")
+    if [len(part) for part in parts] != [2, 32, 16, 2]:
+        return None
+    try:
+        version, _, _, flags = (int(part, 16) for part in parts)
+    except ValueError:
+        return None
+    if version == 0xFF:
+        return None
+    return parts[1], parts[2], bool(flags & 0x01)
+
+
+class TracingMiddleware:
+    """Корневой спан каждого HTTP-запроса; учитывает входящий заголовок traceparent.
+
+    Из заголовка берутся trace id и родительский спан. Решение о записи берётся
+    из его флага только при trust_parent, иначе запрос выбирается локально.
+    """
+
+    def __init__(self, app, tracer: Tracer = tracer, trust_parent: bool = TRACE_TRUST_PARENT):
+        self.app = app
+        self.tracer = tracer
+        self.trust_parent = trust_parent
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = parent_id = sampled = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                parsed = parse_traceparent(value.decode("latin-1"))
+                if parsed is not None:
+                    trace_id, parent_id, sampled = parsed
+                    if not self.trust_parent:
+                        sampled = None
+                break
+        if sampled is None:
+            sampled = self.tracer.should_sample()
+        if not sampled:
+            await self.app(scope, receive, send)
+            return
+
+        span = self.tracer.start_trace(
+            "http.request", sampled=True, trace_id=trace_id, parent_id=parent_id,
+            attributes={"http.method": scope["method"], "http.target": scope["path"]},
+        )
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                span.set("http.status_code", message["status"])
+            await send(message)
+
+        with span:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    span.set("http.route", route.path)
+                    span.name = f"{scope['method']} {route.path}"
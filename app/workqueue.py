@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DROP_NEW = "drop_new"
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+POLICIES = (DROP_NEW, DROP_OLDEST, BLOCK)
+
+
+class CoalescingQueue:
+    """Ограниченная очередь фоновой работы с объединением задач по ключу.
+
+    Пока задача с ключом ждёт в очереди, новая задача с тем же ключом не
+    добавляет элемент, а объединяется с ожидающей через merge(old, new).
+    Обработчик получает пачку {ключ: элемент} размером до batch_size.
+    При переполнении: drop_new отбрасывает новую задачу, drop_oldest — самую
+    старую, block ждёт места до put_timeout и затем отбрасывает новую.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler,
+        merge=None,
+        maxsize: int = 10000,
+        workers: int = 2,
+        batch_size: int = 500,
+        policy: str = DROP_OLDEST,
+        put_timeout: float = 0.05,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.name = name
+        self.handler = handler
+        self.merge = merge
+        self.maxsize = maxsize
+        self.workers = workers
+        self.batch_size = batch_size
+        self.policy = policy
+        self.put_timeout = put_timeout
+        self.pending = OrderedDict()
+        self.running = False
+        self._has_items = asyncio.Event()
+        self._has_space = asyncio.Event()
+        self._has_space.set()
+        self.stats = {
+            "enqueued": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "processed": 0,
+            "batches": 0,
+            "failures": 0,
+        }
+
+    def put_nowait(self, key, item) -> bool:
+        if key in self.pending:
+            old = self.pending[key]
+            self.pending[key] = self.merge(old, item) if self.merge else item
+            self.stats["coalesced"] += 1
+            return True
+        if len(self.pending) >= self.maxsize:
+            if self.policy != DROP_OLDEST:
+                self.stats["dropped"] += 1
+                return False
+            self.pending.popitem(last=False)
+            self.stats["dropped"] += 1
+        self.pending[key] = item
+        self.stats["enqueued"] += 1
+        self._has_items.set()
+        if len(self.pending) >= self.maxsize:
+            self._has_space.clear()
+        return True
+
+    async def submit(self, key, item) -> bool:
+        if not self.running:
+            # Без воркеров (скрипты, тесты) работа выполняется сразу
+            await self._process({key: item})
+            return True
+        if self.policy == BLOCK and key not in self.pending and len(self.pending) >= self.maxsize:
+            try:
+                await asyncio.wait_for(self._has_space.wait(), self.put_timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.put_nowait(key, item)
+
+    def _take_batch(self) -> dict:
+        batch = {}
+        while self.pending and len(batch) < self.batch_size:
+            key, item = self.pending.popitem(last=False)
+            batch[key] = item
+        if not self.pending:
+            self._has_items.clear()
+        self._has_space.set()
+        return batch
+
+    async def _process(self, batch: dict):
+        try:
+            await self.handler(batch)
+        except Exception as e:
+            self.stats["failures"] += 1
+            logger.error(f"Queue {self.name} failed to process {len(batch)} items: {e!r}")
+            return
+        self.stats["batches"] += 1
+        self.stats["processed"] += len(batch)
+
+    def _requeue(self, batch: dict):
+        """Возвращает пачку в начало очереди; пришедшие позже задачи с тем же ключом объединяются с ней."""
+        for key, item in reversed(batch.items()):
+            if key in self.pending:
+                newer = self.pending[key]
+                self.pending[key] = self.merge(item, newer) if self.merge else newer
+            else:
+                self.pending[key] = item
+            self.pending.move_to_end(key, last=False)
+        if self.pending:
+            self._has_items.set()
+
+    async def _worker(self):
+        while True:
+            await self._has_items.wait()
+            batch = self._take_batch()
+            if batch:
+                try:
+                    await self._process(batch)
+                except asyncio.CancelledError:
+                    # Воркер отменили при остановке: пачку обработает drain
+                    self._requeue(batch)
+                    raise
+
+    def start(self, supervisor):
+        self.running = True
+        for number in range(self.workers):
+            supervisor.spawn(self._worker, name=f"{self.name}_worker_{number}", service=True)
+
+    async def drain(self):
+        """Обрабатывает всё, что осталось в очереди; вызывается при остановке."""
+        self.running = False
+        while self.pending:
+            await self._process(self._take_batch())
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "depth": len(self.pending),
+            "maxsize": self.maxsize,
+            "policy": self.policy,
+            **self.stats,
+        }
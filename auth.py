@@ -11,6 +11,7 @@ from db import get_async_session
 from fastapi import Security
 from pydantic import BaseModel, EmailStr
 from config import SECRET_KEY
+from app.tracing import traced
 SECRET_KEY = SECRET_KEY
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
@@ -78,6 +79,7 @@ async def register_user(user: UserCreate, db: AsyncSession = Depends(get_async_s
 class TokenData(BaseModel):
     username: Optional[str] = None
     
+@traced("auth.resolve_user")
 async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_session)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -98,6 +100,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     except jwt.PyJWTError:
         raise credentials_exception 
     
+@traced("auth.resolve_user")
 async def get_current_user_optional(
     token: Optional[str] = Depends(oauth2_scheme),
     db: AsyncSession = Depends(get_async_session)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -12,4 +13,169 @@ DB_NAME = os.getenv("DB_NAME")
 SECRET_KEY = os.getenv("SECRET_KEY")
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 REDIS_HOST = os.getenv("REDIS_HOST")
-REDIS_PORT = os.getenv("REDIS_PORT")
\ No newline at end of file
+REDIS_PORT = os.getenv("REDIS_PORT")
+# Служебные эндпоинты /internal/* отвечают только на заголовок INTERNAL_HEADER
+# со значением INTERNAL_TOKEN; без INTERNAL_TOKEN они закрыты
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN", "")
+INTERNAL_HEADER = os.getenv("INTERNAL_HEADER", "X-Internal-Token")
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+DB_ECHO = _env_bool("DB_ECHO", False)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Число процессов сервера, server.py выставляет его для своих воркеров
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Общий лимит соединений с одной БД на все процессы, 0 — размеры пула заданы явно
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "0"))
+
+
+def split_connection_budget(total: int, workers: int):
+    """Доля процесса в лимите соединений: две трети на пул, остальное на переполнение."""
+    per_worker = max(1, total // max(1, workers))
+    max_overflow = per_worker // 3
+    return per_worker - max_overflow, max_overflow
+
+
+if DB_MAX_CONNECTIONS:
+    DB_POOL_SIZE, DB_MAX_OVERFLOW = split_connection_budget(DB_MAX_CONNECTIONS, WEB_CONCURRENCY)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# Таймаут выполнения запроса в миллисекундах, 0 — без ограничения
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
+
+# Реплики для чтения: список URL через запятую, пусто — все запросы идут в основную БД
+DB_REPLICA_URLS = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+DB_REPLICA_STRATEGY = os.getenv("DB_REPLICA_STRATEGY", "round_robin")
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_RETRY_AFTER = float(os.getenv("DB_REPLICA_RETRY_AFTER", "30"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "10"))
+# Сколько секунд после записи чтения того же клиента идут в основную БД
+DB_READ_YOUR_WRITES_WINDOW = float(os.getenv("DB_READ_YOUR_WRITES_WINDOW", "5"))
+
+# Шардирование таблиц links/link_history по short_code: список URL через запятую, пусто — без шардов
+DB_SHARD_URLS = [url.strip() for url in os.getenv("DB_SHARD_URLS", "").split(",") if url.strip()]
+# Прежний набор шардов на время перешардирования, чтения ищут ссылку и там
+DB_SHARD_PREVIOUS_URLS = [
+    url.strip() for url in os.getenv("DB_SHARD_PREVIOUS_URLS", "").split(",") if url.strip()
+]
+DB_SHARD_VNODES = int(os.getenv("DB_SHARD_VNODES", "64"))
+
+# Как часто переносить накопленные в Redis переходы в БД, в секундах
+CLICK_FLUSH_INTERVAL = float(os.getenv("CLICK_FLUSH_INTERVAL", "5"))
+CLICK_FLUSH_BATCH = int(os.getenv("CLICK_FLUSH_BATCH", "1000"))
+
+# Новые ссылки хранят адрес в таблице urls и ссылаются на него по url_id;
+# URL_CACHE_SIZE — сколько адресов держать в памяти процесса для редиректов
+NORMALIZE_URLS = _env_bool("NORMALIZE_URLS", False)
+URL_CACHE_SIZE = int(os.getenv("URL_CACHE_SIZE", "10000"))
+
+# Выгрузка /links/export: сколько выгрузок может идти одновременно в процессе
+# и сколько строк читать из курсора БД за раз
+EXPORT_MAX_CONCURRENCY = int(os.getenv("EXPORT_MAX_CONCURRENCY", "4"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Холодное хранилище истории (app/coldstore.py): каталог сегментов на локальном
+# диске (пусто — выключено), возраст истёкших ссылок для переноса, число корзин
+# пользователей и как часто фоновая задача переносит историю, в секундах
+COLD_STORAGE_DIR = os.getenv("COLD_STORAGE_DIR", "")
+COLD_AFTER_DAYS = int(os.getenv("COLD_AFTER_DAYS", "365"))
+COLD_USER_BUCKETS = int(os.getenv("COLD_USER_BUCKETS", "16"))
+COLD_COMPACTION_INTERVAL = float(os.getenv("COLD_COMPACTION_INTERVAL", "86400"))
+
+# Формат записи значений в кэш: json (по умолчанию) — прежний формат, который
+# понимают и старые версии приложения, или msgpack; читаются оба
+CACHE_CODEC = os.getenv("CACHE_CODEC", "json")
+
+# Таймауты Redis в секундах: зависший Redis не должен задерживать редирект
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.1"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "0.2"))
+# После стольких ошибок подряд Redis пропускается на REDIS_BREAKER_RESET секунд
+REDIS_BREAKER_FAILURES = int(os.getenv("REDIS_BREAKER_FAILURES", "5"))
+REDIS_BREAKER_RESET = float(os.getenv("REDIS_BREAKER_RESET", "5"))
+
+# Несколько узлов кэша: "host:port,host:port". Ключи распределяются
+# консистентным хешированием на клиенте или, при REDIS_CLUSTER=true, Redis Cluster
+REDIS_NODES = [node.strip() for node in os.getenv("REDIS_NODES", "").split(",") if node.strip()]
+REDIS_CLUSTER = _env_bool("REDIS_CLUSTER", False)
+
+# Фоновые задачи выполняет один процесс — тот, что взял файловую блокировку
+BACKGROUND_LOCK_FILE = os.getenv(
+    "BACKGROUND_LOCK_FILE", os.path.join(tempfile.gettempdir(), "short_links_background.lock")
+)
+BACKGROUND_LOCK_RETRY = float(os.getenv("BACKGROUND_LOCK_RETRY", "30"))
+
+# Редирект из кэша отдаётся ASGI-обработчиком в обход FastAPI (app/fastpath.py)
+FAST_REDIRECT = _env_bool("FAST_REDIRECT", True)
+
+# Сколько секунд браузеры и CDN могут кэшировать редирект ссылки без учёта переходов
+REDIRECT_MAX_AGE = int(os.getenv("REDIRECT_MAX_AGE", "86400"))
+
+# За сколько секунд при остановке процесса нужно доделать фоновые задачи и сбросить буферы
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+
+# Очередь учёта переходов: размер, число воркеров, размер пачки и что делать
+# при переполнении (drop_oldest, drop_new или block на CLICK_QUEUE_PUT_TIMEOUT секунд)
+CLICK_QUEUE_SIZE = int(os.getenv("CLICK_QUEUE_SIZE", "10000"))
+CLICK_QUEUE_WORKERS = int(os.getenv("CLICK_QUEUE_WORKERS", "2"))
+CLICK_QUEUE_BATCH = int(os.getenv("CLICK_QUEUE_BATCH", "500"))
+CLICK_QUEUE_POLICY = os.getenv("CLICK_QUEUE_POLICY", "drop_oldest")
+CLICK_QUEUE_PUT_TIMEOUT = float(os.getenv("CLICK_QUEUE_PUT_TIMEOUT", "0.05"))
+
+# Ограничение одновременных запросов: общий лимит процесса и лимит, длина очереди
+# и время ожидания в секундах для каждого класса (редиректы, чтения, записи)
+ADMISSION_CONTROL = _env_bool("ADMISSION_CONTROL", True)
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "100"))
+ADMISSION_REDIRECT_LIMIT = int(os.getenv("ADMISSION_REDIRECT_LIMIT", "100"))
+ADMISSION_REDIRECT_QUEUE = int(os.getenv("ADMISSION_REDIRECT_QUEUE", "1000"))
+ADMISSION_REDIRECT_TIMEOUT = float(os.getenv("ADMISSION_REDIRECT_TIMEOUT", "0.5"))
+ADMISSION_READ_LIMIT = int(os.getenv("ADMISSION_READ_LIMIT", "40"))
+ADMISSION_READ_QUEUE = int(os.getenv("ADMISSION_READ_QUEUE", "200"))
+ADMISSION_READ_TIMEOUT = float(os.getenv("ADMISSION_READ_TIMEOUT", "2"))
+ADMISSION_WRITE_LIMIT = int(os.getenv("ADMISSION_WRITE_LIMIT", "20"))
+ADMISSION_WRITE_QUEUE = int(os.getenv("ADMISSION_WRITE_QUEUE", "100"))
+ADMISSION_WRITE_TIMEOUT = float(os.getenv("ADMISSION_WRITE_TIMEOUT", "2"))
+
+# Метрики Prometheus на /metrics и замер времени ответа каждого маршрута
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", True)
+
+# Профилирование отдельных запросов: по заголовку, подписанному PROFILE_SECRET,
+# и доле PROFILE_SAMPLE_RATE остальных; стеки снимаются раз в PROFILE_INTERVAL секунд
+PROFILING_ENABLED = _env_bool("PROFILING_ENABLED", False)
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile-Token")
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", SECRET_KEY)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+PROFILE_STORE_SIZE = int(os.getenv("PROFILE_STORE_SIZE", "20"))
+
+# Журнал медленных запросов к БД и бюджет запросов на один HTTP-запрос
+# по имени обработчика: QUERY_BUDGETS=redirect_link=1,shorten_link=3
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+QUERY_BUDGET_DEFAULT = int(os.getenv("QUERY_BUDGET_DEFAULT", "10"))
+QUERY_BUDGETS = {
+    name.strip(): int(budget)
+    for name, _, budget in (
+        item.partition("=") for item in os.getenv("QUERY_BUDGETS", "").split(",") if item.strip()
+    )
+}
+
+# Трассировка: экспортёр memory, ndjson или otlp (пусто — выключена), доля
+# записываемых запросов и интервал отправки накопленных спанов в секундах
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.ndjson")
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "10000"))
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "5"))
+# Флаг sampled из входящего traceparent учитывается только за доверенным прокси
+# или шлюзом; иначе клиент мог бы заставить записывать каждый свой запрос
+TRACE_TRUST_PARENT = _env_bool("TRACE_TRUST_PARENT", False)
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Body
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request, Response
 from typing import Optional
 from pydantic import BaseModel, HttpUrl, Field
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -6,10 +6,53 @@ from sqlalchemy.future import select
 from datetime import datetime
 import uuid
 from fastapi.responses import RedirectResponse
-from app.database import get_async_session
-from app.models import Link, User, LinkHistory
+from app.database import (
+    fan_out,
+    get_async_session,
+    get_read_session,
+    get_shard_session,
+    link_session,
+    read_session_scope,
+    rename_link,
+)
+from app.models import Link, User
+from app.queries import (
+    fetch_expired_links,
+    fetch_link_stats,
+    fetch_links_by_url,
+    fetch_redirect_target,
+    short_code_exists,
+)
 from auth import get_current_user, get_current_user_optional
-from app.redis import get_cache, set_cache, delete_cache
+from app.redis import (
+    get_cache,
+    get_pending_clicks,
+    link_key,
+    move_pending_clicks,
+    set_cache,
+    stats_key,
+)
+from app.http_cache import etag_matches, redirect_policy, stats_etag
+from app.invalidation import (
+    invalidate_links,
+    link_version,
+    set_cache_if_version,
+    stats_version,
+    stats_version_key,
+)
+from app.tasks import click_queue
+from app.urls import resolve_url, store_url
+from app.coldstore import read_cold_history
+from app.export import (
+    MEDIA_TYPES,
+    ExportResponse,
+    ExportSlot,
+    decode_cursor,
+    encode_export,
+    export_records,
+    export_session_makers,
+)
+from config import EXPORT_BATCH_SIZE, EXPORT_MAX_CONCURRENCY, NORMALIZE_URLS
 
 router = APIRouter()
 
@@ -17,22 +60,20 @@ class ShortenLinkRequest(BaseModel):
     original_url: HttpUrl 
     custom_alias: Optional[str] = None
     expires_at: Optional[datetime] = None
+    track_clicks: bool = True
 
 class UpdateLinkRequest(BaseModel):
     custom_alias: Optional[str] = Field(None)
     expires_at: Optional[datetime] = Field(
         None)
+    track_clicks: Optional[bool] = Field(None)
     
 def generate_short_code():
     return str(uuid.uuid4().hex[:8]) 
 
-async def update_stats_cache(short_code: str, new_click_count: int, last_accessed_at: str):
-    stats_key = f"stats:{short_code}"
-    stats_data = {
-        "click_count": new_click_count,
-        "last_accessed_at": last_accessed_at,
-    }
-    await set_cache(stats_key, stats_data, expire=300)
+async def short_code_taken(session: AsyncSession, short_code: str) -> bool:
+    async with link_session(session, short_code) as link_db:
+        return await short_code_exists(link_db, short_code)
     
 @router.post("/links/shorten")
 async def shorten_link(
@@ -41,98 +82,129 @@ async def shorten_link(
     current_user: User = Depends(get_current_user_optional) 
 ):
     if request.custom_alias:
-        result = await session.execute(
-            select(Link).where(Link.short_code == request.custom_alias)
-        )
-        existing_link = result.scalars().first()
-
-        if existing_link:
+        if await short_code_taken(session, request.custom_alias):
             raise HTTPException(status_code=400, detail="Custom alias is already taken")
 
         short_code = request.custom_alias
     else:
         short_code = generate_short_code()
-        
-        result = await session.execute(
-            select(Link).where(Link.short_code == short_code)
-        )
-        existing_link = result.scalars().first()
-
-        while existing_link:
+        while await short_code_taken(session, short_code):
             short_code = generate_short_code()
-            result = await session.execute(
-                select(Link).where(Link.short_code == short_code)
-            )
-            existing_link = result.scalars().first()
                 
+    original_url = str(request.original_url)
     new_link = Link(
-        original_url=str(request.original_url),
+        original_url=original_url,
         short_code=short_code,
         expires_at=request.expires_at,
         user_id=current_user.id if current_user else None, 
-        custom_alias=request.custom_alias
+        custom_alias=request.custom_alias,
+        track_clicks=request.track_clicks,
     )
 
-    session.add(new_link)
-    await session.commit()
+    async with link_session(session, short_code) as link_db:
+        if NORMALIZE_URLS:
+            new_link.url_id = await store_url(link_db, original_url)
+            if new_link.url_id is not None:
+                new_link.original_url = None
+        link_db.add(new_link)
+        await link_db.commit()
     
-    cache_key = f"link:{short_code}"
-    await set_cache(cache_key, {"original_url": new_link.original_url}, expire=60)
+    cache_key = link_key(short_code)
+    await set_cache(
+        cache_key,
+        {
+            "original_url": original_url,
+            "expires_at": new_link.expires_at,
+            "track_clicks": new_link.track_clicks,
+        },
+        expire=60,
+    )
 
     return {"short_url": f"http://localhost:8000/{short_code}"}
 
+@router.get("/links/export")
+async def export_links(
+    export_format: str = Query("ndjson", alias="format", pattern="^(csv|ndjson)$"),
+    gzip: bool = False,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, gt=0),
+    session_makers: list = Depends(export_session_makers),
+    current_user: User = Depends(get_current_user),
+):
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid export cursor")
+    # Место занимается до ответа: иначе одновременные запросы проходят проверку
+    # раньше, чем хотя бы одно тело начнёт отправляться
+    slot = ExportSlot.reserve(EXPORT_MAX_CONCURRENCY)
+    if slot is None:
+        raise HTTPException(
+            status_code=503, detail="Too many exports in progress, retry later", headers={"Retry-After": "5"}
+        )
+
+    records = export_records(session_makers, current_user.id, cursor, limit, EXPORT_BATCH_SIZE)
+    filename = f"links.{export_format}{'.gz' if gzip else ''}"
+    return ExportResponse(
+        # При продолжении заголовок CSV уже есть у клиента
+        encode_export(records, export_format, compress=gzip, header=not cursor, slot=slot),
+        slot,
+        media_type="application/gzip" if gzip else MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
+
 @router.get("/{short_code}")
 async def redirect_link(
     short_code: str, 
+    request: Request,
     session: AsyncSession = Depends(get_async_session),
-    background_tasks: BackgroundTasks = BackgroundTasks()
 ):
     short_code = short_code.strip()
-    cache_key = f"link:{short_code}"
+    cache_key = link_key(short_code)
     cached_link = await get_cache(cache_key)
     
     if cached_link:
         original_url = cached_link.get("original_url")
+        expires_at = cached_link.get("expires_at")
+        track_clicks = cached_link.get("track_clicks", True)
     else:
-        result = await session.execute(select(Link).where(Link.short_code == short_code))
-        link = result.scalars().first()
+        version = await link_version(short_code)
+        # Сессия нужна только при промахе кэша, попадание в кэш не трогает пул соединений
+        async with read_session_scope(request, session) as read_session:
+            link = await fetch_redirect_target(read_session, short_code)
+            if link:
+                original_url = await resolve_url(read_session, link.original_url, link.url_id)
 
         if not link:
             raise HTTPException(status_code=404, detail="Short link not found")
 
-        if link.expires_at and link.expires_at < datetime.utcnow():
-            raise HTTPException(status_code=410, detail="Link has expired")
-
-        original_url = link.original_url
-        await set_cache(cache_key, {"original_url": original_url}, expire=60)
-
-    result = await session.execute(select(Link).where(Link.short_code == short_code))
-    link = result.scalars().first()
-
-    if not link:
-        raise HTTPException(status_code=404, detail="Short link not found")
+        expires_at = link.expires_at
+        track_clicks = link.track_clicks
+        await set_cache_if_version(
+            cache_key,
+            {"original_url": original_url, "expires_at": expires_at, "track_clicks": track_clicks},
+            short_code,
+            version,
+            expire=60,
+        )
 
-    if link.expires_at and link.expires_at < datetime.utcnow():
+    if expires_at and expires_at < datetime.utcnow():
         raise HTTPException(status_code=410, detail="Link has expired")
 
-    link.click_count += 1
-    link.last_accessed_at = datetime.utcnow()
-    await session.commit()
+    if track_clicks:
+        await click_queue.submit(short_code, (1, datetime.utcnow()))
 
-    background_tasks.add_task(
-        update_stats_cache,
-        short_code,
-        link.click_count,
-        link.last_accessed_at.isoformat()
+    status_code, cache_control = redirect_policy(track_clicks, expires_at)
+    return RedirectResponse(
+        url=original_url, status_code=status_code, headers={"Cache-Control": cache_control}
     )
 
-    return RedirectResponse(url=original_url, status_code=307)
-
 @router.put("/links/{short_code}")
 async def update_short_link(
     short_code: str,
     request: UpdateLinkRequest = Body(default={}, example={}),
-    session: AsyncSession = Depends(get_async_session),
+    session: AsyncSession = Depends(get_shard_session),
     current_user: User = Depends(get_current_user),
 ):
     result = await session.execute(select(Link).where(Link.short_code == short_code))
@@ -146,44 +218,51 @@ async def update_short_link(
 
     new_short_code = request.custom_alias if request.custom_alias is not None else generate_short_code()
 
-    while True:
-        result = await session.execute(select(Link).where(Link.short_code == new_short_code))
-        existing_link = result.scalars().first()
-        if not existing_link:
-            break 
+    while await short_code_taken(session, new_short_code):
         new_short_code = generate_short_code()
 
-    link.short_code = new_short_code
     link.custom_alias = request.custom_alias if request.custom_alias is not None else None
     link.updated_at = datetime.utcnow()
 
     if request.expires_at is not None:
         link.expires_at = request.expires_at.replace(tzinfo=None)
 
-    await session.commit()
+    if request.track_clicks is not None:
+        link.track_clicks = request.track_clicks
+
+    old_short_code = link.short_code
+    link = await rename_link(session, link, new_short_code)
+    await move_pending_clicks(old_short_code, link.short_code)
+    await invalidate_links(old_short_code, link.short_code)
 
     return {
         "message": "Short link updated successfully",
         "new_short_url": f"http://localhost:8000/{link.short_code}",
-        "original_url": link.original_url,
+        "original_url": await resolve_url(session, link.original_url, link.url_id),
         "custom_alias": link.custom_alias, 
         "expires_at": link.expires_at,
+        "track_clicks": link.track_clicks,
     }
 
 @router.get("/links/{short_code}/stats")
 async def link_stats(
     short_code: str,
+    request: Request,
+    response: Response,
     session: AsyncSession = Depends(get_async_session),
     current_user: User = Depends(get_current_user)
 ):
-    stats_key = f"stats:{short_code}"
-    cached_stats = await get_cache(stats_key)
+    cache_key = stats_key(short_code)
+    cached_stats = await get_cache(cache_key)
 
     if cached_stats:
         stats = cached_stats
     else:
-        result = await session.execute(select(Link).where(Link.short_code == short_code))
-        link = result.scalars().first()
+        version = await stats_version(short_code)
+        async with read_session_scope(request, session) as read_session:
+            link = await fetch_link_stats(read_session, short_code)
+            if link:
+                original_url = await resolve_url(read_session, link.original_url, link.url_id)
 
         if not link:
             raise HTTPException(status_code=404, detail="Short link not found")
@@ -192,23 +271,39 @@ async def link_stats(
             raise HTTPException(status_code=403, detail="Not authorized to view this link's stats")
 
         stats = {
-            "original_url": link.original_url,
+            "original_url": original_url,
             "created_at": link.created_at,
             "click_count": link.click_count,
             "last_accessed_at": link.last_accessed_at,
         }
-        await set_cache(stats_key, stats, expire=300)
+        await set_cache_if_version(
+            cache_key, stats, short_code, version, expire=300, versioned_by=stats_version_key
+        )
 
+    # Переходы, которые ещё не перенесены из Redis в БД
+    pending_clicks, last_accessed_at = await get_pending_clicks(short_code)
+    if pending_clicks:
+        stats = {
+            **stats,
+            "click_count": (stats.get("click_count") or 0) + pending_clicks,
+            "last_accessed_at": last_accessed_at,
+        }
+
+    # Дашборды, опрашивающие статистику, получают 304 без сериализации ответа
+    etag = stats_etag(stats)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return stats
 
 @router.get("/links/search")
 async def search_link_by_url(
     original_url: str,
-    session: AsyncSession = Depends(get_async_session),
+    session: AsyncSession = Depends(get_read_session),
     current_user: User = Depends(get_current_user) 
 ):
-    result = await session.execute(select(Link).where(Link.original_url == original_url))
-    links = result.scalars().all()
+    links = await fan_out(session, lambda db: fetch_links_by_url(db, original_url))
 
     if not links:
         raise HTTPException(status_code=404, detail="Link not found")
@@ -221,7 +316,8 @@ async def search_link_by_url(
     return [
         {
             "short_code": link.short_code,
-            "original_url": link.original_url,
+            # Нормализованные ссылки совпали по url_id, то есть ведут на искомый адрес
+            "original_url": link.original_url or original_url,
             "expires_at": link.expires_at,
             "created_at": link.created_at
         }
@@ -231,7 +327,7 @@ async def search_link_by_url(
 @router.delete("/links/{short_code}")
 async def delete_short_link(
     short_code: str,
-    session: AsyncSession = Depends(get_async_session),
+    session: AsyncSession = Depends(get_shard_session),
     current_user: User = Depends(get_current_user),
 ):
     result = await session.execute(select(Link).where(Link.short_code == short_code))
@@ -246,20 +342,23 @@ async def delete_short_link(
     await session.delete(link)
     await session.commit()
     
-    await delete_cache(f"link:{short_code}")
+    await invalidate_links(short_code)
     
     return {"message": "Short link deleted successfully"}
 
 
 @router.get("/links/expired")
 async def get_expired_links(
-    session: AsyncSession = Depends(get_async_session),
+    session: AsyncSession = Depends(get_read_session),
     current_user: User = Depends(get_current_user)
 ):
-    result = await session.execute(
-        select(LinkHistory).where(LinkHistory.user_id == current_user.id)
-    )
-    expired_links = result.scalars().all()
+    async def fetch_resolved(db):
+        rows = await fetch_expired_links(db, current_user.id)
+        # Старая история могла уже уйти в сегменты холодного хранилища
+        rows += await read_cold_history(db, current_user.id)
+        return [(row, await resolve_url(db, row.original_url, row.url_id)) for row in rows]
+
+    expired_links = await fan_out(session, fetch_resolved)
 
     if not expired_links:
         raise HTTPException(status_code=404, detail="No expired links found")
@@ -267,10 +366,10 @@ async def get_expired_links(
     return [
         {
             "short_code": link.short_code,
-            "original_url": link.original_url,
+            "original_url": original_url,
             "expires_at": link.expires_at,
             "click_count": link.click_count,
             "created_at": link.created_at
         }
-        for link in expired_links
+        for link, original_url in expired_links
     ]
\ No newline at end of file
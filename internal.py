@@ -0,0 +1,92 @@
+import hmac
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from app import database
+from app.admission import admission_controller
+from app.database import get_pool_status
+from app.metrics import CONTENT_TYPE, REGISTRY
+from app.profiling import profile_store, verify_profile_token
+from app.redis import breakers_status
+from app.supervisor import supervisor
+from app.tracing import MemoryExporter, tracer
+from app.tasks import click_queue
+from config import INTERNAL_HEADER, INTERNAL_TOKEN, PROFILE_HEADER
+
+
+
+def require_internal_token(request: Request):
+    token = request.headers.get(INTERNAL_HEADER)
+    if not INTERNAL_TOKEN or token is None or not hmac.compare_digest(token.encode(), INTERNAL_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid internal token")
+
+
+def require_profile_token(request: Request):
+    """Профили содержат стеки кода, поэтому их отдаём только с тем же токеном, что включает профилирование."""
+    token = request.headers.get(PROFILE_HEADER)
+    if token is None or not verify_profile_token(token):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+
+router = APIRouter(prefix="/internal", tags=["internal"], dependencies=[Depends(require_internal_token)])
+profiles_router = APIRouter(prefix="/internal", tags=["internal"], dependencies=[Depends(require_profile_token)])
+metrics_router = APIRouter(tags=["internal"])
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@router.get("/db-pool")
+async def db_pool_status():
+    return {**get_pool_status(), "sessions": database.session_usage}
+
+
+@router.get("/db-replicas")
+async def db_replicas_status():
+    if database.replica_router is None:
+        return []
+    return database.replica_router.status()
+
+
+@router.get("/redis")
+async def redis_status():
+    return breakers_status()
+
+
+@router.get("/tasks")
+async def tasks_status():
+    return supervisor.status()
+
+
+@router.get("/queues")
+async def queues_status():
+    return [click_queue.status()]
+
+
+@router.get("/admission")
+async def admission_status():
+    return admission_controller.status()
+
+
+@profiles_router.get("/profiles")
+async def list_profiles():
+    return profile_store.list()
+
+
+@profiles_router.get("/profiles/{profile_id}")
+async def download_profile(profile_id: int):
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(
+        profile.folded(),
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile.id}.folded"'},
+    )
+
+
+@router.get("/traces")
+async def recent_spans(limit: int = 100):
+    if not isinstance(tracer.exporter, MemoryExporter):
+        return []
+    return [span.to_dict() for span in list(tracer.exporter.spans)[-limit:]]
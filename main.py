@@ -1,25 +1,106 @@
 import uvicorn
-import asyncio
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from auth import router as auth_router
 from handlers import router
+from internal import metrics_router, profiles_router, router as internal_router
 from app.models import Base
-from app.database import engine
-from app.tasks import periodic_task
+from app.admission import AdmissionMiddleware, admission_controller
+from app.database import (
+    dispose_engines,
+    engine,
+    remember_write,
+    replica_router,
+    shard_router,
+)
+from app.fastpath import RedirectFastPath
+from app.profiling import ProfilingMiddleware
+from app.querylog import QueryBudgetMiddleware
+from app.request_metrics import RequestMetricsMiddleware
+from app.redis import close_redis
+from app.supervisor import supervisor
+from app.tracing import TracingMiddleware, tracer
+from app.tasks import (
+    acquire_background_lock,
+    background_jobs_task,
+    click_queue,
+    drain_click_counters,
+    replica_health_task,
+)
+from config import ADMISSION_CONTROL, FAST_REDIRECT, METRICS_ENABLED, PROFILING_ENABLED, SHUTDOWN_TIMEOUT
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Схему создаёт и фоновые задачи выполняет только один из процессов server.py
+    if acquire_background_lock():
+        await init_db()
+    supervisor.spawn(background_jobs_task, name="background_jobs", service=True)
+    if replica_router is not None:
+        supervisor.spawn(replica_health_task, name="replica_health", service=True)
+    click_queue.start(supervisor)
+    if tracer.enabled:
+        supervisor.spawn(tracer.flush_task, name="trace_export", service=True)
+    yield
+    await supervisor.shutdown(SHUTDOWN_TIMEOUT)
+
+
+# Перед закрытием соединений переходы из очереди попадают в Redis, а из Redis — в БД
+supervisor.on_drain(click_queue.drain)
+supervisor.on_drain(drain_click_counters)
+supervisor.on_drain(tracer.flush)
+supervisor.on_close(close_redis)
+supervisor.on_close(dispose_engines)
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(auth_router)
+app.include_router(internal_router)
+app.include_router(profiles_router)
+app.include_router(metrics_router)
 app.include_router(router)
 
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+async def remember_writes(request: Request, call_next):
+    # Клиент, который только что что-то записал, какое-то время читает из основной БД
+    response = await call_next(request)
+    if request.method in WRITE_METHODS and response.status_code < 400:
+        await remember_write(request)
+    return response
+
+
+if replica_router is not None:
+    app.middleware("http")(remember_writes)
+
+app.add_middleware(QueryBudgetMiddleware)
+
+# Редиректы из кэша не обращаются к БД, поэтому ограничение стоит внутри быстрого пути
+if ADMISSION_CONTROL:
+    app.add_middleware(AdmissionMiddleware, controller=admission_controller)
+
+# Добавляется после ограничения нагрузки, чтобы стоять снаружи него
+if FAST_REDIRECT:
+    app.add_middleware(RedirectFastPath)
+
+if tracer.enabled:
+    app.add_middleware(TracingMiddleware)
+
+# Снаружи быстрого пути, чтобы профилировать и редиректы из кэша
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Самый внешний: время ответа учитывается и для быстрого редиректа, и для отказов 503
+if METRICS_ENABLED:
+    app.add_middleware(RequestMetricsMiddleware)
+
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-
-@app.on_event("startup")
-async def startup_event():
-    await init_db()
-    asyncio.create_task(periodic_task())
+    if shard_router is not None:
+        await shard_router.create_tables()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
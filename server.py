@@ -0,0 +1,45 @@
+import argparse
+import os
+import uvicorn
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Запуск сервера в несколько процессов")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1,
+        help="число процессов, по умолчанию WEB_CONCURRENCY или число ядер",
+    )
+    # auto берёт uvloop и httptools, если они установлены, иначе asyncio и h11
+    parser.add_argument("--loop", default=os.getenv("SERVER_LOOP", "auto"))
+    parser.add_argument("--http", default=os.getenv("SERVER_HTTP", "auto"))
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30")),
+        help="сколько секунд воркер дожидается текущих запросов при остановке",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Воркеры заново читают config.py и делят DB_MAX_CONNECTIONS на это число
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    # SIGHUP главному процессу перезапускает воркеры по одному, SIGTERM — плавная остановка
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=args.loop,
+        http=args.http,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+
+
+if __name__ == "__main__":
+    main()
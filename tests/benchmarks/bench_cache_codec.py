@@ -0,0 +1,46 @@
+"""Сравнение форматов значений кэша: прежний JSON и msgpack с байтом версии.
+
+Запуск из корня репозитория:
+
+    python -m tests.benchmarks.bench_cache_codec --iterations 100000
+"""
+import argparse
+import timeit
+from datetime import datetime
+from app.redis import CODECS, decode_value
+
+ENTRIES = {
+    "link": {
+        "original_url": "https://example.com/landing/spring-sale?utm_source=newsletter&utm_medium=email",
+        "expires_at": datetime(2025, 5, 1, 12, 0),
+    },
+    "stats": {
+        "original_url": "https://example.com/landing/spring-sale?utm_source=newsletter&utm_medium=email",
+        "created_at": datetime(2025, 3, 31, 12, 30, 15, 123456),
+        "click_count": 1532,
+        "last_accessed_at": datetime(2025, 4, 1, 9, 15, 2, 654321),
+    },
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    print(f"{'entry':<8}{'codec':<10}{'encode us':>11}{'decode us':>11}{'bytes':>8}")
+    for entry_name, value in ENTRIES.items():
+        for codec_name, codec in CODECS.items():
+            data = codec.encode(value)
+            assert decode_value(data) == value
+            encode = timeit.timeit(lambda: codec.encode(value), number=args.iterations)
+            decode = timeit.timeit(lambda: decode_value(data), number=args.iterations)
+            print(
+                f"{entry_name:<8}{codec_name:<10}"
+                f"{encode / args.iterations * 1e6:>11.2f}{decode / args.iterations * 1e6:>11.2f}"
+                f"{len(data):>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Микробенчмарки горячих функций и обработчиков без внешних сервисов.
+
+БД — SQLite в памяти (aiosqlite), Redis — fakeredis, обработчики вызываются
+через ASGI-клиент httpx со всеми middleware приложения. Для каждого случая
+выводится лучшее из --repeat измерений времени на одну операцию.
+
+Результаты сравниваются с базовой линией tests/benchmarks/baselines/hot_paths.json;
+--save перезаписывает её, и изменение видно в диффе коммита. --check завершает
+процесс с кодом 1, если случай стал медленнее базовой линии больше чем на --tolerance.
+
+Запуск из корня репозитория:
+
+    python -m tests.benchmarks.bench_hot_paths --iterations 500
+    python -m tests.benchmarks.bench_hot_paths --save
+    python -m tests.benchmarks.bench_hot_paths --background-links 200000
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import uuid
+from unittest.mock import patch
+import fakeredis
+import jwt
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app.database import get_async_session
+from app.dataset import DatasetSpec, populate
+from app.models import Link, User
+from app.redis import get_cache, set_cache
+from auth import SECRET_KEY, create_access_token, get_current_user, get_current_user_optional
+from handlers import generate_short_code
+from main import app
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "hot_paths.json")
+
+USER = User(id=uuid.uuid4(), email="bench@example.com", hashed_password="")
+
+LINK_VALUE = {
+    "original_url": "https://example.com/landing/spring-sale?utm_source=newsletter&utm_medium=email",
+    "expires_at": None,
+    "track_clicks": True,
+}
+
+
+def measure_sync(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+async def measure_async(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for number in range(iterations):
+        await fn(number)
+    return (time.perf_counter() - start) / iterations
+
+
+async def prepare_database(links: int, background_links: int = 0):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    # Фоновые данные генератора делают индексы и таблицы ближе к рабочим размерам
+    await populate(engine, DatasetSpec(users=background_links // 100, links=background_links, history=0))
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_maker() as session:
+        session.add_all(
+            Link(short_code=f"bench{number}", original_url=f"https://example.com/{number}", user_id=USER.id)
+            for number in range(links)
+        )
+        await session.commit()
+    return engine, session_maker
+
+
+def override_dependencies(session_maker):
+    async def get_test_session():
+        async with session_maker() as session:
+            yield session
+
+    app.dependency_overrides[get_async_session] = get_test_session
+    app.dependency_overrides[get_current_user] = lambda: USER
+    app.dependency_overrides[get_current_user_optional] = lambda: USER
+
+
+async def run_cases(iterations: int, background_links: int = 0) -> dict:
+    token = create_access_token({"sub": USER.email})
+    # Коды для промахов кэша: каждый запрашивается один раз
+    engine, session_maker = await prepare_database(iterations * 2 + 1, background_links)
+    override_dependencies(session_maker)
+    results = {}
+    try:
+        results["generate_short_code"] = measure_sync(generate_short_code, iterations * 20)
+        results["create_access_token"] = measure_sync(lambda: create_access_token({"sub": USER.email}), iterations * 20)
+        results["jwt_decode"] = measure_sync(lambda: jwt.decode(token, SECRET_KEY, algorithms=["HS256"]), iterations * 20)
+
+        await set_cache("link:{bench0}", LINK_VALUE)
+        results["set_cache"] = await measure_async(lambda _: set_cache("link:{bench0}", LINK_VALUE), iterations)
+        results["get_cache"] = await measure_async(lambda _: get_cache("link:{bench0}"), iterations)
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+            async def redirect_miss(number):
+                response = await client.get(f"/bench{number + 1}", follow_redirects=False)
+                assert response.status_code == 307, response.status_code
+
+            async def redirect_hit(number):
+                response = await client.get("/bench0", follow_redirects=False)
+                assert response.status_code == 307, response.status_code
+
+            async def shorten(number):
+                response = await client.post("/links/shorten", json={"original_url": "https://example.com/new"})
+                assert response.status_code == 200, response.status_code
+
+            async def stats(number):
+                response = await client.get(f"/links/bench{iterations + 1 + number}/stats")
+                assert response.status_code == 200, response.status_code
+
+            await redirect_hit(0)
+            results["redirect_link (cache miss)"] = await measure_async(redirect_miss, iterations)
+            results["redirect_link (cache hit)"] = await measure_async(redirect_hit, iterations)
+            results["shorten_link"] = await measure_async(shorten, iterations)
+            results["link_stats (cache miss)"] = await measure_async(stats, iterations)
+    finally:
+        app.dependency_overrides.clear()
+        await engine.dispose()
+    return results
+
+
+def bench(iterations: int, repeat: int, background_links: int = 0) -> dict:
+    best = {}
+    for _ in range(repeat):
+        redis = fakeredis.FakeAsyncRedis()
+        with patch("app.redis.redis_client", redis):
+            results = asyncio.run(run_cases(iterations, background_links))
+        for name, seconds in results.items():
+            best[name] = min(best.get(name, seconds), seconds)
+    return {name: round(seconds * 1e6, 2) for name, seconds in best.items()}
+
+
+def load_baseline(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as baseline_file:
+        return json.load(baseline_file)["results_us"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="Overwrite the baseline with these results")
+    parser.add_argument("--check", action="store_true", help="Exit with 1 on regressions over --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument(
+        "--background-links", type=int, default=0,
+        help="Extra synthetic links from app.dataset; baselines are recorded with 0",
+    )
+    args = parser.parse_args(argv)
+
+    results = bench(args.iterations, args.repeat, args.background_links)
+    baseline = load_baseline(args.baseline)
+
+    regressions = []
+    print(f"{'case':<30}{'us/op':>10}{'baseline':>10}{'change':>9}")
+    for name, value in results.items():
+        base = baseline.get(name)
+        change = (value / base - 1) if base else None
+        if change is not None and change > args.tolerance:
+            regressions.append(name)
+        print(
+            f"{name:<30}{value:>10.2f}{base if base is not None else '-':>10}"
+            f"{f'{change:+.0%}' if change is not None else '-':>9}"
+        )
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "iterations": args.iterations,
+                    "results_us": results,
+                },
+                baseline_file,
+                indent=2,
+            )
+            baseline_file.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+
+    if regressions:
+        print(f"Slower than baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Сравнение ORM-запросов и запросов по колонкам (app/queries.py) на горячих путях.
+
+Запуск из корня репозитория:
+
+    python -m tests.benchmarks.bench_hot_queries --links 5000 --iterations 2000
+
+Для каждого пути выводится время CPU и пиковый прирост памяти на один запрос.
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app.models import Base, Link, LinkHistory
+from app.queries import (
+    fetch_expired_links,
+    fetch_link_stats,
+    fetch_links_by_url,
+    fetch_redirect_target,
+)
+
+USER_ID = uuid.uuid4()
+
+
+async def orm_redirect(session, code):
+    link = (await session.execute(select(Link).where(Link.short_code == code))).scalars().first()
+    return link.original_url, link.expires_at
+
+
+async def core_redirect(session, code):
+    row = await fetch_redirect_target(session, code)
+    return row.original_url, row.expires_at
+
+
+async def orm_stats(session, code):
+    link = (await session.execute(select(Link).where(Link.short_code == code))).scalars().first()
+    return link.original_url, link.created_at, link.click_count, link.last_accessed_at
+
+
+async def core_stats(session, code):
+    row = await fetch_link_stats(session, code)
+    return row.original_url, row.created_at, row.click_count, row.last_accessed_at
+
+
+async def orm_search(session, code):
+    url = f"https://example.com/{int(code[4:]) % 50}"
+    return (await session.execute(select(Link).where(Link.original_url == url))).scalars().all()
+
+
+async def core_search(session, code):
+    return await fetch_links_by_url(session, f"https://example.com/{int(code[4:]) % 50}")
+
+
+async def orm_expired(session, code):
+    query = select(LinkHistory).where(LinkHistory.user_id == USER_ID)
+    return (await session.execute(query)).scalars().all()
+
+
+async def core_expired(session, code):
+    return await fetch_expired_links(session, USER_ID)
+
+
+CASES = [
+    ("redirect miss", orm_redirect, core_redirect),
+    ("link stats", orm_stats, core_stats),
+    ("search by url", orm_search, core_search),
+    ("expired list", orm_expired, core_expired),
+]
+
+
+async def prepare(links: int):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_maker() as session:
+        now = datetime.utcnow()
+        session.add_all(
+            Link(
+                short_code=f"code{i}",
+                original_url=f"https://example.com/{i % 50}",
+                user_id=USER_ID,
+                expires_at=now + timedelta(days=1),
+            )
+            for i in range(links)
+        )
+        session.add_all(
+            LinkHistory(
+                short_code=f"old{i}",
+                original_url=f"https://example.com/{i}",
+                expires_at=now - timedelta(days=1),
+                user_id=USER_ID,
+            )
+            for i in range(20)
+        )
+        await session.commit()
+    return engine, session_maker
+
+
+async def measure(session_maker, fn, codes):
+    # Как в обработчике: одна сессия на запрос
+    async def one_request(code):
+        async with session_maker() as session:
+            await fn(session, code)
+
+    for code in codes[:50]:
+        await one_request(code)
+
+    cpu_start = time.process_time()
+    for code in codes:
+        await one_request(code)
+    cpu = (time.process_time() - cpu_start) / len(codes)
+
+    # Пиковый прирост памяти за запрос: сколько байт выделяется под результат и сессию
+    sample = codes[:200]
+    peak_total = 0
+    tracemalloc.start()
+    for code in sample:
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        await one_request(code)
+        _, peak = tracemalloc.get_traced_memory()
+        peak_total += peak - current
+    tracemalloc.stop()
+    return cpu, peak_total / len(sample)
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=5000)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    engine, session_maker = await prepare(args.links)
+    codes = [f"code{i % args.links}" for i in range(args.iterations)]
+    print(f"{'path':<15}{'orm us':>10}{'core us':>10}{'orm KiB':>10}{'core KiB':>10}")
+    for name, orm_fn, core_fn in CASES:
+        orm_cpu, orm_peak = await measure(session_maker, orm_fn, codes)
+        core_cpu, core_peak = await measure(session_maker, core_fn, codes)
+        print(
+            f"{name:<15}{orm_cpu * 1e6:>10.1f}{core_cpu * 1e6:>10.1f}"
+            f"{orm_peak / 1024:>10.1f}{core_peak / 1024:>10.1f}"
+        )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+"""Редирект из кэша: полный стек FastAPI против ASGI-обработчика app/fastpath.py.
+
+Запросы выполняются в одном процессе и одном цикле событий, без сети, поэтому
+результат — запросов в секунду на одно ядро. Кэш подменяется словарём в памяти,
+учёт переходов отключён.
+
+Запуск из корня репозитория:
+
+    python -m tests.benchmarks.bench_redirect_fastpath --requests 20000
+"""
+import argparse
+import asyncio
+import time
+from unittest.mock import patch
+from main import app
+from app.fastpath import RedirectFastPath
+from app.tasks import click_queue
+
+CACHE = {"link:{abc123}": {"original_url": "https://example.com/landing", "expires_at": None}}
+
+
+async def fake_get_cache(key):
+    return CACHE.get(key)
+
+
+async def fake_submit(key, item):
+    return True
+
+
+def build_stack(with_fast_path: bool):
+    user_middleware = app.user_middleware
+    if not with_fast_path:
+        app.user_middleware = [m for m in user_middleware if m.cls is not RedirectFastPath]
+    try:
+        return app.build_middleware_stack()
+    finally:
+        app.user_middleware = user_middleware
+
+
+async def run(stack, requests: int) -> float:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/abc123",
+        "raw_path": b"/abc123",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 8000),
+        "app": app,
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    statuses = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await stack(dict(scope), receive, send)
+    elapsed = time.perf_counter() - start
+    assert set(statuses) == {307}, statuses[:5]
+    return requests / elapsed
+
+
+async def bench(requests: int):
+    results = {}
+    for name, with_fast_path in (("fastapi", False), ("fast path", True)):
+        stack = build_stack(with_fast_path)
+        await run(stack, min(requests, 1000))
+        results[name] = await run(stack, requests)
+        print(f"{name:<12}{results[name]:>12.0f} req/s")
+    print(f"{'speedup':<12}{results['fast path'] / results['fastapi']:>12.1f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    with patch("handlers.get_cache", fake_get_cache), \
+            patch("app.fastpath.get_cache", fake_get_cache), \
+            patch.object(click_queue, "submit", fake_submit):
+        asyncio.run(bench(args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import asyncio
+import json
 import pytest
 import pytest_asyncio
 import uuid
@@ -8,6 +9,8 @@ from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from app.models import Base
 from app.database import get_async_session
+from app.querylog import assert_max_queries
+from app.redis import delete_cache, link_key
 from main import app
 from auth import get_current_user, get_current_user_optional
 
@@ -154,6 +157,9 @@ async def test_update_short_link_authorized(async_client):
         f"/links/{short_code}", json={"custom_alias": "newalias"}
     )
     assert response.status_code == 200
+    # Старый код был в кэше после создания, но больше не должен редиректить
+    old_response = await async_client.get(f"/{short_code}")
+    assert old_response.status_code == 404
 
 
 @pytest.mark.asyncio
@@ -165,6 +171,8 @@ async def test_delete_short_link_authorized(async_client):
     short_code = create_response.json()["short_url"].split("/")[-1]
     response = await async_client.delete(f"/links/{short_code}")
     assert response.status_code == 200
+    redirect_response = await async_client.get(f"/{short_code}")
+    assert redirect_response.status_code == 404
 
 
 @pytest.mark.asyncio
@@ -189,6 +197,26 @@ async def test_get_link_stats_authorized(async_client: AsyncClient):
     stats = stats_resp.json()
     assert stats["click_count"] >= 1
 
+    etag = stats_resp.headers["etag"]
+    cached_resp = await async_client.get(
+        f"/links/{short_code}/stats", headers={**headers, "If-None-Match": etag}
+    )
+    assert cached_resp.status_code == 304
+
+
+@pytest.mark.asyncio
+async def test_untracked_link_redirect_is_permanent(async_client):
+    create_resp = await async_client.post(
+        "/links/shorten",
+        json={"original_url": "https://example.com", "track_clicks": False},
+    )
+    short_code = create_resp.json()["short_url"].split("/")[-1]
+
+    response = await async_client.get(f"/{short_code}")
+
+    assert response.status_code == 308
+    assert response.headers["cache-control"].startswith("public, max-age=")
+
 
 # Тесты для неавторизованных пользователей или не создателей ссылки
 class DummyUserDifferent:
@@ -342,3 +370,125 @@ async def test_get_expired_links_found(async_client, test_db):
     data = resp.json()
     assert isinstance(data, list)
     assert any(link["short_code"] == "expired1" for link in data)
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(async_client):
+    response = await async_client.post(
+        "/links/shorten", json={"original_url": "https://example.com"}
+    )
+    short_code = response.json()["short_url"].split("/")[-1]
+    await async_client.get(f"/{short_code}", follow_redirects=False)
+
+    response = await async_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert any(
+        line.startswith('http_request_duration_seconds_count{route="/links/shorten",method="POST",status="2xx"}')
+        for line in lines
+    )
+    assert any(line.startswith('db_query_duration_seconds_count{handler="shorten_link"}') for line in lines)
+    assert any(line.startswith('cache_lookups_total{family="link",result=') for line in lines)
+
+
+@pytest.mark.asyncio
+async def test_hot_paths_query_budget(async_client):
+    with assert_max_queries(2):
+        response = await async_client.post(
+            "/links/shorten", json={"original_url": "https://example.com"}
+        )
+    short_code = response.json()["short_url"].split("/")[-1]
+    await delete_cache(link_key(short_code))
+
+    with assert_max_queries(1):
+        response = await async_client.get(f"/{short_code}", follow_redirects=False)
+    assert response.status_code == 307
+
+
+@pytest.mark.asyncio
+async def test_normalized_urls(async_client, test_db, mocker):
+    from app.models import Link, Url
+    from app.urls import url_cache
+
+    mocker.patch("handlers.NORMALIZE_URLS", True)
+    original_url = "https://example.com/landing?utm_source=newsletter"
+    for alias in ("norm1", "norm2"):
+        response = await async_client.post(
+            "/links/shorten", json={"original_url": original_url, "custom_alias": alias}
+        )
+        assert response.status_code == 200
+
+    link = await test_db.get(Link, "norm1")
+    assert link.original_url is None
+    assert (await test_db.get(Url, link.url_id)).url == original_url
+
+    await delete_cache(link_key("norm1"))
+    url_cache.clear()
+    response = await async_client.get("/norm1", follow_redirects=False)
+    assert response.headers["location"] == original_url
+
+    response = await async_client.get("/links/norm2/stats")
+    assert response.json()["original_url"] == original_url
+
+    response = await async_client.get("/links/search", params={"original_url": original_url})
+    assert {link["short_code"] for link in response.json()} == {"norm1", "norm2"}
+
+
+@pytest.mark.asyncio
+async def test_export_links(async_client):
+    from app.export import active_exports, export_session_makers
+
+    app.dependency_overrides[export_session_makers] = lambda: [TestingSessionLocal]
+    try:
+        for alias in ("exp1", "exp2"):
+            await async_client.post(
+                "/links/shorten", json={"original_url": "https://example.com", "custom_alias": alias}
+            )
+
+        response = await async_client.get("/links/export", params={"format": "csv"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        lines = response.text.splitlines()
+        assert lines[0].startswith("kind,short_code,original_url")
+        assert len(lines) == 3
+
+        response = await async_client.get("/links/export", params={"limit": 1})
+        first = response.json()
+        assert first["short_code"] == "exp1"
+        response = await async_client.get("/links/export", params={"cursor": first["cursor"]})
+        assert [json.loads(line)["short_code"] for line in response.text.splitlines()] == ["exp2"]
+
+        response = await async_client.get("/links/export", params={"cursor": "bogus"})
+        assert response.status_code == 400
+        response = await async_client.get("/links/export", params={"format": "xml"})
+        assert response.status_code == 422
+        # Каждое занятое место выгрузки освобождено, в том числе при ошибочном cursor
+        assert active_exports["count"] == 0
+    finally:
+        app.dependency_overrides.pop(export_session_makers, None)
+
+
+@pytest.mark.asyncio
+async def test_get_expired_links_from_cold_storage(async_client, test_db, tmp_path, mocker):
+    from app.coldstore import compact_history
+    from app.models import LinkHistory
+
+    mocker.patch("app.coldstore.COLD_STORAGE_DIR", str(tmp_path))
+    test_db.add(LinkHistory(
+        short_code="ancient",
+        original_url="https://ancient.com",
+        expires_at=datetime.utcnow() - timedelta(days=800),
+        click_count=4,
+        user_id=dummy_user.id,
+    ))
+    await test_db.commit()
+    moved = await compact_history(test_db, datetime.utcnow() - timedelta(days=365))
+    assert sum(moved.values()) == 1
+
+    resp = await async_client.get("/links/expired")
+    assert resp.status_code == 200
+    assert [(link["short_code"], link["original_url"], link["click_count"]) for link in resp.json()] == [
+        ("ancient", "https://ancient.com", 4)
+    ]
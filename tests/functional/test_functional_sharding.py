@@ -0,0 +1,148 @@
+import uuid
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from app import database
+from app.database import get_async_session
+from app.models import Base, Link
+from app.sharding import ShardRouter
+from auth import get_current_user, get_current_user_optional
+from main import app
+
+
+class DummyUser:
+    id = uuid.uuid4()
+
+
+@pytest_asyncio.fixture
+async def shards(tmp_path, mocker):
+    """Основная БД с пользователями и два SQLite-шарда для ссылок"""
+    primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'primary.db'}")
+    async with primary.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    router = ShardRouter(
+        [create_async_engine(f"sqlite+aiosqlite:///{tmp_path / name}.db") for name in ("s0", "s1")]
+    )
+    await router.create_tables()
+    mocker.patch.object(database, "shard_router", router)
+
+    session_maker = async_sessionmaker(primary, expire_on_commit=False)
+
+    async def _get_primary_session() -> AsyncSession:
+        async with session_maker() as session:
+            yield session
+
+    app.dependency_overrides[get_async_session] = _get_primary_session
+    app.dependency_overrides[get_current_user] = lambda: DummyUser()
+    app.dependency_overrides[get_current_user_optional] = lambda: DummyUser()
+    yield router
+    app.dependency_overrides.clear()
+    await router.dispose()
+    await primary.dispose()
+
+
+@pytest_asyncio.fixture
+async def async_client(shards):
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+async def find_link(router, short_code):
+    found = []
+    for shard in router.shards.values():
+        async with shard.session_maker() as session:
+            if await session.get(Link, short_code) is not None:
+                found.append(shard)
+    return found
+
+
+@pytest.mark.asyncio
+async def test_links_are_spread_across_shards(async_client, shards):
+    codes = []
+    for _ in range(12):
+        response = await async_client.post("/links/shorten", json={"original_url": "https://example.com"})
+        assert response.status_code == 200
+        codes.append(response.json()["short_url"].split("/")[-1])
+
+    for code in codes:
+        assert await find_link(shards, code) == [shards.shard_for(code)]
+    assert {shards.shard_for(code).name for code in codes} == set(shards.shards)
+
+    response = await async_client.get("/links/search", params={"original_url": "https://example.com/"})
+    assert response.status_code == 200
+    assert sorted(link["short_code"] for link in response.json()) == sorted(codes)
+
+    response = await async_client.get(f"/{codes[0]}", follow_redirects=False)
+    assert response.status_code == 307
+
+
+@pytest.mark.asyncio
+async def test_update_moves_link_to_alias_shard(async_client, shards):
+    response = await async_client.post(
+        "/links/shorten", json={"original_url": "https://example.com", "custom_alias": "source"}
+    )
+    assert response.status_code == 200
+    alias = next(
+        f"alias{i}" for i in range(100) if not shards.same_shard("source", f"alias{i}")
+    )
+
+    response = await async_client.put("/links/source", json={"custom_alias": alias})
+    assert response.status_code == 200
+    assert await find_link(shards, "source") == []
+    assert await find_link(shards, alias) == [shards.shard_for(alias)]
+
+    response = await async_client.delete(f"/links/{alias}")
+    assert response.status_code == 200
+    assert await find_link(shards, alias) == []
+
+
+@pytest.mark.asyncio
+async def test_rename_during_resharding_leaves_previous_shard(async_client, shards, tmp_path, mocker):
+    def engines(*names):
+        return [create_async_engine(f"sqlite+aiosqlite:///{tmp_path / name}.db") for name in names]
+
+    # Ссылка создана до добавления шарда s1 и ещё не перенесена
+    old_router = ShardRouter(engines("s0"))
+    resharding = ShardRouter(engines("s0", "s1"), previous_engines=engines("s0"))
+    target = resharding.shards[next(name for name in resharding.shards if name.endswith("s1.db"))]
+    source, alias = [
+        code for code in (f"reshard{i}" for i in range(100)) if resharding.shard_for(code) is target
+    ][:2]
+
+    mocker.patch.object(database, "shard_router", old_router)
+    response = await async_client.post(
+        "/links/shorten", json={"original_url": "https://example.com", "custom_alias": source}
+    )
+    assert response.status_code == 200
+
+    mocker.patch.object(database, "shard_router", resharding)
+    response = await async_client.put(f"/links/{source}", json={"custom_alias": alias})
+    assert response.status_code == 200
+    assert await find_link(resharding, source) == []
+    assert await find_link(resharding, alias) == [target]
+
+    await old_router.dispose()
+    await resharding.dispose()
+
+
+@pytest.mark.asyncio
+async def test_normalized_url_moves_with_link(async_client, shards, mocker):
+    from app.redis import delete_cache, link_key
+    from app.urls import url_cache
+
+    mocker.patch("handlers.NORMALIZE_URLS", True)
+    response = await async_client.post(
+        "/links/shorten", json={"original_url": "https://example.com/moved", "custom_alias": "normsrc"}
+    )
+    assert response.status_code == 200
+    alias = next(
+        f"norm{i}" for i in range(100) if not shards.same_shard("normsrc", f"norm{i}")
+    )
+    response = await async_client.put("/links/normsrc", json={"custom_alias": alias})
+    assert response.json()["original_url"] == "https://example.com/moved"
+
+    await delete_cache(link_key(alias))
+    url_cache.clear()
+    response = await async_client.get(f"/{alias}", follow_redirects=False)
+    assert response.headers["location"] == "https://example.com/moved"
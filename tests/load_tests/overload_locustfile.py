@@ -0,0 +1,85 @@
+from locust import HttpUser, LoadTestShape, between, task
+import random
+import string
+
+
+def random_string(length=8):
+    """Генерация случайной строки."""
+    return "".join(random.choices(string.ascii_letters + string.digits, k=length))
+
+
+class RedirectUser(HttpUser):
+    """Редиректы по небольшому набору ссылок — запросы, которые должны выдерживать перегрузку."""
+
+    weight = 3
+    wait_time = between(0.1, 0.5)
+
+    def on_start(self):
+        self.short_codes = []
+        for _ in range(5):
+            response = self.client.post("/links/shorten", json={"original_url": "https://example.com"})
+            if response.status_code == 200:
+                self.short_codes.append(response.json()["short_url"].split("/")[-1])
+
+    @task
+    def redirect(self):
+        if not self.short_codes:
+            return
+        with self.client.get(
+            f"/{random.choice(self.short_codes)}", allow_redirects=False, catch_response=True, name="/[short_code]"
+        ) as response:
+            if response.status_code in (307, 308):
+                response.success()
+            else:
+                response.failure(f"Ошибка редиректа: {response.status_code}")
+
+
+class HeavyUser(HttpUser):
+    """Тяжёлые запросы к БД: регистрация (хеширование пароля) и поиск по исходному URL."""
+
+    weight = 1
+    wait_time = between(0, 0.1)
+
+    def on_start(self):
+        email = f"{random_string()}@example.com"
+        self.client.post("/register", json={"email": email, "password": "password"})
+        response = self.client.post("/token", data={"username": email, "password": "password"})
+        token = response.json().get("access_token") if response.status_code == 200 else None
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+    @task(3)
+    def search(self):
+        with self.client.get(
+            "/links/search", params={"original_url": "https://example.com"},
+            headers=self.headers, catch_response=True,
+        ) as response:
+            # 503 — ожидаемый отказ при перегрузке
+            if response.status_code in (200, 404, 503):
+                response.success()
+
+    @task(1)
+    def register(self):
+        with self.client.post(
+            "/register", json={"email": f"{random_string()}@example.com", "password": "password"},
+            catch_response=True,
+        ) as response:
+            if response.status_code in (201, 503):
+                response.success()
+
+
+class RampShape(LoadTestShape):
+    """Нагрузка растёт ступенями до заведомой перегрузки, затем держится."""
+
+    stages = [
+        (60, 50),
+        (120, 200),
+        (180, 500),
+        (300, 1000),
+    ]
+
+    def tick(self):
+        run_time = self.get_run_time()
+        for duration, users in self.stages:
+            if run_time < duration:
+                return users, 50
+        return None
@@ -0,0 +1,74 @@
+import json
+import random
+from bisect import bisect_left
+from itertools import accumulate
+
+PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+
+class ZipfSampler:
+    """Выбирает элемент items так, что k-й по популярности выпадает с весом 1 / k**s."""
+
+    def __init__(self, items, s: float = 1.1, rng: random.Random = None):
+        self.items = list(items)
+        self.rng = rng or random.Random()
+        self.cumulative = list(accumulate(1 / rank ** s for rank in range(1, len(self.items) + 1)))
+
+    def sample(self):
+        point = self.rng.random() * self.cumulative[-1]
+        return self.items[min(bisect_left(self.cumulative, point), len(self.items) - 1)]
+
+
+def load_slo(path: str) -> dict:
+    with open(path, encoding="utf-8") as slo_file:
+        return json.load(slo_file)
+
+
+def summarize(entry) -> dict:
+    """Сводка по одной строке статистики Locust (StatsEntry)."""
+    summary = {
+        "name": entry.name,
+        "method": entry.method,
+        "requests": entry.num_requests,
+        "failures": entry.num_failures,
+        "failure_ratio": entry.fail_ratio,
+        "rps": entry.total_rps,
+        "max_ms": entry.max_response_time,
+    }
+    for key, percentile in PERCENTILES.items():
+        summary[f"{key}_ms"] = entry.get_response_time_percentile(percentile) if entry.num_requests else None
+    return summary
+
+
+def check_slo(results, slo: dict) -> list:
+    """Нарушения порогов: slo — {имя запроса: {"p99": мс, "max_failure_ratio": доля, ...}}."""
+    by_name = {result["name"]: result for result in results}
+    violations = []
+    for name, limits in slo.items():
+        result = by_name.get(name)
+        if result is None or not result["requests"]:
+            violations.append({"name": name, "metric": "requests", "limit": "> 0", "value": 0})
+            continue
+        for metric, limit in limits.items():
+            value = result["failure_ratio"] if metric == "max_failure_ratio" else result.get(f"{metric}_ms")
+            if value is not None and value > limit:
+                violations.append({"name": name, "metric": metric, "limit": limit, "value": value})
+    return violations
+
+
+def build_report(stats, slo: dict, options: dict) -> dict:
+    results = [summarize(entry) for entry in stats.entries.values()]
+    results.append(summarize(stats.total))
+    violations = check_slo(results, slo)
+    return {
+        "options": options,
+        "slo": slo,
+        "results": sorted(results, key=lambda result: result["name"]),
+        "violations": violations,
+        "passed": not violations,
+    }
+
+
+def write_report(report: dict, path: str):
+    with open(path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, ensure_ascii=False, indent=2)
@@ -0,0 +1,157 @@
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+import requests
+from locust import HttpUser, SequentialTaskSet, between, events, task
+from locust.runners import MasterRunner
+from slo import ZipfSampler, build_report, load_slo, write_report
+
+DEFAULT_SLO_FILE = os.path.join(os.path.dirname(__file__), "slo.json")
+
+# Заполняется в test_start: популярные и истёкшие ссылки общие для всех пользователей процесса
+link_pool = {"popular": None, "expired": []}
+
+
+@events.init_command_line_parser.add_listener
+def add_arguments(parser):
+    parser.add_argument("--seed", type=int, default=42, help="Seed for link aliases and traffic")
+    parser.add_argument("--links", type=int, default=1000, help="Links in the redirect pool")
+    parser.add_argument("--expired-links", type=int, default=50, help="Already expired links")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Zipf exponent of redirect popularity")
+    parser.add_argument("--slo-file", default=DEFAULT_SLO_FILE, help="JSON with per-request SLO thresholds")
+    parser.add_argument("--report", default="load_report.json", help="Where to write the JSON report")
+
+
+def create_links(host: str, aliases, expires_at=None):
+    session = requests.Session()
+    for alias in aliases:
+        payload = {"original_url": f"https://example.com/{alias}", "custom_alias": alias}
+        if expires_at is not None:
+            payload["expires_at"] = expires_at.isoformat()
+        response = session.post(f"{host}/links/shorten", json=payload)
+        # 400 — ссылка осталась от прошлого запуска с тем же seed
+        if response.status_code not in (200, 400):
+            logging.warning(f"Failed to seed {alias}: {response.status_code}")
+
+
+@events.test_start.add_listener
+def seed_links(environment, **kwargs):
+    if isinstance(environment.runner, MasterRunner):
+        return
+    options = environment.parsed_options
+    rng = random.Random(options.seed)
+    popular = [f"z{options.seed}-{number}" for number in range(options.links)]
+    rng.shuffle(popular)
+    expired = [f"x{options.seed}-{number}" for number in range(options.expired_links)]
+
+    create_links(environment.host, popular)
+    create_links(environment.host, expired, expires_at=datetime.utcnow() - timedelta(days=1))
+    link_pool["popular"] = ZipfSampler(popular, options.zipf_s, random.Random(options.seed))
+    link_pool["expired"] = expired
+
+
+@events.quitting.add_listener
+def check_slo(environment, **kwargs):
+    if environment.stats is None or not environment.parsed_options:
+        return
+    options = environment.parsed_options
+    report = build_report(
+        environment.stats,
+        load_slo(options.slo_file),
+        {"seed": options.seed, "links": options.links, "zipf_s": options.zipf_s, "host": environment.host},
+    )
+    write_report(report, options.report)
+    for violation in report["violations"]:
+        logging.error(f"SLO violated: {violation}")
+    if not report["passed"]:
+        environment.process_exit_code = 1
+
+
+def random_string(length=8):
+    return "".join(random.choices("abcdefghijklmnopqrstuvwxyz0123456789", k=length))
+
+
+class Reader(HttpUser):
+    """Анонимные переходы: популярность ссылок по Zipf, немного несуществующих и истёкших."""
+
+    weight = 9
+    wait_time = between(0.1, 0.5)
+
+    def redirect(self, short_code: str, name: str, expected):
+        with self.client.get(f"/{short_code}", allow_redirects=False, catch_response=True, name=name) as response:
+            if response.status_code in expected:
+                response.success()
+            else:
+                response.failure(f"Unexpected status {response.status_code}")
+
+    @task(90)
+    def popular_redirect(self):
+        if link_pool["popular"] is not None:
+            self.redirect(link_pool["popular"].sample(), "/[short_code]", (307, 308))
+
+    @task(5)
+    def missing_redirect(self):
+        self.redirect(f"missing-{random_string()}", "/[short_code] (404)", (404,))
+
+    @task(5)
+    def expired_redirect(self):
+        if link_pool["expired"]:
+            # Фоновая очистка может уже перенести ссылку в историю
+            self.redirect(random.choice(link_pool["expired"]), "/[short_code] (expired)", (404, 410))
+
+
+class AccountFlow(SequentialTaskSet):
+    """Жизненный цикл ссылки владельца: создание, статистика, поиск, изменение, удаление."""
+
+    def on_start(self):
+        self.short_code = None
+
+    @task
+    def shorten(self):
+        self.original_url = f"https://example.com/{random_string()}"
+        response = self.client.post("/links/shorten", json={"original_url": self.original_url}, headers=self.user.headers)
+        if response.status_code == 200:
+            self.short_code = response.json()["short_url"].split("/")[-1]
+
+    @task
+    def stats(self):
+        if self.short_code:
+            self.client.get(f"/links/{self.short_code}/stats", headers=self.user.headers, name="/links/[short_code]/stats")
+
+    @task
+    def search(self):
+        self.client.get("/links/search", params={"original_url": self.original_url}, headers=self.user.headers)
+
+    @task
+    def update(self):
+        if self.short_code:
+            expires_at = (datetime.utcnow() + timedelta(days=1)).isoformat()
+            response = self.client.put(
+                f"/links/{self.short_code}", json={"expires_at": expires_at},
+                headers=self.user.headers, name="PUT /links/[short_code]",
+            )
+            # Изменение выдаёт ссылке новый код, старый больше не действует
+            if response.status_code == 200:
+                self.short_code = response.json()["new_short_url"].split("/")[-1]
+
+    @task
+    def delete(self):
+        if self.short_code:
+            self.client.delete(f"/links/{self.short_code}", headers=self.user.headers, name="DELETE /links/[short_code]")
+            self.short_code = None
+
+
+class Account(HttpUser):
+    """Зарегистрированный пользователь, который ведёт свои ссылки."""
+
+    weight = 1
+    wait_time = between(1, 3)
+    tasks = [AccountFlow]
+
+    def on_start(self):
+        email = f"{random_string(12)}@example.com"
+        self.client.post("/register", json={"email": email, "password": "password"})
+        response = self.client.post("/token", data={"username": email, "password": "password"})
+        token = response.json().get("access_token") if response.status_code == 200 else None
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
@@ -0,0 +1,168 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+from app.admission import (
+    READ,
+    REDIRECT,
+    WRITE,
+    AdmissionController,
+    AdmissionMiddleware,
+    RouteClass,
+    classify,
+)
+
+
+def make_controller(total_limit=2, queue_size=10, timeout=1.0):
+    return AdmissionController(
+        [
+            RouteClass(REDIRECT, 0, total_limit, queue_size, timeout),
+            RouteClass(READ, 1, total_limit, queue_size, timeout),
+            RouteClass(WRITE, 2, 1, queue_size, timeout),
+        ],
+        total_limit=total_limit,
+    )
+
+
+def make_scope(path, method="GET"):
+    return {"type": "http", "method": method, "path": path, "app": None}
+
+
+def test_classify():
+    assert classify(make_scope("/abc123")) == REDIRECT
+    assert classify(make_scope("/links/search")) == READ
+    assert classify(make_scope("/links/shorten", "POST")) == WRITE
+    assert classify(make_scope("/internal/db-pool")) is None
+
+
+@pytest.mark.asyncio
+async def test_class_limit_and_queue_overflow():
+    controller = make_controller(queue_size=0)
+    write = controller.classes[WRITE]
+
+    assert await controller.acquire(write)
+    assert not await controller.acquire(write)
+    assert write.shed == 1
+
+    controller.release(write)
+    assert await controller.acquire(write)
+
+
+@pytest.mark.asyncio
+async def test_waiter_is_shed_after_timeout():
+    controller = make_controller(timeout=0.01)
+    read = controller.classes[READ]
+    await controller.acquire(read)
+    await controller.acquire(read)
+
+    assert not await controller.acquire(read)
+    assert read.shed == 1
+    assert read.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_freed_slot_goes_to_higher_priority():
+    controller = make_controller()
+    read, redirect = controller.classes[READ], controller.classes[REDIRECT]
+    await controller.acquire(read)
+    await controller.acquire(read)
+
+    waiting_read = asyncio.create_task(controller.acquire(read))
+    await asyncio.sleep(0)
+    waiting_redirect = asyncio.create_task(controller.acquire(redirect))
+    await asyncio.sleep(0)
+
+    controller.release(read)
+
+    assert await waiting_redirect
+    assert not waiting_read.done()
+
+    controller.release(read)
+    assert await waiting_read
+    assert controller.active == 2
+
+
+@pytest.mark.asyncio
+async def test_class_at_own_limit_does_not_block_others():
+    controller = make_controller(total_limit=3)
+    write, read = controller.classes[WRITE], controller.classes[READ]
+    await controller.acquire(write)
+    await controller.acquire(read)
+    await controller.acquire(read)
+
+    waiting_write = asyncio.create_task(controller.acquire(write))
+    await asyncio.sleep(0)
+    waiting_read = asyncio.create_task(controller.acquire(read))
+    await asyncio.sleep(0)
+
+    controller.release(read)
+    assert await waiting_read
+    assert not waiting_write.done()
+
+    controller.release(write)
+    assert await waiting_write
+
+
+@pytest.mark.asyncio
+async def test_waiters_at_class_limit_do_not_hold_lower_classes():
+    redirect = RouteClass(REDIRECT, 0, 1, 10, 1.0)
+    read = RouteClass(READ, 1, 3, 10, 1.0)
+    controller = AdmissionController([redirect, read], total_limit=3)
+    await controller.acquire(redirect)
+    waiting_redirect = asyncio.create_task(controller.acquire(redirect))
+    await asyncio.sleep(0)
+
+    # Ожидающий редирект не может занять место, пока его класс на пределе
+    assert await asyncio.wait_for(controller.acquire(read), 0.1)
+    assert not waiting_redirect.done()
+
+    controller.release(redirect)
+    assert await waiting_redirect
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_is_removed():
+    controller = make_controller()
+    read = controller.classes[READ]
+    await controller.acquire(read)
+    await controller.acquire(read)
+
+    waiting = asyncio.create_task(controller.acquire(read))
+    await asyncio.sleep(0)
+    assert read.queued == 1
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+
+    assert read.queued == 0
+    controller.release(read)
+    assert controller.active == 1
+
+
+@pytest.mark.asyncio
+async def test_middleware_returns_503_when_overloaded():
+    controller = make_controller(queue_size=0)
+    write = controller.classes[WRITE]
+    await controller.acquire(write)
+    downstream = AsyncMock()
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await AdmissionMiddleware(downstream, controller)(make_scope("/links/shorten", "POST"), AsyncMock(), send)
+
+    downstream.assert_not_called()
+    assert sent[0]["status"] == 503
+    assert (b"retry-after", b"1") in sent[0]["headers"]
+
+
+@pytest.mark.asyncio
+async def test_middleware_releases_slot_on_error():
+    controller = make_controller()
+    downstream = AsyncMock(side_effect=RuntimeError("boom"))
+
+    with pytest.raises(RuntimeError):
+        await AdmissionMiddleware(downstream, controller)(make_scope("/links/search"), AsyncMock(), AsyncMock())
+
+    assert controller.active == 0
+    assert controller.classes[READ].admitted == 1
@@ -0,0 +1,182 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app import coldstore
+from app.coldstore import (
+    ColdRow,
+    SegmentReader,
+    compact_history,
+    read_cold_history,
+    restore_segment,
+    write_segment,
+)
+from app.models import Base, HistorySegment, LinkHistory
+from app.urls import store_url
+
+USERS = [uuid.uuid4() for _ in range(5)]
+NOW = datetime(2026, 6, 15)
+
+
+def cold_row(user_id, number, expires_at=NOW):
+    return ColdRow(
+        id=uuid.uuid4(),
+        short_code=f"c{number}",
+        original_url=f"https://example.com/{number}",
+        url_id=None,
+        expires_at=expires_at,
+        click_count=number,
+        created_at=None if number % 3 == 0 else expires_at - timedelta(days=30),
+        user_id=user_id,
+    )
+
+
+@pytest_asyncio.fixture
+async def session(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'history.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        yield session
+    await engine.dispose()
+
+
+def test_segment_roundtrip_and_user_lookup(tmp_path, mocker):
+    mocker.patch.object(coldstore, "GROUP_ROWS", 7)
+    rows = [cold_row(USERS[number % 3] if number % 10 else None, number) for number in range(50)]
+    path = str(tmp_path / "2026-06" / "bucket.seg")
+    assert write_segment(path, rows) == os.path.getsize(path)
+
+    with SegmentReader(path) as reader:
+        assert reader.rows == 50
+        assert sorted(reader.all_rows(), key=lambda row: row.short_code) == sorted(
+            rows, key=lambda row: row.short_code
+        )
+        for user_id in (USERS[0], USERS[1], None):
+            expected = {row.id for row in rows if row.user_id == user_id}
+            assert {row.id for row in reader.rows_for_user(user_id)} == expected
+        assert reader.rows_for_user(USERS[4]) == []
+
+
+def test_segment_rejects_other_files(tmp_path):
+    path = tmp_path / "other.seg"
+    path.write_bytes(b"not a segment")
+    with pytest.raises(ValueError):
+        SegmentReader(str(path))
+
+
+@pytest.mark.asyncio
+async def test_compact_read_and_restore(session, tmp_path):
+    url_id = await store_url(session, "https://example.com/normalized")
+    for number, user_id in enumerate(USERS * 4):
+        session.add(LinkHistory(
+            short_code=f"h{number}",
+            original_url=None if number == 0 else f"https://example.com/{number}",
+            url_id=url_id if number == 0 else None,
+            expires_at=NOW - timedelta(days=400 + 20 * number),
+            click_count=number,
+            user_id=user_id,
+        ))
+    session.add(LinkHistory(
+        short_code="recent", original_url="https://recent.com", expires_at=NOW - timedelta(days=1), user_id=USERS[0]
+    ))
+    await session.commit()
+    storage_dir = str(tmp_path / "cold")
+
+    moved = await compact_history(session, NOW - timedelta(days=365), storage_dir=storage_dir, buckets=4)
+
+    assert sum(moved.values()) == 20
+    assert (await session.execute(select(func.count()).select_from(LinkHistory))).scalar() == 1
+    segments = (await session.execute(select(HistorySegment))).scalars().all()
+    assert {(segment.month, segment.bucket) for segment in segments} == set(
+        (key.split("/")[0], int(key.split("/")[1])) for key in moved
+    )
+
+    rows = await read_cold_history(session, USERS[0], storage_dir=storage_dir)
+    assert sorted(row.short_code for row in rows) == ["h0", "h10", "h15", "h5"]
+    assert {row.original_url for row in rows if row.short_code == "h0"} == {"https://example.com/normalized"}
+    assert await read_cold_history(session, USERS[0], storage_dir="") == []
+
+    # Повторное уплотнение дописывает строки в существующий сегмент месяца и корзины
+    expires_at = NOW - timedelta(days=400)
+    segment = next(segment for segment in segments if segment.min_expires_at <= expires_at <= segment.max_expires_at)
+    old_path, old_rows = os.path.join(storage_dir, segment.path), segment.rows
+    session.add(LinkHistory(
+        short_code="late", original_url="https://late.com", expires_at=expires_at, user_id=USERS[0]
+    ))
+    await session.commit()
+    await compact_history(session, NOW - timedelta(days=365), storage_dir=storage_dir, buckets=4)
+    await session.refresh(segment)
+    assert segment.rows == old_rows + 1
+    assert not os.path.exists(old_path)
+    assert (await session.execute(select(func.count()).select_from(HistorySegment))).scalar() == len(segments)
+
+    for segment in (await session.execute(select(HistorySegment))).scalars().all():
+        await restore_segment(session, segment, storage_dir=storage_dir)
+    assert (await session.execute(select(func.count()).select_from(LinkHistory))).scalar() == 22
+    assert (await session.execute(select(func.count()).select_from(HistorySegment))).scalar() == 0
+    assert not any(files for _, _, files in os.walk(storage_dir))
+
+
+@pytest.mark.asyncio
+async def test_compaction_streams_rows_into_existing_segments(session, tmp_path, mocker):
+    mocker.patch.object(coldstore, "GROUP_ROWS", 3)
+    storage_dir = str(tmp_path / "cold")
+    users = USERS + [None]
+    month_start = datetime(2025, 1, 1)
+
+    async def add_history(numbers):
+        for number in numbers:
+            session.add(LinkHistory(
+                short_code=f"m{number}",
+                original_url=f"https://example.com/{number}",
+                expires_at=month_start + timedelta(hours=number),
+                click_count=number,
+                user_id=users[number % len(users)],
+            ))
+        await session.commit()
+
+    await add_history(range(30))
+    await compact_history(session, NOW - timedelta(days=365), storage_dir=storage_dir, buckets=2, batch_size=2)
+    await add_history(range(30, 45))
+    moved = await compact_history(session, NOW - timedelta(days=365), storage_dir=storage_dir, buckets=2, batch_size=2)
+
+    assert sum(moved.values()) == 15
+    segments = (await session.execute(select(HistorySegment))).scalars().all()
+    assert sum(segment.rows for segment in segments) == 45
+    for segment in segments:
+        with SegmentReader(os.path.join(storage_dir, segment.path)) as reader:
+            rows = list(reader.iter_rows())
+        assert rows == sorted(rows, key=coldstore.segment_key)
+        assert len(rows) == segment.rows
+    # Во временных файлах ничего не осталось, прежние сегменты удалены
+    assert sorted(len(files) for _, _, files in os.walk(storage_dir) if files) == [len(segments)]
+    for index, user_id in enumerate(users):
+        rows = await read_cold_history(session, user_id, storage_dir=storage_dir)
+        assert sorted(row.click_count for row in rows) == list(range(index, 45, len(users)))
+
+
+@pytest.mark.asyncio
+async def test_read_cold_history_survives_rewritten_segment(session, tmp_path, mocker):
+    storage_dir = str(tmp_path / "cold")
+    session.add(LinkHistory(
+        short_code="old", original_url="https://old.com", expires_at=NOW - timedelta(days=400), user_id=USERS[0]
+    ))
+    await session.commit()
+    await compact_history(session, NOW - timedelta(days=365), storage_dir=storage_dir, buckets=1)
+    segment = (await session.execute(select(HistorySegment))).scalars().one()
+    current = os.path.join(storage_dir, segment.path)
+    stale = os.path.join(storage_dir, "2025-05", "bucket-0000-removed.seg")
+
+    # Первый запрос индекса вернул файл, который уплотнение успело удалить
+    mocker.patch.object(coldstore, "_user_segment_paths", side_effect=[[stale], [current]])
+    rows = await read_cold_history(session, USERS[0], storage_dir=storage_dir)
+    assert [row.short_code for row in rows] == ["old"]
+
+    # Если файла нет и после повторного запроса, его строки пропускаются
+    mocker.patch.object(coldstore, "_user_segment_paths", side_effect=[[stale], [stale, current]])
+    rows = await read_cold_history(session, USERS[0], storage_dir=storage_dir)
+    assert [row.short_code for row in rows] == ["old"]
@@ -1,6 +1,18 @@
 import pytest
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database import get_async_session, engine, async_session_maker
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app.database import (
+    get_async_session,
+    engine,
+    async_session_maker,
+    build_engine_options,
+    get_pool_status,
+    InstrumentedQueuePool,
+    LazySession,
+    PoolWaitHistogram,
+    session_usage,
+)
 from unittest.mock import AsyncMock, patch
 
 
@@ -8,7 +20,37 @@ from unittest.mock import AsyncMock, patch
 async def test_get_async_session():
     """Тестирование получения асинхронной сессии"""
     session = await anext(get_async_session())
-    assert isinstance(session, AsyncSession)
+    assert isinstance(session, LazySession)
+    assert not session.opened
+    assert session.sync_session is not None
+    assert session.opened
+    assert isinstance(session._session, AsyncSession)
+
+
+@pytest.mark.asyncio
+async def test_get_async_session_counts_requests_without_connection():
+    before = dict(session_usage)
+    dependency = get_async_session()
+    await anext(dependency)
+    await dependency.aclose()
+
+    assert session_usage["requests"] == before["requests"] + 1
+    assert session_usage["without_connection"] == before["without_connection"] + 1
+
+
+@pytest.mark.asyncio
+async def test_get_async_session_counts_opened_connection(tmp_path, mocker):
+    test_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'lazy.db'}")
+    mocker.patch("app.database.async_session_maker", async_sessionmaker(test_engine))
+    before = dict(session_usage)
+    dependency = get_async_session()
+    session = await anext(dependency)
+    await session.execute(text("SELECT 1"))
+    await dependency.aclose()
+    await test_engine.dispose()
+
+    assert session_usage["requests"] == before["requests"] + 1
+    assert session_usage["without_connection"] == before["without_connection"]
 
 
 @pytest.mark.asyncio
@@ -22,3 +64,57 @@ async def test_async_session_maker():
     """Проверяем создание сессии через async_session_maker"""
     async with async_session_maker() as session:
         assert isinstance(session, AsyncSession)
+
+
+def test_build_engine_options_postgres(mocker):
+    mocker.patch("app.database.DB_POOL_SIZE", 7)
+    mocker.patch("app.database.DB_MAX_OVERFLOW", 3)
+    mocker.patch("app.database.DB_STATEMENT_TIMEOUT", 1500)
+    options = build_engine_options("postgresql+asyncpg://u:p@localhost:5432/db")
+
+    assert options["echo"] is False
+    assert options["poolclass"] is InstrumentedQueuePool
+    assert options["pool_size"] == 7
+    assert options["max_overflow"] == 3
+    assert options["connect_args"]["server_settings"] == {"statement_timeout": "1500"}
+
+
+def test_build_engine_options_sqlite():
+    options = build_engine_options("sqlite+aiosqlite:///:memory:")
+    assert "poolclass" not in options
+    assert "pool_size" not in options
+
+
+def test_engine_uses_instrumented_pool():
+    status = get_pool_status(engine)
+    assert status["pool_class"] == "InstrumentedQueuePool"
+    assert status["checked_out"] == 0
+    assert status["wait_time"]["count"] == 0
+
+
+def test_pool_wait_histogram_cumulative_buckets():
+    histogram = PoolWaitHistogram(buckets=(0.01, 0.1))
+    histogram.observe(0.005)
+    histogram.observe(0.05)
+    histogram.observe(5)
+
+    snapshot = histogram.snapshot()
+    assert snapshot["buckets"] == {"0.01": 1, "0.1": 2, "+Inf": 3}
+    assert snapshot["count"] == 3
+
+
+@pytest.mark.asyncio
+async def test_instrumented_pool_records_checkout_wait(tmp_path):
+    """Ожидание соединения попадает в гистограмму пула"""
+    test_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedQueuePool
+    )
+    async with test_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+        status = get_pool_status(test_engine)
+        assert status["checked_out"] == 1
+
+    status = get_pool_status(test_engine)
+    assert status["checked_out"] == 0
+    assert status["wait_time"]["count"] == 1
+    await test_engine.dispose()
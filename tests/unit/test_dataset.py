@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.dataset import DatasetSpec, alias_for, link_rows, populate, short_code_for
+from app.models import Link, LinkHistory, User
+
+SPEC = DatasetSpec(users=20, links=500, history=50, seed=7, popular_urls=10)
+
+
+def test_link_rows_are_deterministic():
+    assert list(link_rows(SPEC)) == list(link_rows(SPEC))
+    assert list(link_rows(SPEC)) != list(link_rows(DatasetSpec(users=20, links=500, seed=8, popular_urls=10)))
+
+
+def test_link_codes_are_unique_and_fit_column():
+    codes = [row[0] for row in link_rows(SPEC)]
+    assert len(set(codes)) == len(codes)
+    assert all(len(code) <= 10 for code in codes)
+    assert short_code_for(1) != short_code_for(2)
+    assert alias_for(2 ** 32 - 1) not in {short_code_for(number) for number in range(1000)}
+
+
+def test_link_rows_follow_spec_ratios():
+    spec = DatasetSpec(links=5000, seed=1, duplicate_url_rate=0.5, alias_ratio=0.2, expired_ratio=0.1)
+    rows = list(link_rows(spec))
+    aliases = sum(1 for row in rows if row[1] is not None)
+    expired = sum(1 for row in rows if row[7] is not None and row[7] < spec.now)
+    distinct_urls = len({row[2] for row in rows})
+    assert 0.15 < aliases / len(rows) < 0.25
+    assert 0.07 < expired / len(rows) < 0.13
+    assert distinct_urls < len(rows) * 0.7
+
+
+@pytest.mark.asyncio
+async def test_populate_sqlite():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    try:
+        counts = await populate(engine, SPEC, batch_size=128)
+        async with engine.connect() as conn:
+            for model, expected in ((User, 20), (Link, 500), (LinkHistory, 50)):
+                assert (await conn.execute(select(func.count()).select_from(model))).scalar() == expected
+    finally:
+        await engine.dispose()
+    assert counts == {"users": 20, "links": 500, "link_history": 50}
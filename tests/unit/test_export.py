@@ -0,0 +1,154 @@
+import csv
+import gzip
+import io
+import json
+import uuid
+from datetime import datetime, timedelta
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.requests import ClientDisconnect
+from app.export import (
+    EXPORT_FIELDS,
+    ExportResponse,
+    ExportSlot,
+    active_exports,
+    decode_cursor,
+    encode_cursor,
+    encode_export,
+    export_records,
+    merge_sorted,
+)
+from app import coldstore
+from app.coldstore import compact_history
+from app.models import Base, Link, LinkHistory
+from app.urls import store_url
+
+USER_ID = uuid.uuid4()
+
+
+async def make_database(links, history=()):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_maker() as session:
+        for short_code, original_url in links:
+            link = Link(short_code=short_code, original_url=original_url, user_id=USER_ID)
+            if original_url is None:
+                link.url_id = await store_url(session, "https://example.com/normalized")
+            session.add(link)
+        session.add_all(
+            LinkHistory(
+                short_code=short_code,
+                original_url="https://old.com",
+                expires_at=datetime.utcnow() - timedelta(days=1),
+                user_id=USER_ID,
+            )
+            for short_code in history
+        )
+        session.add(Link(short_code="foreign", original_url="https://x.com", user_id=uuid.uuid4()))
+        await session.commit()
+    return engine, session_maker
+
+
+@pytest_asyncio.fixture
+async def shards():
+    first = await make_database([("a1", "https://a.com"), ("c3", None)], history=["h1", "h2"])
+    second = await make_database([("b2", "https://b.com"), ("d4", "https://d.com")], history=["h3"])
+    yield [first[1], second[1]]
+    await first[0].dispose()
+    await second[0].dispose()
+
+
+async def collect(records):
+    return [record async for record in records]
+
+
+def test_cursor_roundtrip():
+    history_id = uuid.uuid4()
+    assert decode_cursor(encode_cursor("link", "abc:def")) == ("link", "abc:def")
+    assert decode_cursor(encode_cursor("history", history_id)) == ("history", history_id)
+    for cursor in ("???", encode_cursor("other", "x"), encode_cursor("history", "not-a-uuid")):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+@pytest.mark.asyncio
+async def test_merge_sorted_skips_duplicates():
+    async def stream(values):
+        for value in values:
+            yield value
+
+    merged = merge_sorted([stream([1, 3, 5]), stream([2, 3, 6]), stream([])], key=lambda value: value)
+    assert await collect(merged) == [1, 2, 3, 5, 6]
+
+
+@pytest.mark.asyncio
+async def test_export_records_merges_shards_and_resumes(shards):
+    records = await collect(export_records(shards, USER_ID, batch_size=2))
+
+    assert [record["short_code"] for record in records[:4]] == ["a1", "b2", "c3", "d4"]
+    assert records[2]["original_url"] == "https://example.com/normalized"
+    assert [record["kind"] for record in records[4:]] == ["history"] * 3
+    assert "foreign" not in {record["short_code"] for record in records}
+
+    for position in (1, 3, 5):
+        resumed = await collect(export_records(shards, USER_ID, cursor=records[position]["cursor"]))
+        assert resumed == records[position + 1:]
+
+    limited = await collect(export_records(shards, USER_ID, cursor=records[2]["cursor"], limit=3))
+    assert limited == records[3:6]
+
+
+@pytest.mark.asyncio
+async def test_export_includes_cold_history(shards, tmp_path, mocker):
+    before = await collect(export_records(shards, USER_ID))
+    storage_dir = str(tmp_path / "cold")
+    mocker.patch.object(coldstore, "COLD_STORAGE_DIR", storage_dir)
+    async with shards[0]() as session:
+        moved = await compact_history(session, datetime.utcnow(), storage_dir=storage_dir, buckets=2)
+    assert sum(moved.values()) == 2
+
+    records = await collect(export_records(shards, USER_ID, batch_size=2))
+    assert records == before
+    # Продолжение по cursor проходит и через строки из сегментов
+    for position in range(4, len(records)):
+        resumed = await collect(export_records(shards, USER_ID, cursor=records[position]["cursor"]))
+        assert resumed == records[position + 1:]
+
+
+@pytest.mark.asyncio
+async def test_encode_export_csv_and_gzip(shards):
+    body = b"".join([chunk async for chunk in encode_export(export_records(shards, USER_ID), "csv")])
+    rows = list(csv.reader(io.StringIO(body.decode())))
+    assert rows[0] == list(EXPORT_FIELDS)
+    assert len(rows) == 8
+
+    body = b"".join([
+        chunk async for chunk in encode_export(export_records(shards, USER_ID), "ndjson", compress=True)
+    ])
+    lines = gzip.decompress(body).decode().splitlines()
+    assert [json.loads(line)["short_code"] for line in lines][:2] == ["a1", "b2"]
+
+
+@pytest.mark.asyncio
+async def test_export_slot_released_when_body_never_starts(mocker):
+    mocker.patch.dict(active_exports, {"count": 0})
+    first = ExportSlot.reserve(2)
+    second = ExportSlot.reserve(2)
+    assert ExportSlot.reserve(2) is None
+    first.release()
+    first.release()
+    assert active_exports["count"] == 1
+
+    async def body():
+        yield b"never sent"
+
+    async def broken_send(message):
+        raise OSError("client went away")
+
+    response = ExportResponse(body(), second)
+    with pytest.raises(ClientDisconnect):
+        await response({"type": "http", "asgi": {"spec_version": "2.4"}}, None, broken_send)
+    assert active_exports["count"] == 0
@@ -0,0 +1,127 @@
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock
+from app.fastpath import RedirectFastPath
+from app.tasks import click_queue
+
+
+class DummyApp:
+    def __init__(self):
+        self.routes = []
+        self.calls = 0
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+
+
+def make_scope(path, method="GET", app=None):
+    return {"type": "http", "method": method, "path": path, "app": app}
+
+
+async def call(fast_path, scope):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await fast_path(scope, AsyncMock(), send)
+    return sent
+
+
+@pytest.fixture
+def downstream():
+    return DummyApp()
+
+
+@pytest.fixture
+def mock_submit(mocker):
+    return mocker.patch.object(click_queue, "submit", new_callable=AsyncMock)
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_is_answered_directly(mocker, downstream, mock_submit):
+    mock_get_cache = mocker.patch(
+        "app.fastpath.get_cache",
+        new_callable=AsyncMock,
+        return_value={"original_url": "https://example.com/path?q=1", "expires_at": None},
+    )
+
+    sent = await call(RedirectFastPath(downstream), make_scope("/abc123"))
+
+    mock_get_cache.assert_called_once_with("link:{abc123}")
+    assert downstream.calls == 0
+    assert sent[0]["status"] == 307
+    assert (b"location", b"https://example.com/path?q=1") in sent[0]["headers"]
+    assert (b"cache-control", b"no-store") in sent[0]["headers"]
+    assert mock_submit.call_args.args[0] == "abc123"
+
+
+@pytest.mark.asyncio
+async def test_untracked_link_is_permanent(mocker, downstream, mock_submit):
+    mocker.patch(
+        "app.fastpath.get_cache",
+        new_callable=AsyncMock,
+        return_value={"original_url": "https://example.com", "expires_at": None, "track_clicks": False},
+    )
+
+    sent = await call(RedirectFastPath(downstream), make_scope("/abc123"))
+
+    assert sent[0]["status"] == 308
+    assert (b"cache-control", b"public, max-age=86400") in sent[0]["headers"]
+    mock_submit.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "cached",
+    [None, {"original_url": "https://example.com", "expires_at": datetime.utcnow() - timedelta(days=1)}],
+)
+async def test_miss_or_expired_falls_back(mocker, downstream, mock_submit, cached):
+    mocker.patch("app.fastpath.get_cache", new_callable=AsyncMock, return_value=cached)
+
+    sent = await call(RedirectFastPath(downstream), make_scope("/abc123"))
+
+    assert sent == []
+    assert downstream.calls == 1
+    mock_submit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_cache_error_falls_back(mocker, downstream, mock_submit):
+    mocker.patch("app.fastpath.get_cache", new_callable=AsyncMock, side_effect=ValueError("bad entry"))
+
+    await call(RedirectFastPath(downstream), make_scope("/abc123"))
+
+    assert downstream.calls == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "scope",
+    [
+        make_scope("/abc123", method="POST"),
+        make_scope("/links/abc123/stats"),
+        make_scope("/"),
+        {"type": "websocket", "path": "/abc123"},
+    ],
+)
+async def test_other_requests_skip_fast_path(mocker, downstream, scope):
+    mock_get_cache = mocker.patch("app.fastpath.get_cache", new_callable=AsyncMock)
+
+    await call(RedirectFastPath(downstream), scope)
+
+    mock_get_cache.assert_not_called()
+    assert downstream.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_static_routes_are_reserved(mocker):
+    from main import app
+
+    mock_get_cache = mocker.patch("app.fastpath.get_cache", new_callable=AsyncMock)
+    downstream = DummyApp()
+
+    await call(RedirectFastPath(downstream), make_scope("/docs", app=app))
+
+    mock_get_cache.assert_not_called()
+    assert downstream.calls == 1
@@ -12,15 +12,15 @@ from handlers import (
     update_short_link,
     redirect_link,
     generate_short_code,
-    update_stats_cache,
     get_expired_links,
     link_stats,
     delete_short_link,
     search_link_by_url,
     ShortenLinkRequest,
-    RedirectResponse
+    RedirectResponse,
+    click_queue,
 )
-from fastapi import HTTPException, BackgroundTasks
+from fastapi import HTTPException, Response
 import asyncio
 import uuid
 
@@ -32,23 +32,18 @@ def test_generate_short_code():
 
 
 @pytest.mark.asyncio
-async def test_update_stats_cache(mocker):
-    mock_set_cache = mocker.patch("handlers.set_cache", new_callable=AsyncMock)
-
-    key = "abc123"
-    click_count = 5
-    last_accessed_at = "2024-03-31T12:00:00"
+async def test_redirect_link_queues_click(mocker):
+    mock_get_cache = mocker.patch("handlers.get_cache", new_callable=AsyncMock)
+    mock_get_cache.return_value = {"original_url": "https://example.com", "expires_at": None}
+    mock_submit = mocker.patch.object(click_queue, "submit", new_callable=AsyncMock)
+    session = AsyncMock()
 
-    await update_stats_cache(key, click_count, last_accessed_at)
+    response = await redirect_link("abc123", request=MagicMock(), session=session)
 
-    mock_set_cache.assert_called_once_with(
-        "stats:abc123",
-        {
-            "click_count": 5,
-            "last_accessed_at": last_accessed_at,
-        },
-        expire=300,
-    )
+    assert response.status_code == 307
+    short_code, (count, _) = mock_submit.call_args.args
+    assert short_code == "abc123"
+    assert count == 1
 
 
 @pytest.mark.asyncio
@@ -63,6 +58,7 @@ async def test_link_stats_cache_hit(mocker):
 
     mock_get_cache = mocker.patch("handlers.get_cache", new_callable=AsyncMock)
     mock_get_cache.return_value = cached_stats
+    mocker.patch("handlers.get_pending_clicks", new_callable=AsyncMock, return_value=(0, None))
 
     # Мокаем сессию
     session = AsyncMock()
@@ -73,7 +69,9 @@ async def test_link_stats_cache_hit(mocker):
     current_user = MagicMock()
     current_user.id = uuid.uuid4()
 
-    stats = await link_stats(short_code, session=session, current_user=current_user)
+    stats = await link_stats(
+        short_code, request=MagicMock(), response=Response(), session=session, current_user=current_user
+    )
 
     assert stats == cached_stats
     session.execute.assert_not_called()
@@ -85,6 +83,9 @@ def make_fake_result(first_return):
     fake_scalars.first.return_value = first_return
     fake_result = MagicMock()
     fake_result.scalars.return_value = fake_scalars
+    # Запросы по колонкам (app/queries.py) читают строки напрямую: first() / all()
+    fake_result.first.return_value = first_return
+    fake_result.all.return_value = first_return
     return fake_result
 
 
@@ -117,7 +118,6 @@ async def test_shorten_link_random_alias_loop():
 @pytest.mark.asyncio
 async def test_redirect_link_not_found(mocker):
      session = AsyncMock()
-     background_tasks = BackgroundTasks()
      # Симулируем, что кэш отсутствует и в базе ничего не найдено
      session.execute.return_value = make_fake_result(None)
 
@@ -127,7 +127,9 @@ async def test_redirect_link_not_found(mocker):
 
      with pytest.raises(HTTPException) as exc:
          await redirect_link(
-             "nonexistent", session=session, background_tasks=background_tasks
+             "nonexistent",
+             request=MagicMock(),
+             session=session,
          )
      assert exc.value.status_code == 404
      assert exc.value.detail == "Short link not found"
@@ -220,7 +222,9 @@ async def test_link_stats_forbidden(mocker):
     current_user.id = uuid.uuid4()
 
     with pytest.raises(HTTPException) as exc:
-        await link_stats("shortcode123", session=session, current_user=current_user)
+        await link_stats(
+            "shortcode123", request=MagicMock(), response=Response(), session=session, current_user=current_user
+        )
 
     assert exc.value.status_code == 403
     assert exc.value.detail == "Not authorized to view this link's stats"
@@ -280,11 +284,12 @@ async def test_search_link_by_url_forbidden():
 @pytest.mark.asyncio
 async def test_redirect_link(mocker):
     session = AsyncMock()
-    background_tasks = BackgroundTasks()
+    mock_submit = mocker.patch.object(click_queue, "submit", new_callable=AsyncMock)
     link = MagicMock()
     link.original_url = "https://example.com"
     link.expires_at = None
     link.click_count = 0
+    link.track_clicks = True
     session.execute.return_value = make_fake_result(link)
 
     # Мокируем Redis get
@@ -292,12 +297,16 @@ async def test_redirect_link(mocker):
     mock_redis_client.get.return_value = None
 
     result = await redirect_link(
-        "valid_short_code", session=session, background_tasks=background_tasks
+        "valid_short_code",
+        request=MagicMock(),
+        session=session,
     )
 
     assert result.status_code == 307
     assert result.headers["Location"] == "https://example.com"
-    assert link.click_count == 1
+    assert result.headers["Cache-Control"] == "no-store"
+    # Переход ставится в очередь и учитывается после ответа
+    mock_submit.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -337,7 +346,7 @@ async def test_redirect_link_from_cache(mocker):
     session = AsyncMock()
     session.execute = AsyncMock()
     session.commit = AsyncMock()
-    background_tasks = BackgroundTasks()
+    mocker.patch.object(click_queue, "submit", new_callable=AsyncMock)
     mock_get_cache = mocker.patch("handlers.get_cache", new_callable=AsyncMock)
     mock_get_cache.return_value = {"original_url": "https://example.com/cached"}
 
@@ -351,8 +360,68 @@ async def test_redirect_link_from_cache(mocker):
     )
 
     response = await redirect_link(
-        "cached_alias", session=session, background_tasks=background_tasks
+        "cached_alias", request=MagicMock(), session=session
     )
     assert isinstance(response, RedirectResponse)
     assert response.headers["location"] == "https://example.com/cached"
-    session.execute.assert_called()
+    session.execute.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_redirect_untracked_link_is_cacheable(mocker):
+    mocker.patch(
+        "handlers.get_cache",
+        new_callable=AsyncMock,
+        return_value={
+            "original_url": "https://example.com",
+            "expires_at": datetime.utcnow() + timedelta(hours=1),
+            "track_clicks": False,
+        },
+    )
+    mock_submit = mocker.patch.object(click_queue, "submit", new_callable=AsyncMock)
+
+    response = await redirect_link("abc123", request=MagicMock(), session=AsyncMock())
+
+    assert response.status_code == 308
+    max_age = int(response.headers["Cache-Control"].split("max-age=")[1])
+    assert 3590 <= max_age <= 3600
+    mock_submit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_link_stats_not_modified(mocker):
+    cached_stats = {
+        "original_url": "http://example.com",
+        "created_at": "2025-03-31",
+        "click_count": 100,
+        "last_accessed_at": "2025-04-01",
+    }
+    mocker.patch("handlers.get_cache", new_callable=AsyncMock, return_value=cached_stats)
+    mocker.patch("handlers.get_pending_clicks", new_callable=AsyncMock, return_value=(0, None))
+    request = MagicMock()
+    request.headers = {}
+    response = MagicMock()
+    response.headers = {}
+
+    stats = await link_stats(
+        "abc123", request=request, response=response, session=AsyncMock(), current_user=MagicMock()
+    )
+
+    assert stats == cached_stats
+    etag = response.headers["ETag"]
+
+    request.headers = {"if-none-match": etag}
+    not_modified = await link_stats(
+        "abc123", request=request, response=Response(), session=AsyncMock(), current_user=MagicMock()
+    )
+    assert not_modified.status_code == 304
+    assert not_modified.headers["etag"] == etag
+
+    # Новый переход меняет ETag
+    mocker.patch(
+        "handlers.get_pending_clicks", new_callable=AsyncMock, return_value=(1, datetime(2025, 4, 2))
+    )
+    stats = await link_stats(
+        "abc123", request=request, response=Response(), session=AsyncMock(), current_user=MagicMock()
+    )
+    assert stats["click_count"] == 101
@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta
+from app.http_cache import etag_matches, redirect_policy, stats_etag
+
+
+def test_tracked_links_are_not_cached():
+    assert redirect_policy(True, None) == (307, "no-store")
+
+
+def test_untracked_link_max_age_follows_expiry():
+    now = datetime(2025, 4, 1, 12, 0)
+
+    assert redirect_policy(False, None, now) == (308, "public, max-age=86400")
+    assert redirect_policy(False, now + timedelta(minutes=10), now) == (308, "public, max-age=600")
+    assert redirect_policy(False, now + timedelta(days=30), now) == (308, "public, max-age=86400")
+
+
+def test_etag_matching():
+    etag = stats_etag({"original_url": "https://example.com", "click_count": 1})
+
+    assert etag.startswith('W/"')
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", {etag.removeprefix("W/")}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert stats_etag({"original_url": "https://example.com", "click_count": 2}) != etag
@@ -0,0 +1,44 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+from main import app
+
+HEADERS = {"X-Internal-Token": "internal-secret"}
+
+
+@pytest.fixture(autouse=True)
+def internal_token(mocker):
+    mocker.patch("internal.INTERNAL_TOKEN", "internal-secret")
+
+
+@pytest.mark.asyncio
+async def test_db_pool_status():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/internal/db-pool", headers=HEADERS)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["pool_class"] == "InstrumentedQueuePool"
+    assert "checked_out" in data
+    assert "overflow" in data
+    assert "+Inf" in data["wait_time"]["buckets"]
+
+
+@pytest.mark.asyncio
+async def test_redis_status():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/internal/redis", headers=HEADERS)
+
+    assert response.status_code == 200
+    [node] = response.json().values()
+    assert node["state"] in ("closed", "open", "half_open")
+
+
+@pytest.mark.asyncio
+async def test_internal_requires_token(mocker):
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        missing = await client.get("/internal/tasks")
+        wrong = await client.get("/internal/tasks", headers={"X-Internal-Token": "guess"})
+        mocker.patch("internal.INTERNAL_TOKEN", "")
+        disabled = await client.get("/internal/tasks", headers={"X-Internal-Token": ""})
+
+    assert (missing.status_code, wrong.status_code, disabled.status_code) == (403, 403, 403)
@@ -0,0 +1,79 @@
+import fakeredis
+import pytest
+from app.invalidation import (
+    invalidate_links,
+    invalidate_stats,
+    link_version,
+    set_cache_if_version,
+    stats_version,
+    stats_version_key,
+)
+from app.redis import get_cache, link_key, set_cache, stats_key
+
+
+@pytest.fixture
+def fake_redis(mocker):
+    client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())
+    mocker.patch("app.redis.redis_client", client)
+    mocker.patch("app.redis.redis_breakers", {})
+    return client
+
+
+@pytest.mark.asyncio
+async def test_invalidate_links_drops_derived_keys(fake_redis):
+    await set_cache(link_key("abc"), {"original_url": "https://example.com"})
+    await set_cache(stats_key("abc"), {"click_count": 1})
+    version = await link_version("abc")
+
+    await invalidate_links("abc", "abc", "new")
+
+    assert await get_cache(link_key("abc")) is None
+    assert await get_cache(stats_key("abc")) is None
+    assert await link_version("abc") != version
+
+
+@pytest.mark.asyncio
+async def test_invalidate_stats_keeps_redirect_cache(fake_redis):
+    await set_cache(link_key("abc"), {"original_url": "https://example.com"})
+    await set_cache(stats_key("abc"), {"click_count": 1})
+
+    await invalidate_stats(["abc"])
+
+    assert await get_cache(link_key("abc")) == {"original_url": "https://example.com"}
+    assert await get_cache(stats_key("abc")) is None
+
+
+@pytest.mark.asyncio
+async def test_click_flush_does_not_block_redirect_cache(fake_redis):
+    link_before = await link_version("abc")
+    stats_before = await stats_version("abc")
+    # Переходы перенесены в БД, пока загрузчики читали ссылку
+    await invalidate_stats(["abc"])
+
+    assert await set_cache_if_version(
+        link_key("abc"), {"original_url": "https://example.com"}, "abc", link_before
+    )
+    assert not await set_cache_if_version(
+        stats_key("abc"), {"click_count": 1}, "abc", stats_before, versioned_by=stats_version_key
+    )
+    assert await get_cache(stats_key("abc")) is None
+
+
+@pytest.mark.asyncio
+async def test_stale_loader_does_not_write_back(fake_redis):
+    version = await link_version("abc")
+    # Пока загрузчик читал БД, ссылку изменили
+    await invalidate_links("abc")
+
+    stored = await set_cache_if_version(
+        link_key("abc"), {"original_url": "https://old.example.com"}, "abc", version
+    )
+
+    assert stored is False
+    assert await get_cache(link_key("abc")) is None
+
+    version = await link_version("abc")
+    assert await set_cache_if_version(
+        link_key("abc"), {"original_url": "https://new.example.com"}, "abc", version
+    )
+    assert await get_cache(link_key("abc")) == {"original_url": "https://new.example.com"}
@@ -0,0 +1,119 @@
+import pytest
+from unittest.mock import AsyncMock
+from app.metrics import CallbackHistogram, CallbackMetric, Counter, Histogram, Registry
+from app.request_metrics import HTTP_REQUEST_SECONDS, RequestMetricsMiddleware
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter_children_are_reused(registry):
+    counter = Counter("requests_total", "Requests", ("family",), registry=registry)
+
+    child = counter.labels("link")
+    child.inc()
+    counter.labels("link").inc(2)
+
+    assert counter.labels("link") is child
+    assert 'requests_total{family="link"} 3' in registry.render()
+
+
+def test_wrong_label_count(registry):
+    counter = Counter("requests_total", "Requests", ("family",), registry=registry)
+
+    with pytest.raises(ValueError):
+        counter.labels("link", "hit")
+
+
+def test_duplicate_metric_name(registry):
+    Counter("requests_total", "Requests", registry=registry)
+
+    with pytest.raises(ValueError):
+        Counter("requests_total", "Requests", registry=registry)
+
+
+def test_histogram_exposition(registry):
+    histogram = Histogram("duration_seconds", "Duration", ("route",), buckets=(0.1, 1.0), registry=registry)
+
+    histogram.labels("/a").observe(0.05)
+    histogram.labels("/a").observe(0.5)
+    histogram.labels("/a").observe(5)
+
+    text = registry.render()
+    assert "# TYPE duration_seconds histogram" in text
+    assert 'duration_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'duration_seconds_bucket{route="/a",le="1.0"} 2' in text
+    assert 'duration_seconds_bucket{route="/a",le="+Inf"} 3' in text
+    assert 'duration_seconds_count{route="/a"} 3' in text
+    assert 'duration_seconds_sum{route="/a"} 5.55' in text
+
+
+def test_callback_metrics_read_state_on_render(registry):
+    state = {"depth": 1}
+    CallbackMetric("queue_depth", "Depth", "gauge", ("queue",), lambda: [(("clicks",), state["depth"])], registry=registry)
+    CallbackHistogram(
+        "pool_wait_seconds", "Wait", ("engine",),
+        lambda: [(("primary",), {"buckets": {"0.1": 2, "+Inf": 3}, "count": 3, "sum": 1.5})],
+        registry=registry,
+    )
+
+    state["depth"] = 7
+    text = registry.render()
+
+    assert 'queue_depth{queue="clicks"} 7' in text
+    assert 'pool_wait_seconds_bucket{engine="primary",le="0.1"} 2' in text
+    assert 'pool_wait_seconds_count{engine="primary"} 3' in text
+
+
+def test_label_values_are_escaped(registry):
+    Counter("errors_total", "Errors", ("reason",), registry=registry).labels('bad "value"').inc()
+
+    assert 'errors_total{reason="bad \\"value\\""} 1' in registry.render()
+
+
+@pytest.mark.asyncio
+async def test_request_middleware_labels_by_route_and_status():
+    class Route:
+        path = "/links/{short_code}"
+
+    async def downstream(scope, receive, send):
+        scope["route"] = Route()
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+
+    middleware = RequestMetricsMiddleware(downstream)
+    scope = {"type": "http", "method": "PUT", "path": "/links/abc", "app": None}
+    child = HTTP_REQUEST_SECONDS.labels("/links/{short_code}", "PUT", "4xx")
+    before = child.count
+
+    await middleware(scope, AsyncMock(), AsyncMock())
+
+    assert child.count == before + 1
+    assert middleware._children["/links/{short_code}"]["PUT"][3] is child
+
+
+@pytest.mark.asyncio
+async def test_request_middleware_counts_failures_as_5xx():
+    middleware = RequestMetricsMiddleware(AsyncMock(side_effect=RuntimeError("boom")))
+    scope = {"type": "http", "method": "POST", "path": "/links/shorten", "app": None}
+    child = HTTP_REQUEST_SECONDS.labels("unmatched", "POST", "5xx")
+    before = child.count
+
+    with pytest.raises(RuntimeError):
+        await middleware(scope, AsyncMock(), AsyncMock())
+
+    assert child.count == before + 1
+
+
+@pytest.mark.asyncio
+async def test_request_middleware_folds_unknown_methods():
+    middleware = RequestMetricsMiddleware(AsyncMock())
+    child = HTTP_REQUEST_SECONDS.labels("unmatched", "other", "5xx")
+    before = child.count
+
+    for method in ("PROPFIND", "X-RANDOM-1", "get"):
+        await middleware({"type": "http", "method": method, "path": "/", "app": None}, AsyncMock(), AsyncMock())
+
+    assert child.count == before + 3
+    assert list(middleware._children["unmatched"]) == ["other"]
@@ -0,0 +1,123 @@
+import asyncio
+import time
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from httpx import AsyncClient, ASGITransport
+from app.profiling import (
+    AWAITING,
+    Profile,
+    ProfileStore,
+    ProfilingMiddleware,
+    frame_label,
+    profile_store,
+    sign_profile_token,
+    verify_profile_token,
+)
+from config import PROFILE_HEADER
+from main import app
+
+
+def test_profile_token_signature_and_expiry():
+    token = sign_profile_token(60, secret="secret", now=1000)
+
+    assert verify_profile_token(token, secret="secret", now=1000)
+    assert not verify_profile_token(token, secret="other", now=1000)
+    assert not verify_profile_token(token, secret="secret", now=1061)
+    assert not verify_profile_token("garbage", secret="secret", now=1000)
+
+
+def test_store_keeps_last_profiles():
+    store = ProfileStore(size=2)
+    profiles = [Profile("GET", f"/{number}", "sampled", 0.001) for number in range(3)]
+    for profile in profiles:
+        store.add(profile)
+
+    assert [summary["path"] for summary in store.list()] == ["/2", "/1"]
+    assert store.get(profiles[0].id) is None
+    assert store.get(profiles[2].id) is profiles[2]
+
+
+def busy_handler(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+async def downstream(scope, receive, send):
+    busy_handler(0.05)
+    await asyncio.sleep(0.05)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def make_scope(headers=()):
+    return {"type": "http", "method": "GET", "path": "/abc123", "headers": list(headers)}
+
+
+@pytest.mark.asyncio
+async def test_signed_request_is_profiled():
+    store = ProfileStore()
+    middleware = ProfilingMiddleware(downstream, store=store, interval=0.002)
+    token = sign_profile_token(60).encode()
+
+    await middleware(make_scope([(b"x-profile-token", token)]), AsyncMock(), AsyncMock())
+
+    [summary] = store.list()
+    assert summary["reason"] == "header"
+    assert summary["status"] == 200
+    assert summary["duration_ms"] >= 100
+    folded = store.get(summary["id"]).folded()
+    assert "busy_handler" in folded
+    assert AWAITING in folded
+    stack, count = folded.splitlines()[0].rsplit(" ", 1)
+    assert int(count) > 0
+
+
+@pytest.mark.asyncio
+async def test_unsigned_request_is_not_profiled():
+    store = ProfileStore()
+    called = AsyncMock()
+    middleware = ProfilingMiddleware(called, store=store, sample_rate=0)
+
+    await middleware(make_scope([(b"x-profile-token", b"1.bad")]), AsyncMock(), AsyncMock())
+
+    called.assert_called_once()
+    assert store.list() == []
+
+
+@pytest.mark.asyncio
+async def test_sampled_requests_are_profiled():
+    store = ProfileStore()
+    middleware = ProfilingMiddleware(AsyncMock(), store=store, sample_rate=1.0)
+
+    await middleware(make_scope(), AsyncMock(), AsyncMock())
+
+    assert store.list()[0]["reason"] == "sampled"
+
+
+def test_frame_label_without_qualname():
+    # В Python 3.10 у объекта кода нет co_qualname
+    code = SimpleNamespace(co_name="handler", co_filename="/app/handlers.py", co_firstlineno=12)
+    assert frame_label(SimpleNamespace(f_code=code)) == "handler (handlers.py:12)"
+
+
+@pytest.mark.asyncio
+async def test_download_profile():
+    profile = Profile("GET", "/abc123", "header", 0.001)
+    profile.stacks["main;handler"] = 3
+    profile_store.add(profile)
+
+    headers = {PROFILE_HEADER: sign_profile_token()}
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        listed = await client.get("/internal/profiles", headers=headers)
+        downloaded = await client.get(f"/internal/profiles/{profile.id}", headers=headers)
+        missing = await client.get("/internal/profiles/0", headers=headers)
+        anonymous = await client.get(f"/internal/profiles/{profile.id}")
+        forged = await client.get("/internal/profiles", headers={PROFILE_HEADER: "9999999999.forged"})
+
+    assert anonymous.status_code == 403
+    assert forged.status_code == 403
+    assert listed.json()[0]["id"] == profile.id
+    assert downloaded.text == "main;handler 3\n"
+    assert missing.status_code == 404
@@ -0,0 +1,74 @@
+import uuid
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app.models import Base, Link, LinkHistory
+from app.queries import (
+    fetch_expired_links,
+    fetch_link_stats,
+    fetch_links_by_url,
+    fetch_redirect_target,
+    short_code_exists,
+)
+
+USER_ID = uuid.uuid4()
+
+
+@pytest_asyncio.fixture
+async def session():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        session.add_all(
+            [
+                Link(short_code="abc", original_url="https://example.com", user_id=USER_ID, click_count=7),
+                Link(short_code="def", original_url="https://example.com", user_id=uuid.uuid4()),
+                LinkHistory(
+                    short_code="old",
+                    original_url="https://old.com",
+                    expires_at=datetime.utcnow() - timedelta(days=1),
+                    click_count=3,
+                    user_id=USER_ID,
+                ),
+            ]
+        )
+        await session.commit()
+        yield session
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_fetch_redirect_target(session):
+    row = await fetch_redirect_target(session, "abc")
+    assert row.original_url == "https://example.com"
+    assert row.expires_at is not None
+    assert await fetch_redirect_target(session, "missing") is None
+    # Строки не попадают в identity map сессии
+    assert len(session.identity_map) == 0
+
+
+@pytest.mark.asyncio
+async def test_fetch_link_stats(session):
+    row = await fetch_link_stats(session, "abc")
+    assert row.click_count == 7
+    assert row.user_id == USER_ID
+
+
+@pytest.mark.asyncio
+async def test_fetch_links_by_url(session):
+    rows = await fetch_links_by_url(session, "https://example.com")
+    assert sorted(row.short_code for row in rows) == ["abc", "def"]
+
+
+@pytest.mark.asyncio
+async def test_fetch_expired_links(session):
+    rows = await fetch_expired_links(session, USER_ID)
+    assert [(row.short_code, row.click_count) for row in rows] == [("old", 3)]
+
+
+@pytest.mark.asyncio
+async def test_short_code_exists(session):
+    assert await short_code_exists(session, "abc")
+    assert not await short_code_exists(session, "zzz")
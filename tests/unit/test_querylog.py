@@ -0,0 +1,73 @@
+import logging
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.querylog import (
+    QUERY_BUDGET_EXCEEDED,
+    QueryLog,
+    assert_max_queries,
+    capture_queries,
+    check_query_budget,
+    fingerprint,
+)
+
+
+def test_fingerprint_hides_values():
+    assert fingerprint("SELECT * FROM links WHERE short_code = 'abc' AND click_count > 10") == (
+        "SELECT * FROM links WHERE short_code = ? AND click_count > ?"
+    )
+    assert fingerprint("SELECT links.url\n  FROM links WHERE links.short_code = $1::VARCHAR") == (
+        "SELECT links.url FROM links WHERE links.short_code = ?::VARCHAR"
+    )
+    assert fingerprint("DELETE FROM links WHERE id IN (?, ?, ?)") == "DELETE FROM links WHERE id IN (?)"
+    assert fingerprint("SELECT anon_1.id FROM t WHERE a = %(a_1)s") == "SELECT anon_1.id FROM t WHERE a = ?"
+
+
+def test_budget_exceeded_is_logged_with_repeated_queries(caplog, mocker):
+    mocker.patch.dict("app.querylog.QUERY_BUDGETS", {"shorten_link": 2})
+    log = QueryLog()
+    for _ in range(3):
+        log.add("SELECT links.short_code FROM links WHERE links.short_code = ?", 0.001)
+    counter = QUERY_BUDGET_EXCEEDED.labels("shorten_link")
+    before = counter.value
+
+    with caplog.at_level(logging.WARNING, logger="app.querylog"):
+        check_query_budget("shorten_link", log)
+
+    assert counter.value == before + 1
+    assert "shorten_link ran 3 queries" in caplog.text
+    assert "3x SELECT links.short_code" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_capture_and_assert_max_queries(caplog):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+
+    with capture_queries() as log:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await conn.execute(text("SELECT 2"))
+
+    assert log.count == 2
+    assert log.repeated() == {"SELECT ?": 2}
+
+    with pytest.raises(AssertionError, match="at most 1 queries, got 2"):
+        with assert_max_queries(1):
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+                await conn.execute(text("SELECT 1"))
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_slow_queries_are_logged(caplog, mocker):
+    mocker.patch("app.querylog.SLOW_QUERY_MS", 0)
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+
+    with caplog.at_level(logging.WARNING, logger="app.querylog"):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 'secret'"))
+    await engine.dispose()
+
+    assert "Slow query in background" in caplog.text
+    assert "secret" not in caplog.text
@@ -0,0 +1,320 @@
+import asyncio
+import json
+import fakeredis
+import pytest
+import redis.asyncio as redis
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock
+from app.redis import (
+    CODECS,
+    CircuitBreaker,
+    MsgpackCodec,
+    client_for,
+    clicks_key,
+    breaker_for,
+    decode_value,
+    delete_cache,
+    direct_key,
+    get_cache,
+    get_pending_clicks,
+    hash_tag,
+    link_key,
+    move_pending_clicks,
+    pop_pending_clicks,
+    record_click,
+    resilient,
+    set_cache,
+    stats_key,
+)
+from app.sharding import HashRing
+
+STATS = {
+    "original_url": "https://example.com/landing?utm_source=newsletter",
+    "created_at": datetime(2025, 3, 31, 12, 30, 15, 123456),
+    "click_count": 42,
+    "last_accessed_at": None,
+}
+
+
+def test_msgpack_roundtrip_keeps_datetimes():
+    codec = MsgpackCodec()
+    data = codec.encode(STATS)
+
+    assert data[0] == codec.version
+    assert decode_value(data) == STATS
+
+
+def test_msgpack_aware_datetime():
+    value = {"expires_at": datetime(2025, 4, 1, tzinfo=timezone.utc)}
+    assert decode_value(MsgpackCodec().encode(value)) == value
+
+
+def test_msgpack_is_smaller_than_json():
+    assert len(CODECS["msgpack"].encode(STATS)) < len(CODECS["json"].encode(STATS))
+
+
+def test_legacy_json_entries_are_readable():
+    """Записи, сохранённые до перехода на msgpack, по-прежнему читаются"""
+    legacy = json.dumps(
+        {
+            "original_url": "https://example.com",
+            "created_at": "2025-03-31T12:30:15",
+            "last_accessed_at": None,
+        }
+    ).encode()
+
+    value = decode_value(legacy)
+    assert value["created_at"] == datetime(2025, 3, 31, 12, 30, 15)
+    assert value["last_accessed_at"] is None
+
+
+def test_json_codec_writes_legacy_format():
+    data = CODECS["json"].encode(STATS)
+    assert json.loads(data)["created_at"] == "2025-03-31T12:30:15.123456"
+    assert decode_value(data) == STATS
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("codec_name, first_byte", [("json", ord("{")), ("msgpack", MsgpackCodec.version)])
+async def test_set_and_get_cache(mocker, codec_name, first_byte):
+    mocker.patch("app.redis.cache_codec", CODECS[codec_name])
+    storage = {}
+    mock_redis_client = mocker.patch("app.redis.redis_client", new_callable=AsyncMock)
+    mock_redis_client.set.side_effect = lambda key, value, ex: storage.__setitem__(key, value)
+    mock_redis_client.get.side_effect = lambda key: storage.get(key)
+
+    await set_cache("stats:abc", dict(STATS), expire=300)
+
+    assert storage["stats:abc"][0] == first_byte
+    assert await get_cache("stats:abc") == STATS
+    assert await get_cache("stats:missing") is None
+
+
+class FaultyRedis:
+    """Redis в памяти, который по команде отказывает или отвечает по таймауту."""
+
+    def __init__(self):
+        self.storage = {}
+        self.mode = None
+        self.calls = 0
+
+    async def _fault(self):
+        self.calls += 1
+        if self.mode == "down":
+            raise redis.ConnectionError("Connection refused")
+        if self.mode == "slow":
+            await asyncio.sleep(0.01)
+            raise redis.TimeoutError("Timeout reading from socket")
+
+    async def get(self, key):
+        await self._fault()
+        return self.storage.get(key)
+
+    async def set(self, key, value, ex=None):
+        await self._fault()
+        self.storage[key] = value
+
+    async def delete(self, *keys):
+        await self._fault()
+        for key in keys:
+            self.storage.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        raise redis.ConnectionError("Connection refused")
+
+
+@pytest.fixture
+def faulty_redis(mocker):
+    client = FaultyRedis()
+    mocker.patch("app.redis.redis_client", client)
+    return client
+
+
+@pytest.fixture
+def breaker(faulty_redis, mocker):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    mocker.patch("app.redis.redis_breakers", {faulty_redis: breaker})
+    return breaker
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["down", "slow"])
+async def test_cache_errors_are_not_raised(faulty_redis, breaker, mode):
+    faulty_redis.mode = mode
+
+    await set_cache("link:abc", {"original_url": "https://example.com"})
+    await delete_cache("link:abc")
+    assert await get_cache("link:abc") is None
+    assert breaker.failures == 3
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_after_failures(faulty_redis, breaker):
+    faulty_redis.mode = "down"
+    for _ in range(3):
+        assert await get_cache("link:abc") is None
+
+    assert breaker.state == CircuitBreaker.OPEN
+    # Открытый выключатель не пускает вызовы к Redis
+    assert await get_cache("link:abc") is None
+    assert faulty_redis.calls == 3
+    assert breaker.status()["short_circuited"] == 1
+    assert breaker.status()["opened_total"] == 1
+
+
+@pytest.mark.asyncio
+async def test_breaker_closes_after_successful_probe(faulty_redis, breaker):
+    faulty_redis.mode = "down"
+    for _ in range(3):
+        await get_cache("link:abc")
+
+    breaker.reset_timeout = 0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    faulty_redis.mode = None
+    await set_cache("link:abc", {"original_url": "https://example.com"})
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert await get_cache("link:abc") == {"original_url": "https://example.com"}
+
+
+@pytest.mark.asyncio
+async def test_breaker_reopens_after_failed_probe(faulty_redis, breaker):
+    faulty_redis.mode = "down"
+    for _ in range(3):
+        await get_cache("link:abc")
+
+    breaker.reset_timeout = 0
+    await get_cache("link:abc")
+    breaker.reset_timeout = 60
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.status()["opened_total"] == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_is_released(faulty_redis, breaker):
+    faulty_redis.mode = "down"
+    for _ in range(3):
+        await get_cache("link:abc")
+    breaker.reset_timeout = 0
+
+    @resilient(node=direct_key)
+    async def cancelled_call(key):
+        raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled_call("link:abc")
+    # Отмена не оставляет выключатель в ожидании пробного вызова
+    assert not breaker.probing
+    faulty_redis.mode = None
+    await set_cache("link:abc", {"original_url": "https://example.com"})
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_record_click_reports_failure(faulty_redis, breaker):
+    assert await record_click("abc", "2025-04-01T12:00:00") is False
+
+
+def test_hash_tag():
+    assert hash_tag("link:{abc}") == "abc"
+    assert hash_tag("clicks:{abc}") == "abc"
+    assert hash_tag("link:{}abc") == "link:{}abc"
+    assert hash_tag("plain") == "plain"
+
+
+@pytest.fixture
+def redis_nodes(mocker):
+    clients = [fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer()) for _ in range(3)]
+    mocker.patch("app.redis.redis_node_clients", clients)
+    mocker.patch("app.redis.redis_ring", HashRing(range(len(clients))))
+    mocker.patch("app.redis.redis_breakers", {})
+    return clients
+
+
+def test_link_keys_are_colocated(redis_nodes):
+    for short_code in ("abc", "def", "xyz123"):
+        node = client_for(link_key(short_code))
+        assert client_for(stats_key(short_code)) is node
+        assert client_for(clicks_key(short_code)) is node
+
+
+@pytest.mark.asyncio
+async def test_cache_keys_across_nodes(redis_nodes):
+    codes = [f"code{i}" for i in range(20)]
+    for code in codes:
+        await set_cache(link_key(code), {"original_url": f"https://example.com/{code}"})
+
+    # Ключи действительно разошлись по нескольким узлам
+    sizes = [await client.dbsize() for client in redis_nodes]
+    assert sum(1 for size in sizes if size) > 1
+    assert sum(sizes) == 20
+
+    assert await get_cache(link_key("code7")) == {"original_url": "https://example.com/code7"}
+    for code in codes:
+        await delete_cache(link_key(code))
+    assert [await client.dbsize() for client in redis_nodes] == [0, 0, 0]
+
+
+@pytest.mark.asyncio
+async def test_breaker_is_per_node(redis_nodes, mocker):
+    codes = [f"code{i}" for i in range(20)]
+    for code in codes:
+        await set_cache(link_key(code), {"original_url": f"https://example.com/{code}"})
+    broken = client_for(link_key("code0"))
+    mocker.patch.object(broken, "get", side_effect=redis.ConnectionError("Connection refused"))
+
+    for _ in range(5):
+        assert await get_cache(link_key("code0")) is None
+
+    assert breaker_for(broken).state == CircuitBreaker.OPEN
+    healthy = [code for code in codes if client_for(link_key(code)) is not broken]
+    for code in healthy:
+        assert await get_cache(link_key(code)) == {"original_url": f"https://example.com/{code}"}
+    assert all(breaker_for(client).state == CircuitBreaker.CLOSED for client in redis_nodes if client is not broken)
+
+
+@pytest.mark.asyncio
+async def test_pending_clicks_across_nodes(redis_nodes):
+    codes = [f"code{i}" for i in range(10)]
+    for code in codes:
+        await record_click(code, "2025-04-01T12:00:00")
+    await record_click("code0", "2025-04-01T12:05:00")
+
+    pending = await pop_pending_clicks(100)
+
+    assert set(pending) == set(codes)
+    assert pending["code0"] == (2, datetime(2025, 4, 1, 12, 5))
+    assert await pop_pending_clicks(100) == {}
+
+
+@pytest.mark.asyncio
+async def test_pop_pending_clicks_keeps_healthy_nodes(redis_nodes, mocker):
+    codes = [f"code{i}" for i in range(10)]
+    for code in codes:
+        await record_click(code, "2025-04-01T12:00:00")
+    broken = client_for(clicks_key("code0"))
+    mocker.patch.object(broken, "spop", side_effect=redis.ConnectionError("Connection refused"))
+
+    pending = await pop_pending_clicks(100)
+
+    broken_codes = {code for code in codes if client_for(clicks_key(code)) is broken}
+    assert set(pending) == set(codes) - broken_codes
+    # Переходы недоступного узла остаются в нём до следующего сброса
+    assert await get_pending_clicks("code0") == (1, datetime(2025, 4, 1, 12, 0))
+
+
+@pytest.mark.asyncio
+async def test_move_pending_clicks_between_nodes(redis_nodes):
+    old_code = "code0"
+    new_code = next(
+        f"new{i}" for i in range(100)
+        if client_for(clicks_key(f"new{i}")) is not client_for(clicks_key(old_code))
+    )
+    await record_click(old_code, "2025-04-01T12:00:00")
+
+    await move_pending_clicks(old_code, new_code)
+
+    assert await get_pending_clicks(old_code) == (0, None)
+    assert await get_pending_clicks(new_code) == (1, datetime(2025, 4, 1, 12, 0))
+    assert set(await pop_pending_clicks(100)) == {new_code}
@@ -0,0 +1,159 @@
+import fakeredis
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.requests import Request
+from app import database
+from app.database import get_read_session, remember_write
+from app.export import export_session_makers
+from app.replicas import ReplicaRouter
+
+
+def make_request(authorization=None):
+    headers = []
+    if authorization:
+        headers.append((b"authorization", authorization.encode()))
+    return Request(
+        {"type": "http", "method": "GET", "path": "/", "headers": headers, "client": ("10.0.0.1", 1234)}
+    )
+
+
+async def make_database(path, name):
+    """Отдельная SQLite-база вместо реплики, в которой записано её имя"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE TABLE node (name TEXT)"))
+        await conn.execute(text("INSERT INTO node VALUES (:name)"), {"name": name})
+    return engine
+
+
+async def node_name(session):
+    return (await session.execute(text("SELECT name FROM node"))).scalar()
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(mocker):
+    client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())
+    mocker.patch("app.redis.redis_client", client)
+    mocker.patch("app.redis.redis_breakers", {})
+    return client
+
+
+@pytest_asyncio.fixture
+async def databases(tmp_path):
+    primary = await make_database(tmp_path / "primary.db", "primary")
+    replica = await make_database(tmp_path / "replica.db", "replica")
+    yield primary, replica
+    await primary.dispose()
+    await replica.dispose()
+
+
+async def read_from(router, primary, request, mocker):
+    mocker.patch.object(database, "replica_router", router)
+    async with async_sessionmaker(primary)() as primary_session:
+        dependency = get_read_session(request, primary_session)
+        session = await anext(dependency)
+        name = await node_name(session)
+        await dependency.aclose()
+    return name
+
+
+@pytest.mark.asyncio
+async def test_read_session_without_replicas_uses_primary(databases, mocker):
+    primary, _ = databases
+    assert await read_from(None, primary, make_request(), mocker) == "primary"
+
+
+@pytest.mark.asyncio
+async def test_read_session_routes_to_replica(databases, mocker):
+    primary, replica = databases
+    router = ReplicaRouter([replica])
+
+    assert await read_from(router, primary, make_request(), mocker) == "replica"
+    assert router.replicas[0].in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_read_your_writes_sticks_to_primary(databases, mocker):
+    primary, replica = databases
+    router = ReplicaRouter([replica], read_your_writes_window=60)
+    router.remember_write("Bearer token")
+
+    assert await read_from(router, primary, make_request("Bearer token"), mocker) == "primary"
+    assert await read_from(router, primary, make_request("Bearer other"), mocker) == "replica"
+
+
+@pytest.mark.asyncio
+async def test_read_your_writes_shared_between_workers(databases, mocker):
+    primary, replica = databases
+    writer = ReplicaRouter([replica], read_your_writes_window=60)
+    mocker.patch.object(database, "replica_router", writer)
+    await remember_write(make_request("Bearer token"))
+
+    # У другого воркера свой роутер без локальной метки, она приходит из Redis
+    reader = ReplicaRouter([replica], read_your_writes_window=60)
+    assert await read_from(reader, primary, make_request("Bearer token"), mocker) == "primary"
+    assert await read_from(reader, primary, make_request("Bearer other"), mocker) == "replica"
+
+
+@pytest.mark.asyncio
+async def test_export_session_makers_follow_read_your_writes(databases, mocker):
+    primary, replica = databases
+    router = ReplicaRouter([replica], read_your_writes_window=60)
+    mocker.patch.object(database, "replica_router", router)
+    mocker.patch("app.export.replica_router", router)
+    mocker.patch("app.export.async_session_maker", async_sessionmaker(primary))
+
+    [session_maker] = await export_session_makers(make_request("Bearer token"))
+    async with session_maker() as session:
+        assert await node_name(session) == "replica"
+        assert router.replicas[0].in_flight == 1
+    assert router.replicas[0].in_flight == 0
+
+    await remember_write(make_request("Bearer token"))
+    [session_maker] = await export_session_makers(make_request("Bearer token"))
+    async with session_maker() as session:
+        assert await node_name(session) == "primary"
+
+
+@pytest.mark.asyncio
+async def test_unavailable_replica_falls_back_to_primary(databases, tmp_path, mocker):
+    primary, _ = databases
+    broken = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    router = ReplicaRouter([broken])
+
+    assert await read_from(router, primary, make_request(), mocker) == "primary"
+    assert router.replicas[0].available is False
+    assert router.choose() is None
+
+
+@pytest.mark.asyncio
+async def test_lagging_replica_is_skipped(databases, mocker):
+    _, replica = databases
+    router = ReplicaRouter([replica], max_lag=1)
+    mocker.patch.object(router, "measure_lag", return_value=30.0)
+
+    await router.check_replicas()
+    assert router.choose() is None
+
+    mocker.patch.object(router, "measure_lag", return_value=0.2)
+    await router.check_replicas()
+    assert router.choose() is router.replicas[0]
+
+
+@pytest.mark.asyncio
+async def test_round_robin_and_least_busy(databases):
+    primary, replica = databases
+    router = ReplicaRouter([primary, replica])
+    first, second = router.replicas
+    assert [router.choose(), router.choose(), router.choose()] == [first, second, first]
+
+    router = ReplicaRouter([primary, replica], strategy="least_busy")
+    router.replicas[0].in_flight = 3
+    assert router.choose() is router.replicas[1]
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        ReplicaRouter([], strategy="random")
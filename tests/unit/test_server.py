@@ -0,0 +1,37 @@
+import os
+from config import split_connection_budget
+from server import main, parse_args
+
+
+def test_split_connection_budget():
+    assert split_connection_budget(96, 16) == (4, 2)
+    assert split_connection_budget(20, 1) == (14, 6)
+    # Процессов больше, чем соединений: каждому остаётся хотя бы одно
+    assert split_connection_budget(4, 16) == (1, 0)
+
+
+def test_parse_args_defaults_to_cpu_count(mocker):
+    mocker.patch.dict(os.environ, {}, clear=False)
+    os.environ.pop("WEB_CONCURRENCY", None)
+    mocker.patch("server.os.cpu_count", return_value=16)
+
+    args = parse_args([])
+
+    assert args.workers == 16
+    # uvicorn сам выбирает uvloop и httptools, если они установлены
+    assert args.loop == "auto"
+    assert args.http == "auto"
+
+
+def test_main_runs_workers(mocker):
+    mocker.patch.dict(os.environ, {}, clear=False)
+    mock_run = mocker.patch("server.uvicorn.run")
+
+    main(["--workers", "4", "--port", "9000"])
+
+    assert os.environ["WEB_CONCURRENCY"] == "4"
+    mock_run.assert_called_once()
+    args, kwargs = mock_run.call_args
+    assert args == ("main:app",)
+    assert kwargs["workers"] == 4
+    assert kwargs["port"] == 9000
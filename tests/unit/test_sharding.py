@@ -0,0 +1,118 @@
+import uuid
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.models import Link, LinkHistory
+from app.reshard import reshard
+from app.sharding import HashRing, ShardRouter
+
+
+def make_engines(tmp_path, names):
+    return [create_async_engine(f"sqlite+aiosqlite:///{tmp_path / name}.db") for name in names]
+
+
+@pytest_asyncio.fixture
+async def engines(tmp_path):
+    engines = make_engines(tmp_path, ["shard0", "shard1", "shard2"])
+    yield engines
+    for engine in engines:
+        await engine.dispose()
+
+
+async def count_links(shard, model=Link):
+    async with shard.session_maker() as session:
+        return await session.scalar(select(func.count()).select_from(model))
+
+
+def test_hash_ring_is_stable_and_moves_few_keys():
+    keys = [f"code{i}" for i in range(2000)]
+    ring = HashRing(["a", "b", "c"])
+    assert [ring.node_for(key) for key in keys] == [HashRing(["a", "b", "c"]).node_for(key) for key in keys]
+
+    bigger = HashRing(["a", "b", "c", "d"])
+    moved = sum(ring.node_for(key) != bigger.node_for(key) for key in keys)
+    # При добавлении четвёртого узла переезжает примерно четверть ключей
+    assert 0.1 < moved / len(keys) < 0.4
+    assert all(bigger.node_for(key) == "d" for key in keys if ring.node_for(key) != bigger.node_for(key))
+
+
+def test_empty_hash_ring():
+    with pytest.raises(LookupError):
+        HashRing([]).node_for("abc")
+
+
+@pytest.mark.asyncio
+async def test_gather_merges_results_from_all_shards(engines):
+    router = ShardRouter(engines)
+    await router.create_tables()
+    codes = [f"code{i}" for i in range(30)]
+    for code in codes:
+        async with router.session_for(code) as session:
+            session.add(Link(short_code=code, original_url="https://example.com"))
+            await session.commit()
+
+    assert sum([await count_links(shard) for shard in router.shards.values()]) == 30
+    assert all([await count_links(shard) for shard in router.shards.values()])
+
+    async def all_codes(session):
+        return (await session.execute(select(Link.short_code))).scalars().all()
+
+    assert sorted(await router.gather(all_codes)) == sorted(codes)
+
+
+@pytest.mark.asyncio
+async def test_reshard_moves_links_to_new_ring(engines):
+    user_id = uuid.uuid4()
+    old_router = ShardRouter(engines[:2])
+    await old_router.create_tables()
+    codes = [f"code{i}" for i in range(60)]
+    for code in codes:
+        async with old_router.session_for(code) as session:
+            session.add(Link(short_code=code, original_url="https://example.com", user_id=user_id))
+            session.add(
+                LinkHistory(
+                    short_code=code,
+                    original_url="https://example.com",
+                    expires_at=datetime.utcnow() - timedelta(days=1),
+                    user_id=user_id,
+                )
+            )
+            await session.commit()
+
+    router = ShardRouter(engines, previous_engines=engines[:2])
+    await router.create_tables()
+    moved = await reshard(router, batch_size=7)
+
+    assert sum(moved.values()) > 0
+    for code in codes:
+        shard = router.shard_for(code)
+        async with shard.session_maker() as session:
+            assert await session.get(Link, code) is not None
+            history = await session.scalar(
+                select(func.count()).select_from(LinkHistory).where(LinkHistory.short_code == code)
+            )
+            assert history == 1
+    assert sum([await count_links(shard) for shard in router.shards.values()]) == 60
+
+    # Повторный запуск ничего не переносит
+    assert await reshard(router) == {}
+
+
+@pytest.mark.asyncio
+async def test_locate_falls_back_to_previous_shard_during_migration(engines):
+    old_router = ShardRouter(engines[:1])
+    await old_router.create_tables()
+    router = ShardRouter(engines, previous_engines=engines[:1])
+    await router.create_tables()
+
+    code = next(f"code{i}" for i in range(100) if router.shard_for(f"code{i}").engine is not engines[0])
+    async with old_router.session_for(code) as session:
+        session.add(Link(short_code=code, original_url="https://example.com"))
+        await session.commit()
+
+    located = await router.locate(code)
+    assert located.engine is engines[0]
+    async with router.session_for(code) as session:
+        assert await session.get(Link, code) is not None
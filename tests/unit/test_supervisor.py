@@ -0,0 +1,111 @@
+import asyncio
+import pytest
+from app.supervisor import TaskSupervisor
+
+
+@pytest.mark.asyncio
+async def test_shutdown_waits_for_tasks_and_cancels_services():
+    supervisor = TaskSupervisor()
+    done = []
+
+    async def job():
+        await asyncio.sleep(0.01)
+        done.append("job")
+
+    async def service():
+        while True:
+            await asyncio.sleep(1)
+
+    supervisor.spawn(job(), name="job")
+    service_task = supervisor.spawn(service(), name="service", service=True)
+    assert supervisor.status() == {"accepting": True, "tasks": 1, "services": ["service"], "restarts": {}}
+
+    await supervisor.shutdown(timeout=1)
+
+    assert done == ["job"]
+    assert service_task.cancelled()
+    assert supervisor.status()["tasks"] == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_service_is_restarted_with_backoff():
+    supervisor = TaskSupervisor(restart_delay=0.01, restart_max_delay=0.02)
+    runs = []
+
+    async def flaky():
+        runs.append(asyncio.get_running_loop().time())
+        if len(runs) < 4:
+            raise RuntimeError("db is down")
+        await asyncio.sleep(10)
+
+    task = supervisor.spawn(flaky, name="flaky", service=True)
+    for _ in range(100):
+        if len(runs) == 4:
+            break
+        await asyncio.sleep(0.01)
+
+    assert len(runs) == 4
+    assert supervisor.status()["restarts"] == {"flaky": 3}
+    assert not task.done()
+    # Пауза растёт, но не больше restart_max_delay
+    assert runs[2] - runs[1] >= 0.02
+    await supervisor.shutdown(timeout=1)
+    assert task.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_no_tasks_accepted_after_shutdown():
+    supervisor = TaskSupervisor()
+    await supervisor.shutdown(timeout=1)
+
+    with pytest.raises(RuntimeError):
+        supervisor.spawn(asyncio.sleep(0))
+
+
+@pytest.mark.asyncio
+async def test_hooks_run_in_order_within_deadline():
+    supervisor = TaskSupervisor()
+    calls = []
+
+    async def slow_task():
+        await asyncio.sleep(10)
+
+    async def drain():
+        calls.append("drain")
+
+    async def slow_drain():
+        await asyncio.sleep(10)
+
+    async def close():
+        calls.append("close")
+
+    task = supervisor.spawn(slow_task())
+    supervisor.on_drain(slow_drain)
+    supervisor.on_drain(drain)
+    supervisor.on_close(close)
+
+    await supervisor.shutdown(timeout=0.05)
+
+    # Задача не уложилась в дедлайн и отменена, сброс буферов пропущен,
+    # но соединения всё равно закрываются
+    assert task.cancelled()
+    assert calls == ["close"]
+
+
+@pytest.mark.asyncio
+async def test_drain_failure_does_not_skip_close():
+    supervisor = TaskSupervisor()
+    calls = []
+
+    async def broken_drain():
+        raise RuntimeError("redis is down")
+
+    async def close():
+        calls.append("close")
+
+    supervisor.on_drain(broken_drain)
+    supervisor.on_close(close)
+
+    await supervisor.shutdown(timeout=1)
+
+    assert calls == ["close"]
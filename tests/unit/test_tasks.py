@@ -1,7 +1,15 @@
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import datetime, timedelta
-from app.tasks import delete_expired_links, periodic_task
+from app.tasks import (
+    acquire_background_lock,
+    background_jobs_task,
+    count_clicks,
+    merge_clicks,
+    delete_expired_links,
+    flush_click_counters,
+    periodic_task,
+)
 from app.models import Link, LinkHistory
 import asyncio
 
@@ -26,6 +34,7 @@ async def test_delete_expired_links(mocker):
 
     mock_session.add = AsyncMock()
     mock_session.commit = AsyncMock()
+    mock_invalidate = mocker.patch("app.tasks.invalidate_links", new_callable=AsyncMock)
 
     await delete_expired_links(mock_session)
 
@@ -38,3 +47,183 @@ async def test_delete_expired_links(mocker):
     assert link_history.click_count == 10
 
     mock_session.commit.assert_called_once()
+    mock_invalidate.assert_called_once_with("abc123")
+
+
+def make_session_maker(session):
+    session_maker = MagicMock()
+    session_maker.return_value.__aenter__.return_value = session
+    return session_maker
+
+
+@pytest.mark.asyncio
+async def test_flush_click_counters(mocker):
+    last_accessed_at = datetime(2025, 4, 1, 12, 0)
+    mocker.patch(
+        "app.tasks.pop_pending_clicks",
+        new_callable=AsyncMock,
+        return_value={"abc123": (3, last_accessed_at)},
+    )
+    mock_invalidate_stats = mocker.patch("app.tasks.invalidate_stats", new_callable=AsyncMock)
+    mock_session = AsyncMock()
+    mocker.patch("app.tasks.async_session_maker", make_session_maker(mock_session))
+
+    assert await flush_click_counters() == 1
+
+    mock_session.execute.assert_called_once()
+    mock_session.commit.assert_called_once()
+    # Кэш статистики сбрасывается, чтобы не показывать устаревший click_count
+    mock_invalidate_stats.assert_called_once_with(["abc123"])
+
+
+@pytest.mark.asyncio
+async def test_flush_click_counters_restores_on_failure(mocker):
+    pending = {"abc123": (3, datetime(2025, 4, 1, 12, 0))}
+    mocker.patch("app.tasks.pop_pending_clicks", new_callable=AsyncMock, return_value=pending)
+    mock_restore = mocker.patch("app.tasks.restore_pending_clicks", new_callable=AsyncMock)
+    mocker.patch("app.tasks.invalidate_stats", new_callable=AsyncMock)
+    mock_session = AsyncMock()
+    mock_session.commit.side_effect = RuntimeError("db is down")
+    mocker.patch("app.tasks.async_session_maker", make_session_maker(mock_session))
+
+    with pytest.raises(RuntimeError):
+        await flush_click_counters()
+
+    mock_restore.assert_called_once_with(pending)
+
+
+@pytest.mark.asyncio
+async def test_flush_click_counters_restores_on_cancel(mocker):
+    pending = {"abc123": (3, datetime(2025, 4, 1, 12, 0))}
+    mocker.patch("app.tasks.pop_pending_clicks", new_callable=AsyncMock, return_value=pending)
+    mock_restore = mocker.patch("app.tasks.restore_pending_clicks", new_callable=AsyncMock)
+    mocker.patch("app.tasks.invalidate_stats", new_callable=AsyncMock)
+    mock_session = AsyncMock()
+    mock_session.commit.side_effect = asyncio.CancelledError()
+    mocker.patch("app.tasks.async_session_maker", make_session_maker(mock_session))
+
+    with pytest.raises(asyncio.CancelledError):
+        await flush_click_counters()
+
+    mock_restore.assert_called_once_with(pending)
+
+
+@pytest.mark.asyncio
+async def test_flush_click_counters_keeps_clicks_when_restore_fails(mocker):
+    last_accessed_at = datetime(2025, 4, 1, 12, 0)
+    mock_pop = mocker.patch(
+        "app.tasks.pop_pending_clicks", new_callable=AsyncMock, return_value={"abc123": (3, last_accessed_at)}
+    )
+    mocker.patch("app.tasks.restore_pending_clicks", new_callable=AsyncMock, side_effect=ConnectionError())
+    mocker.patch("app.tasks.invalidate_stats", new_callable=AsyncMock)
+    unflushed = mocker.patch("app.tasks.unflushed_clicks", {})
+    mock_session = AsyncMock()
+    mock_session.commit.side_effect = [RuntimeError("db is down"), None]
+    mocker.patch("app.tasks.async_session_maker", make_session_maker(mock_session))
+
+    with pytest.raises(RuntimeError):
+        await flush_click_counters()
+    assert unflushed == {"abc123": (3, last_accessed_at)}
+
+    # Следующий сброс записывает сохранённые в памяти переходы вместе с новыми
+    mock_pop.return_value = {"abc123": (2, datetime(2025, 4, 1, 12, 5))}
+    assert await flush_click_counters() == 1
+    params = mock_session.execute.call_args.args[0].compile().params
+    assert 5 in params.values()
+    assert datetime(2025, 4, 1, 12, 5) in params.values()
+    assert unflushed == {}
+
+
+@pytest.mark.asyncio
+async def test_flush_click_counters_nothing_pending(mocker):
+    mocker.patch("app.tasks.pop_pending_clicks", new_callable=AsyncMock, return_value={})
+    assert await flush_click_counters() == 0
+
+
+@pytest.mark.asyncio
+async def test_count_clicks_buffers_in_redis(mocker):
+    mocker.patch("app.tasks.record_clicks", new_callable=AsyncMock, return_value=True)
+    session_maker = make_session_maker(AsyncMock())
+    mocker.patch("app.tasks.async_session_maker", session_maker)
+
+    await count_clicks({"abc123": (1, datetime(2025, 4, 1, 12, 0))})
+
+    session_maker.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_count_clicks_falls_back_to_db(mocker):
+    mocker.patch("app.tasks.record_clicks", new_callable=AsyncMock, return_value=False)
+    mock_session = AsyncMock()
+    mocker.patch("app.tasks.async_session_maker", make_session_maker(mock_session))
+
+    await count_clicks({"abc123": (1, datetime(2025, 4, 1, 12, 0)), "def456": (2, datetime(2025, 4, 1))})
+
+    assert mock_session.execute.call_count == 2
+    mock_session.commit.assert_called_once()
+
+
+def test_merge_clicks():
+    first = (1, datetime(2025, 4, 1, 12, 0))
+    second = (2, datetime(2025, 4, 1, 12, 5))
+    assert merge_clicks(first, second) == (3, datetime(2025, 4, 1, 12, 5))
+    assert merge_clicks(second, first) == (3, datetime(2025, 4, 1, 12, 5))
+
+
+def test_background_lock_is_taken_once(mocker, tmp_path):
+    lock_path = str(tmp_path / "background.lock")
+    mocker.patch("app.tasks._background_lock", None)
+
+    assert acquire_background_lock(lock_path) is True
+    assert acquire_background_lock(lock_path) is True
+
+    # Другой процесс (здесь — другой открытый файл) блокировку не получит
+    import app.tasks
+
+    held = app.tasks._background_lock
+    mocker.patch("app.tasks._background_lock", None)
+    assert acquire_background_lock(lock_path) is False
+    held.close()
+
+
+class StopLoop(Exception):
+    pass
+
+
+@pytest.mark.asyncio
+async def test_periodic_task_survives_expiry_failure(mocker):
+    mocker.patch("app.tasks.flush_click_counters", new_callable=AsyncMock)
+    mocker.patch("app.tasks.link_session_makers", return_value=[make_session_maker(AsyncMock())] * 2)
+    mock_delete = mocker.patch(
+        "app.tasks.delete_expired_links", new_callable=AsyncMock, side_effect=[RuntimeError("db is down"), 0]
+    )
+    mocker.patch("app.tasks.asyncio.sleep", new_callable=AsyncMock, side_effect=StopLoop)
+
+    with pytest.raises(StopLoop):
+        await periodic_task()
+
+    # Ошибка на одном шарде не останавливает очистку остальных и сам цикл
+    assert mock_delete.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_background_jobs_are_separate_services(mocker):
+    from app.supervisor import TaskSupervisor
+
+    supervisor = TaskSupervisor()
+    mocker.patch("app.tasks.supervisor", supervisor)
+    mocker.patch("app.tasks.acquire_background_lock", return_value=True)
+    mocker.patch("app.tasks.COLD_STORAGE_DIR", "/tmp/cold")
+
+    async def idle():
+        await asyncio.Event().wait()
+
+    for name in ("periodic_task", "click_flush_task", "cold_compaction_task"):
+        idle_job = lambda: idle()
+        idle_job.__name__ = name
+        mocker.patch(f"app.tasks.{name}", idle_job)
+
+    await background_jobs_task()
+
+    assert supervisor.status()["services"] == ["click_flush_task", "cold_compaction_task", "periodic_task"]
+    await supervisor.shutdown(timeout=1)
@@ -0,0 +1,172 @@
+import json
+import pytest
+from unittest.mock import AsyncMock
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from app import querylog  # noqa: F401  # слушатели SQLAlchemy, создающие спаны db.query
+from app.redis import get_cache
+from app.tracing import (
+    NOOP_SPAN,
+    MemoryExporter,
+    NDJSONExporter,
+    Tracer,
+    TracingMiddleware,
+    otlp_payload,
+    parse_traceparent,
+    traced,
+    tracer,
+)
+
+
+@pytest.fixture
+def memory_tracer(mocker):
+    exporter = MemoryExporter()
+    mocker.patch.object(tracer, "exporter", exporter)
+    mocker.patch.object(tracer, "buffer", [])
+    return exporter
+
+
+def test_spans_are_nested():
+    local_tracer = Tracer(MemoryExporter(), sample_rate=1.0)
+
+    with local_tracer.start_trace("root") as root:
+        with local_tracer.span("child") as child:
+            child.set("key", "value")
+
+    finished = {span.name: span for span in local_tracer.buffer}
+    assert finished["child"].parent_id == root.span_id
+    assert finished["child"].trace_id == root.trace_id
+    assert finished["child"].attributes == {"key": "value"}
+    assert finished["root"].end >= finished["child"].end
+
+
+def test_unsampled_trace_is_noop():
+    local_tracer = Tracer(MemoryExporter(), sample_rate=0.0)
+
+    with local_tracer.start_trace("root") as root:
+        assert local_tracer.span("child") is NOOP_SPAN
+
+    assert root is NOOP_SPAN
+    assert local_tracer.buffer == []
+    assert Tracer().start_trace("root", sampled=True) is NOOP_SPAN
+
+
+def test_buffer_is_bounded():
+    local_tracer = Tracer(MemoryExporter(), max_buffer=1)
+
+    for _ in range(3):
+        with local_tracer.start_trace("root", sampled=True):
+            pass
+
+    assert len(local_tracer.buffer) == 1
+    assert local_tracer.dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_ndjson_exporter(tmp_path):
+    local_tracer = Tracer(NDJSONExporter(str(tmp_path / "traces.ndjson")))
+    with local_tracer.start_trace("root", sampled=True, attributes={"http.method": "GET"}):
+        pass
+
+    await local_tracer.flush()
+
+    [line] = (tmp_path / "traces.ndjson").read_text().splitlines()
+    span = json.loads(line)
+    assert span["name"] == "root"
+    assert span["attributes"] == {"http.method": "GET"}
+    assert local_tracer.buffer == []
+
+
+def test_otlp_payload():
+    local_tracer = Tracer(MemoryExporter())
+    with pytest.raises(ValueError):
+        with local_tracer.start_trace("root", sampled=True, attributes={"count": 2}):
+            raise ValueError("boom")
+
+    [span] = otlp_payload(local_tracer.buffer)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert len(span["traceId"]) == 32 and len(span["spanId"]) == 16
+    assert span["attributes"] == [{"key": "count", "value": {"intValue": "2"}}]
+    assert span["status"]["code"] == 2
+
+
+def test_parse_traceparent():
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+
+    assert parse_traceparent(f"00-{trace_id}-{parent_id}-01") == (trace_id, parent_id, True)
+    assert parse_traceparent(f"00-{trace_id}-{parent_id}-03") == (trace_id, parent_id, True)
+    assert parse_traceparent(f"00-{trace_id}-{parent_id}-02") == (trace_id, parent_id, False)
+    assert parse_traceparent(f"00-{trace_id}-{parent_id}-zz") is None
+    assert parse_traceparent(f"ff-{trace_id}-{parent_id}-01") is None
+    assert parse_traceparent("garbage") is None
+
+
+@pytest.mark.asyncio
+async def test_middleware_continues_incoming_trace(memory_tracer):
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+
+    async def downstream(scope, receive, send):
+        with tracer.span("inner"):
+            pass
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    scope = {
+        "type": "http", "method": "GET", "path": "/abc123",
+        "headers": [(b"traceparent", f"00-{trace_id}-{parent_id}-01".encode())],
+    }
+    await TracingMiddleware(downstream, tracer, trust_parent=True)(scope, AsyncMock(), AsyncMock())
+
+    root = next(span for span in tracer.buffer if span.name == "http.request")
+    assert root.trace_id == trace_id
+    assert root.parent_id == parent_id
+    assert root.attributes["http.status_code"] == 200
+    assert {span.name for span in tracer.buffer} == {"http.request", "inner"}
+
+
+@pytest.mark.asyncio
+async def test_middleware_samples_untrusted_parent_locally(memory_tracer, mocker):
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+    scope = {
+        "type": "http", "method": "GET", "path": "/abc123",
+        "headers": [(b"traceparent", f"00-{trace_id}-{parent_id}-01".encode())],
+    }
+    middleware = TracingMiddleware(AsyncMock(), tracer, trust_parent=False)
+
+    mocker.patch.object(tracer, "sample_rate", 0.0)
+    await middleware(scope, AsyncMock(), AsyncMock())
+    assert tracer.buffer == []
+
+    mocker.patch.object(tracer, "sample_rate", 1.0)
+    await middleware(scope, AsyncMock(), AsyncMock())
+    [root] = tracer.buffer
+    assert (root.trace_id, root.parent_id) == (trace_id, parent_id)
+
+
+@pytest.mark.asyncio
+async def test_cache_and_sql_spans(memory_tracer, mocker):
+    client = mocker.Mock()
+    client.get = AsyncMock(return_value=None)
+    mocker.patch("app.redis.client_for", return_value=client)
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+
+    with tracer.start_trace("root", sampled=True):
+        await get_cache("link:{abc}")
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    await engine.dispose()
+
+    spans = {span.name: span for span in tracer.buffer}
+    assert spans["redis.get"].attributes == {"cache.family": "link", "cache.hit": False}
+    assert spans["db.query"].attributes == {"db.statement": "SELECT ?"}
+    assert spans["db.query"].parent_id == spans["root"].span_id
+
+
+@pytest.mark.asyncio
+async def test_traced_job_starts_trace(memory_tracer):
+    @traced("job.test", job=True)
+    async def job():
+        return 42
+
+    assert await job() == 42
+    [span] = tracer.buffer
+    assert span.name == "job.test"
+    assert span.parent_id is None
@@ -0,0 +1,115 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app.models import Base, Link, Url
+from app.urls import UrlCache, copy_urls, inline_urls, main, resolve_url, store_url, url_cache, url_id_for
+
+
+@pytest_asyncio.fixture
+async def session_maker():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    url_cache.clear()
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    url_cache.clear()
+    await engine.dispose()
+
+
+def test_url_id_is_stable_signed_64_bit():
+    url_id = url_id_for("https://example.com/landing?utm_source=mail")
+    assert url_id == url_id_for("https://example.com/landing?utm_source=mail")
+    assert url_id != url_id_for("https://example.com/landing?utm_source=ads")
+    assert -(2 ** 63) <= url_id < 2 ** 63
+
+
+def test_url_cache_evicts_least_recently_used():
+    cache = UrlCache(2)
+    cache.put(1, "a")
+    cache.put(2, "b")
+    assert cache.get(1) == "a"
+    cache.put(3, "c")
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+    assert cache.get(3) == "c"
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+@pytest.mark.asyncio
+async def test_store_url_is_idempotent(session_maker):
+    async with session_maker() as session:
+        first = await store_url(session, "https://example.com/a")
+        second = await store_url(session, "https://example.com/a")
+        await session.commit()
+        assert first == second
+        assert (await session.execute(select(func.count()).select_from(Url))).scalar() == 1
+
+
+@pytest.mark.asyncio
+async def test_store_url_detects_hash_collision(session_maker, mocker):
+    mocker.patch("app.urls.url_id_for", return_value=42)
+    async with session_maker() as session:
+        assert await store_url(session, "https://example.com/first") == 42
+        assert await store_url(session, "https://example.com/second") is None
+        await session.commit()
+        assert (await session.execute(select(Url.url))).scalars().all() == ["https://example.com/first"]
+
+
+@pytest.mark.asyncio
+async def test_resolve_url_reads_through_cache(session_maker):
+    async with session_maker() as session:
+        url_id = await store_url(session, "https://example.com/b")
+        await session.commit()
+
+    assert await resolve_url(None, "https://inline.com", None) == "https://inline.com"
+    url_cache.clear()
+    async with session_maker() as session:
+        assert await resolve_url(session, None, url_id) == "https://example.com/b"
+    # Второй раз адрес берётся из кэша, без сессии
+    assert await resolve_url(None, None, url_id) == "https://example.com/b"
+
+
+@pytest.mark.asyncio
+async def test_copy_urls_between_databases(session_maker):
+    target_engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with target_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    target_maker = async_sessionmaker(target_engine, expire_on_commit=False)
+
+    async with session_maker() as source, target_maker() as target:
+        url_id = await store_url(source, "https://example.com/c")
+        await source.commit()
+        await copy_urls(source, target, [url_id, None])
+        await copy_urls(source, target, [url_id])
+        await target.commit()
+        assert (await target.execute(select(Url.url))).scalars().all() == ["https://example.com/c"]
+    await target_engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_copy_urls_reports_collisions(session_maker):
+    target_engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with target_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    target_maker = async_sessionmaker(target_engine, expire_on_commit=False)
+
+    async with session_maker() as source, target_maker() as target:
+        source.add(Url(id=7, url="https://example.com/source"))
+        target.add(Url(id=7, url="https://example.com/target"))
+        await source.commit()
+        await target.commit()
+        conflicts = await copy_urls(source, target, [7])
+    await target_engine.dispose()
+
+    assert conflicts == {7: "https://example.com/source"}
+    link = Link(short_code="abc", url_id=7)
+    inline_urls([link], conflicts)
+    assert (link.url_id, link.original_url) == (None, "https://example.com/source")
+
+
+@pytest.mark.asyncio
+async def test_clear_original_requires_normalize_urls(mocker):
+    mocker.patch("app.urls.NORMALIZE_URLS", False)
+    with pytest.raises(SystemExit):
+        await main(["--url", "sqlite+aiosqlite:///:memory:", "clear-original"])
@@ -0,0 +1,137 @@
+import asyncio
+import pytest
+from app.supervisor import TaskSupervisor
+from app.workqueue import CoalescingQueue
+
+
+def make_queue(handler=None, **kwargs):
+    batches = []
+
+    async def record(batch):
+        batches.append(batch)
+
+    queue = CoalescingQueue("test", handler or record, merge=lambda old, new: old + new, **kwargs)
+    return queue, batches
+
+
+def test_duplicate_keys_are_coalesced():
+    queue, _ = make_queue()
+
+    queue.put_nowait("abc", 1)
+    queue.put_nowait("abc", 2)
+    queue.put_nowait("def", 1)
+
+    assert dict(queue.pending) == {"abc": 3, "def": 1}
+    assert queue.status()["depth"] == 2
+    assert queue.stats["coalesced"] == 1
+
+
+def test_drop_oldest_policy():
+    queue, _ = make_queue(maxsize=2, policy="drop_oldest")
+
+    for key in ("a", "b", "c"):
+        assert queue.put_nowait(key, 1)
+
+    assert list(queue.pending) == ["b", "c"]
+    assert queue.stats["dropped"] == 1
+
+
+def test_drop_new_policy():
+    queue, _ = make_queue(maxsize=2, policy="drop_new")
+
+    queue.put_nowait("a", 1)
+    queue.put_nowait("b", 1)
+    assert queue.put_nowait("c", 1) is False
+    # Ключ, который уже ждёт в очереди, объединяется даже при полной очереди
+    assert queue.put_nowait("a", 1) is True
+
+    assert dict(queue.pending) == {"a": 2, "b": 1}
+    assert queue.stats["dropped"] == 1
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        make_queue(policy="spill_to_disk")
+
+
+@pytest.mark.asyncio
+async def test_workers_process_batches():
+    queue, batches = make_queue(workers=1, batch_size=2)
+    supervisor = TaskSupervisor()
+    queue.start(supervisor)
+
+    for key in ("a", "b", "c", "a"):
+        await queue.submit(key, 1)
+    for _ in range(50):
+        if queue.stats["processed"] == 3:
+            break
+        await asyncio.sleep(0.01)
+
+    assert batches == [{"a": 2, "b": 1}, {"c": 1}]
+    assert queue.stats["batches"] == 2
+    await supervisor.shutdown(timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_block_policy_waits_for_space():
+    queue, batches = make_queue(workers=1, maxsize=1, policy="block", put_timeout=1)
+    supervisor = TaskSupervisor()
+    queue.start(supervisor)
+
+    await queue.submit("a", 1)
+    assert await queue.submit("b", 1) is True
+    await queue.drain()
+
+    assert {key for batch in batches for key in batch} == {"a", "b"}
+    assert queue.stats["dropped"] == 0
+    await supervisor.shutdown(timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_worker_requeues_batch():
+    started = asyncio.Event()
+    batches = []
+
+    async def slow(batch):
+        if not batches:
+            batches.append(None)
+            started.set()
+            await asyncio.sleep(10)
+        batches.append(batch)
+
+    queue, _ = make_queue(handler=slow, workers=1)
+    supervisor = TaskSupervisor()
+    queue.start(supervisor)
+    await queue.submit("a", 1)
+    await started.wait()
+    await queue.submit("a", 2)
+    await queue.submit("b", 1)
+
+    await supervisor.shutdown(timeout=1)
+    # Пачка, которую обрабатывал отменённый воркер, вернулась в начало очереди
+    assert list(queue.pending.items()) == [("a", 3), ("b", 1)]
+    await queue.drain()
+    assert batches[1:] == [{"a": 3, "b": 1}]
+
+
+@pytest.mark.asyncio
+async def test_submit_without_workers_runs_inline():
+    queue, batches = make_queue()
+
+    await queue.submit("abc", 1)
+
+    assert batches == [{"abc": 1}]
+
+
+@pytest.mark.asyncio
+async def test_handler_failure_is_counted():
+    async def broken(batch):
+        raise RuntimeError("redis is down")
+
+    queue, _ = make_queue(handler=broken)
+    queue.put_nowait("abc", 1)
+
+    await queue.drain()
+
+    assert queue.stats["failures"] == 1
+    assert queue.status()["depth"] == 0